@@ -1,21 +1,82 @@
+import time
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 from app.config import settings
-print("Using database URL:", settings.DATABASE_URL)
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+
+# The engine (and the DB driver import behind it) is created on first use,
+# not at import time, so importing models/routers stays cheap.
+_engine = None
+_factory = sessionmaker(expire_on_commit=False)
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        print("Using database URL:", settings.DATABASE_URL)
+        _engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
+    return _engine
+
+def SessionLocal():
+    return _factory(bind=get_engine())
+
+def __getattr__(name):
+    # keeps `from app.db import engine` working
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(name)
 
 class Base(DeclarativeBase):
     pass
 
 def get_db():
+    from app.metrics import DB_CHECKOUT
     db = SessionLocal()
     try:
+        t0 = time.perf_counter()
+        db.connection()
+        DB_CHECKOUT.observe(time.perf_counter() - t0)
         yield db
     finally:
         db.close()
 
+# Columns added to tables that predate them. create_all() only creates
+# missing tables, so existing databases get these through add_missing_columns().
+ADDED_COLUMNS = (
+    ("analysis_runs", "exec_mode"),
+    ("analysis_runs", "mem_estimate_bytes"),
+    ("analysis_runs", "peak_rss_bytes"),
+    ("analysis_runs", "timings_json"),
+    ("analysis_runs", "batch_id"),
+)
+
+def add_missing_columns(engine) -> None:
+    """
+    ALTER TABLE ... ADD COLUMN for every ADDED_COLUMNS entry the live table
+    lacks, with its foreign key and index (idempotent).
+    """
+    from sqlalchemy import inspect, text
+
+    insp = inspect(engine)
+    tables = set(insp.get_table_names())
+    with engine.begin() as conn:
+        for table, name in ADDED_COLUMNS:
+            if table not in tables:
+                continue
+            if name in {c["name"] for c in insp.get_columns(table)}:
+                continue
+            col = Base.metadata.tables[table].c[name]
+            ddl = f"ALTER TABLE {table} ADD COLUMN {name} {col.type.compile(dialect=engine.dialect)}"
+            for fk in col.foreign_keys:
+                ddl += f" REFERENCES {fk.column.table.name}({fk.column.name})"
+                if fk.ondelete:
+                    ddl += f" ON DELETE {fk.ondelete}"
+            conn.execute(text(ddl))
+            for index in col.table.indexes:
+                if col in index.columns:
+                    index.create(bind=conn, checkfirst=True)
+
 def init_db():
     from app import models
+    engine = get_engine()
     Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
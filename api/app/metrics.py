@@ -0,0 +1,274 @@
+"""
+Minimal in-process metrics registry with Prometheus text exposition.
+Values are per process; scrape each API/worker process separately.
+"""
+from __future__ import annotations
+
+import bisect
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+_lock = threading.Lock()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+RUN_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        k = self._key(labels)
+        with _lock:
+            self._values[k] = self._values.get(k, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return float(self._values.get(self._key(labels), 0.0))
+
+    def render(self) -> List[str]:
+        out = self.header()
+        with _lock:
+            values = list(self._values.items())
+        for k, v in sorted(values):
+            out.append(f"{self.name}{_fmt_labels(self.label_names, k)} {_num(v)}")
+        return out
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with _lock:
+            self._values[self._key(labels)] = float(value)
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        k = self._key(labels)
+        with _lock:
+            st = self._values.get(k)
+            if st is None:
+                st = self._values[k] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            st[0][bisect.bisect_left(self.buckets, value)] += 1
+            st[1] += value
+            st[2] += 1
+
+    def render(self) -> List[str]:
+        out = self.header()
+        with _lock:
+            values = [(k, (list(st[0]), st[1], st[2])) for k, st in self._values.items()]
+        for k, (counts, total, n) in sorted(values):
+            acc = 0
+            for b, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le = 'le="%s"' % _num(b)
+                out.append(f"{self.name}_bucket{_fmt_labels(self.label_names, k, le)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.label_names, k)} {_num(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(self.label_names, k)} {n}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+        self.collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> None:
+        self.metrics.append(metric)
+
+    def add_collector(self, fn: Callable[[], None]) -> None:
+        """fn runs before each scrape to refresh gauges from live objects."""
+        self.collectors.append(fn)
+
+    def render(self) -> str:
+        for fn in self.collectors:
+            try:
+                fn()
+            except Exception:
+                pass
+        lines: List[str] = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ---------- HTTP ----------
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Request latency by route", ("method", "route", "status"))
+HTTP_INFLIGHT = Gauge("http_requests_in_flight", "Requests currently being served", ("method",))
+HTTP_RESPONSE_SIZE = Histogram("http_response_size_bytes", "Response body size by route", ("method", "route"), SIZE_BUCKETS)
+
+# ---------- caches ----------
+CHART_CACHE = Counter("chart_cache_requests_total", "Chart/stats TTL cache lookups", ("result",))
+CHART_CACHE_EVICTIONS = Counter("chart_cache_evictions_total", "Chart/stats TTL cache evictions (size or TTL)")
+CHART_CACHE_SIZE = Gauge("chart_cache_entries", "Entries currently in the chart/stats TTL cache")
+MONGO_CACHE = Counter("mongo_cache_requests_total", "Mongo-backed preview/schema cache lookups", ("kind", "result"))
+RESIDENT_CACHE = Counter("dataset_resident_requests_total", "Resident dataset frame lookups in this process", ("result",))
+RESIDENT_EVICTIONS = Counter("dataset_resident_evictions_total", "Resident dataset frames evicted for space")
+RESIDENT_BYTES = Gauge("dataset_resident_bytes", "Bytes of dataset frames resident in this process")
+
+# ---------- DB pool ----------
+DB_POOL = Gauge("db_pool_connections", "SQLAlchemy pool state", ("state",))
+DB_CHECKOUT = Histogram("db_pool_checkout_seconds", "Time waiting for a pooled DB connection")
+
+# ---------- analytics ----------
+ANALYTICS_QUEUE = Gauge("analytics_runs_active",
+                        "Analytics runs by state (running: in this process; queued: waiting, from the database)",
+                        ("state",))
+ANALYTICS_RUN = Histogram("analytics_run_duration_seconds", "Analytics run wall time", ("recipe_key", "status"), RUN_BUCKETS)
+BATCH_WORKER = Gauge("analytics_batch_worker", "Batch pool workers as last reported (pending runs, resident frames)", ("worker", "field"))
+
+# ---------- storage ----------
+GC_RECLAIMED = Counter("storage_gc_reclaimed_bytes_total", "Bytes removed by storage garbage collection", ("policy",))
+
+
+def _collect_db_pool() -> None:
+    from app.db import get_engine
+
+    pool = get_engine().pool
+    for state, fn in (("checked_out", "checkedout"), ("checked_in", "checkedin"),
+                      ("overflow", "overflow"), ("size", "size")):
+        f = getattr(pool, fn, None)
+        if callable(f):
+            DB_POOL.set(f(), state=state)
+
+
+def _collect_chart_cache() -> None:
+    from app.utils.cache import cache
+
+    CHART_CACHE_SIZE.set(len(cache))
+
+
+def _collect_residency() -> None:
+    # only processes that have loaded datasets have the module (and pandas) imported
+    mod = sys.modules.get("app.services.residency")
+    if mod is not None:
+        RESIDENT_BYTES.set(mod.stats()["bytes"])
+
+
+def _collect_batch_workers() -> None:
+    mod = sys.modules.get("app.services.batch_exec")
+    if mod is None:
+        return
+    for w in mod.workers():
+        for field in ("pending", "hit", "miss", "invalidated", "evicted", "entries", "bytes"):
+            if field in w:
+                BATCH_WORKER.set(w[field], worker=w["worker"], field=field)
+
+
+def _collect_queued_runs() -> None:
+    # queued runs wait in the database (any process may pick them up), so every
+    # process reports the same count
+    from app.db import SessionLocal
+    from app.models import AnalysisRun, RunStatus
+
+    db = SessionLocal()
+    try:
+        n = db.query(AnalysisRun).filter(AnalysisRun.status == RunStatus.queued).count()
+    finally:
+        db.close()
+    ANALYTICS_QUEUE.set(n, state="queued")
+
+
+REGISTRY.add_collector(_collect_db_pool)
+REGISTRY.add_collector(_collect_chart_cache)
+REGISTRY.add_collector(_collect_residency)
+REGISTRY.add_collector(_collect_batch_workers)
+REGISTRY.add_collector(_collect_queued_runs)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: per-route latency, in-flight count and response size."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope.get("method", "")
+        t0 = time.perf_counter()
+        state = {"status": 500, "size": 0}
+        # the route template is only known after routing, so in-flight is per method
+        HTTP_INFLIGHT.inc(method=method)
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["size"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            HTTP_INFLIGHT.dec(method=method)
+            route = _route_template(scope)
+            HTTP_LATENCY.observe(time.perf_counter() - t0, method=method, route=route, status=state["status"])
+            HTTP_RESPONSE_SIZE.observe(state["size"], method=method, route=route)
+
+
+def _route_template(scope) -> str:
+    """Route path template (bounded label cardinality), e.g. /datasets/{dataset_id}/preview."""
+    path = scope.get("path", "")
+    route = scope.get("route")
+    if route is None:
+        return "/files" if path.startswith("/files/") else "unmatched"
+    regex = getattr(route, "path_regex", None)
+    if regex is not None and regex.match(path):
+        return route.path
+    # routers included with a prefix may report their path without it
+    params = {str(v): k for k, v in (scope.get("path_params") or {}).items()}
+    return "/".join("{%s}" % params[seg] if seg in params else seg for seg in path.split("/"))
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -7,6 +7,9 @@ from app.db import Base
 from sqlalchemy.sql import func
 import enum
 
+# BIGINT primary keys don't autoincrement on SQLite (used for local runs/benchmarks)
+BigIntId = BigInteger().with_variant(Integer, "sqlite")
+
 class User(Base):
     __tablename__ = "users"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -67,7 +70,7 @@ class RunStatus(str, enum.Enum):
 
 class AnalysisRecipeTemplate(Base):
     __tablename__ = "analysis_recipe_templates"
-    id = Column(BigInteger, primary_key=True)
+    id = Column(BigIntId, primary_key=True)
     key = Column(String(64), unique=True, nullable=False)
     display_name = Column(String(128), nullable=False)
     description = Column(Text)
@@ -77,9 +80,24 @@ class AnalysisRecipeTemplate(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
+class AnalysisBatch(Base):
+    """One recipe over many datasets; each dataset gets its own AnalysisRun."""
+    __tablename__ = "analysis_batches"
+    id = Column(BigIntId, primary_key=True)
+    user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    recipe_key = Column(String(64), nullable=False)
+    params_json = Column(JSON, nullable=False)
+    status = Column(Enum(RunStatus), nullable=False, default=RunStatus.queued)
+    n_total = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    summary_json = Column(JSON)
+    error_message = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class AnalysisRun(Base):
     __tablename__ = "analysis_runs"
-    id = Column(BigInteger, primary_key=True)
+    id = Column(BigIntId, primary_key=True)
     dataset_id = Column(BigInteger, ForeignKey("datasets.id", ondelete="CASCADE"), nullable=False)
     user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     recipe_key = Column(String(64), nullable=False)
@@ -91,14 +109,35 @@ class AnalysisRun(Base):
     finished_at = Column(DateTime(timezone=True))
     artifacts_json = Column(JSON)
     error_message = Column(Text)
+    exec_mode = Column(String(16))
+    mem_estimate_bytes = Column(BigInteger)
+    peak_rss_bytes = Column(BigInteger)
+    timings_json = Column(JSON)
+    batch_id = Column(BigInteger, ForeignKey("analysis_batches.id", ondelete="CASCADE"), index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     dataset = relationship("Dataset")
     user = relationship("User")
 
+class SavedView(Base):
+    """Named filter set on a dataset, materialized as a row bitmap next to the file."""
+    __tablename__ = "saved_views"
+    id = Column(BigIntId, primary_key=True)
+    dataset_id = Column(Integer, ForeignKey("datasets.id", ondelete="CASCADE"), nullable=False, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    name = Column(String(120), nullable=False)
+    filters_json = Column(JSON, nullable=False, default=list)
+    source_signature = Column(String(64))
+    row_count = Column(BigInteger)
+    total_rows = Column(BigInteger)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (UniqueConstraint("dataset_id", "owner_id", "name", name="uq_saved_view_name"),)
+
 class UserNotebook(Base):
     __tablename__ = "user_notebooks"
-    id = Column(BigInteger, primary_key=True)
+    id = Column(BigIntId, primary_key=True)
     dataset_id = Column(BigInteger, ForeignKey("datasets.id", ondelete="CASCADE"), nullable=False)
     user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     title = Column(String(200), nullable=False)
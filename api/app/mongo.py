@@ -1,4 +1,3 @@
-from pymongo import MongoClient
 from app.config import settings
 
 _client = None
@@ -7,6 +6,7 @@ _db = None
 def get_mongo():
     global _client, _db
     if _client is None:
+        from pymongo import MongoClient
         _client = MongoClient(settings.MONGODB_URI)
         _db = _client[settings.MONGODB_DB]
     return _db
@@ -1,24 +1,25 @@
 from __future__ import annotations
-from fastapi import APIRouter, Depends, HTTPException, Query, Body
+from fastapi import APIRouter, Depends, HTTPException, Query, Body, Request
 from sqlalchemy.orm import Session
 from datetime import datetime
 import os
+import re
 import hashlib
-import pandas as pd
 from typing import Optional
 from fastapi import Response
 from fastapi.responses import StreamingResponse
 import io
-import pandas as pd
-from app.utils.dataread import read_table_any
 from app.db import get_db
 from app.models import Dataset, User
 from app.utils.deps import current_user
 from app.mongo import get_mongo
-from app.utils.dataread import read_table_any, dtype_of, guess_role, scan_any
-from app.utils.filters import apply_filters, apply_filters_pl
 from app.utils.cache import cache, make_key
-import polars as pl
+from app.metrics import MONGO_CACHE
+from app.utils.payloads import FORMAT_PATTERN, Frame, render, wanted_format
+from pathlib import Path
+
+# pandas/polars/pyarrow are imported inside the handlers so that API workers
+# which never serve dataset reads don't pay for them at startup.
 
 def _file_signature(path: str) -> dict:
     try:
@@ -45,18 +46,33 @@ def _cache_key(dataset_id: int, sig: dict, kind: str) -> dict:
 @router.get("/datasets/{dataset_id}/preview")
 def dataset_preview(
     dataset_id: int,
+    request: Request,
     rows: int = Query(50, ge=1, le=200),
+    format: Optional[str] = Query(None, pattern=FORMAT_PATTERN),
     db: Session = Depends(get_db),
     user: User = Depends(current_user),
 ):
+    import pandas as pd
+    from app.utils.dataread import read_table_any
+
     ds = db.query(Dataset).filter(Dataset.id == dataset_id, Dataset.owner_id == user.id).first()
     if not ds:
         raise HTTPException(status_code=404, detail="Dataset not found")
 
     sig = _file_signature(ds.storage_path)
+    fmt = wanted_format(request, format)
+    if fmt != "json":
+        # binary/columnar previews are encoded from the frame's buffers, not from cached rows
+        try:
+            df = read_table_any(ds.storage_path, nrows=rows)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Failed to read file: {e}")
+        return render(Frame.from_pandas(df), fmt, None)
+
     mongo = get_mongo()
     key = _cache_key(dataset_id, sig, "preview")
     cached = mongo.caches.find_one(key, {"_id": 0})
+    MONGO_CACHE.inc(kind="preview", result="hit" if cached else "miss")
     if cached:
         return cached["payload"]
 
@@ -72,66 +88,172 @@ def dataset_preview(
     mongo.caches.update_one(key, {"$set": {"payload": payload, "created_at": datetime.utcnow()}}, upsert=True)
     return payload
 
-@router.get("/datasets/{dataset_id}/schema")
-def dataset_schema(
+@router.get("/datasets/{dataset_id}/table")
+def dataset_table(
     dataset_id: int,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    sort: Optional[str] = None,
+    desc: bool = False,
+    columns: Optional[str] = Query(None, description="Comma-separated columns (default: ids + a window)"),
+    col_offset: int = Query(0, ge=0),
+    col_limit: int = Query(200, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
     db: Session = Depends(get_db),
     user: User = Depends(current_user),
 ):
+    """One page of the dataset table, optionally sorted by a column; for virtualized grids."""
+    from app.services.table_browse import browse
+
     ds = db.query(Dataset).filter(Dataset.id == dataset_id, Dataset.owner_id == user.id).first()
     if not ds:
         raise HTTPException(status_code=404, detail="Dataset not found")
+    _file_signature(ds.storage_path)
 
-    sig = _file_signature(ds.storage_path)
-    mongo = get_mongo()
-    key = _cache_key(dataset_id, sig, "schema")
-    cached = mongo.caches.find_one(key, {"_id": 0})
-    if cached:
-        return cached["payload"]
+    wanted = [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+    try:
+        return browse(ds.storage_path, offset=offset, limit=limit, sort=sort, desc=desc, columns=wanted,
+                      col_offset=col_offset, col_limit=col_limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/datasets/{dataset_id}/genes")
+def dataset_genes(
+    dataset_id: int,
+    ids: str = Query(..., description="Comma-separated gene ids"),
+    db: Session = Depends(get_db),
+    user: User = Depends(current_user),
+):
+    import pandas as pd
+    from app.services.matrix_store import read_genes
+
+    ds = db.query(Dataset).filter(Dataset.id == dataset_id, Dataset.owner_id == user.id).first()
+    if not ds:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    wanted = [g.strip() for g in ids.split(",") if g.strip()]
+    if not wanted:
+        raise HTTPException(status_code=400, detail="No gene ids given")
+    if len(wanted) > 1000:
+        raise HTTPException(status_code=400, detail="Too many gene ids (max 1000)")
 
+    _file_signature(ds.storage_path)
     try:
-        sample = read_table_any(ds.storage_path, nrows=20000)
+        df, missing = read_genes(Path(ds.storage_path), wanted)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to read file: {e}")
 
-    out = []
-    n = len(sample)
-    for col in sample.columns:
-        s = sample[col]
-        if s.dtype == "object":
-            try:
-                s_dt = pd.to_datetime(s, errors="raise", infer_datetime_format=True)
-                s = s_dt
-                sample[col] = s_dt
-            except Exception:
-                pass
-
-        dtype = dtype_of(s)
-        missing = int(s.isna().sum())
-        uniq = int(s.nunique(dropna=True))
-        role = guess_role(s)
-        missing_pct = (missing / n * 100.0) if n else 0.0
-
-        out.append({
-            "name": col,
-            "dtype": dtype,
-            "missing": missing,
-            "missing_pct": round(missing_pct, 2),
-            "unique_count": uniq,
-            "role": role,
-        })
-
-    payload = {"rows": n, "columns": out}
-    mongo.caches.update_one(key, {"$set": {"payload": payload, "created_at": datetime.utcnow()}}, upsert=True)
-    return payload
+    return {
+        "columns": df.columns.tolist(),
+        "rows": df.where(pd.notnull(df), None).values.tolist(),
+        "missing": missing,
+    }
+
+@router.get("/datasets/{dataset_id}/samples")
+def dataset_samples(
+    dataset_id: int,
+    db: Session = Depends(get_db),
+    user: User = Depends(current_user),
+):
+    """Sample metadata parsed at ingest (GEO !Sample_ annotations), one row per matrix column."""
+    import pandas as pd
+    from app.services.sample_meta import load_sample_meta
+
+    ds = db.query(Dataset).filter(Dataset.id == dataset_id, Dataset.owner_id == user.id).first()
+    if not ds:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    meta = load_sample_meta(Path(ds.storage_path))
+    if meta is None:
+        return {"columns": [], "rows": [], "groups": {}}
+    # columns with few distinct values are the ones worth grouping by
+    groups = {
+        c: sorted(meta[c].dropna().astype(str).unique().tolist())
+        for c in meta.columns[1:]
+        if 1 < meta[c].nunique(dropna=True) <= max(2, len(meta) // 2)
+    }
+    return {
+        "columns": meta.columns.tolist(),
+        "rows": meta.astype(object).where(pd.notnull(meta), None).values.tolist(),
+        "groups": groups,
+    }
+
+def _user_gene_index(db: Session, user: User):
+    from app.services.gene_search import load_user_index
+
+    rows = db.query(Dataset.id, Dataset.title, Dataset.storage_path).filter(Dataset.owner_id == user.id).all()
+    paths = {int(r.id): r.storage_path for r in rows}
+    titles = {int(r.id): r.title for r in rows}
+    return load_user_index(user.id, paths), paths, titles
+
+@router.get("/genes/search")
+def search_genes(
+    q: str = Query(..., min_length=1, description="Gene id prefix (case-insensitive)"),
+    limit: int = Query(20, ge=1, le=200),
+    db: Session = Depends(get_db),
+    user: User = Depends(current_user),
+):
+    """Prefix autocomplete over the gene ids of all of the user's datasets."""
+    index, _, titles = _user_gene_index(db, user)
+    matches = index.prefix(q.strip(), limit)
+    for m in matches:
+        m["datasets"] = [{"id": d, "title": titles.get(d)} for d in m["datasets"] if d in titles]
+    return {"q": q, "matches": [m for m in matches if m["datasets"]]}
+
+@router.get("/genes/{gene_id}/expression")
+def gene_expression(
+    gene_id: str,
+    db: Session = Depends(get_db),
+    user: User = Depends(current_user),
+):
+    """One gene's rows in every dataset of the user that has it, without loading any matrix."""
+    from app.services.gene_search import expression
+
+    index, paths, titles = _user_gene_index(db, user)
+    try:
+        found = expression(index, paths, gene_id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to read file: {e}")
+    if not found:
+        raise HTTPException(status_code=404, detail="Gene not found in any dataset")
+    for f in found:
+        f["title"] = titles.get(f["dataset_id"])
+    return {"gene_id": gene_id, "datasets": found}
+
+@router.get("/datasets/{dataset_id}/schema")
+def dataset_schema(
+    dataset_id: int,
+    db: Session = Depends(get_db),
+    user: User = Depends(current_user),
+):
+    """
+    Per-column profile of the whole file (see app.utils.colprofile). Built
+    at ingest and stored next to the file, so this is normally a file read;
+    it is rebuilt here only when the file has changed.
+    """
+    from app.utils.colprofile import load_profile
+
+    ds = db.query(Dataset).filter(Dataset.id == dataset_id, Dataset.owner_id == user.id).first()
+    if not ds:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    try:
+        profile = load_profile(ds.storage_path)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to read file: {e}")
+    return {"rows": profile["rows"], "columns": profile["columns"]}
 @router.get("/datasets/{dataset_id}/download")
 def download_dataset(
     dataset_id: int,
     format: str = "csv",                
     columns: Optional[str] = None,       
+    order: Optional[str] = None,
+    view_id: Optional[int] = None,
     db: Session = Depends(get_db),
     user: User = Depends(current_user),
 ):
+    import pandas as pd
+    from app.utils.dataread import read_table_any
+
     ds = db.query(Dataset).filter(Dataset.id == dataset_id, Dataset.owner_id == user.id).first()
     if not ds:
         raise HTTPException(status_code=404, detail="Dataset not found")
@@ -141,12 +263,23 @@ def download_dataset(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to read file: {e}")
 
+    mask, _ = _view(db, ds, view_id)
+    if mask is not None:
+        if len(mask) != len(df):
+            raise HTTPException(status_code=409, detail="View does not match the dataset rows")
+        df = df[mask]
+
     if columns:
         cols = [c for c in columns.split(",") if c in df.columns]
         if not cols:
             raise HTTPException(status_code=400, detail="No requested columns found")
         df = df[cols]
 
+    if order:
+        # reuse a stored clustering ordering (from a correlation/heatmap run)
+        ordering = _dataset_ordering(ds, order)
+        df = _apply_ordering(df, ordering["order"], ordering["ids"])
+
     title = (ds.title or f"dataset_{dataset_id}").replace(" ", "_")
 
     if format == "csv":
@@ -178,13 +311,80 @@ def download_dataset(
     else:
         raise HTTPException(status_code=400, detail="Unsupported format")
 
+def _view(db: Session, ds: Dataset, view_id):
+    """(row mask, cache token) of a saved view, or (None, None)."""
+    from app.services.view_service import resolve_view
+
+    try:
+        return resolve_view(db, ds, view_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+def _dataset_ordering(ds: Dataset, key: str) -> dict:
+    from app.services.clustering import load_ordering
+
+    ordering = load_ordering(key) if re.fullmatch(r"[0-9a-f]{64}", key or "") else None
+    if ordering is None or ordering.get("dataset_id") != ds.id:
+        raise HTTPException(status_code=404, detail="Ordering not found")
+    return ordering
+
+
+def _apply_ordering(df, order, ids):
+    """
+    Reorder rows (gene orderings) or columns (sample orderings). Unlisted rows
+    go last; unlisted columns (gene_id and other identifiers) stay in front.
+    """
+    ranked = [ids[i] for i in order]
+    if "gene_id" in df.columns and set(ranked) & set(df["gene_id"].astype(str)):
+        pos = {g: i for i, g in enumerate(ranked)}
+        key = df["gene_id"].astype(str).map(pos).fillna(len(pos))
+        return df.iloc[key.argsort(kind="stable").to_numpy()]
+    cols = [str(c) for c in df.columns]
+    placed = [c for c in ranked if c in set(cols)]
+    if not placed:
+        raise HTTPException(status_code=400, detail="Ordering does not match this dataset's rows or columns")
+    rest = [c for c in cols if c not in set(placed)]
+    return df[rest + placed]
+
+
+@router.get("/datasets/{dataset_id}/orderings/{key}")
+def get_ordering(
+    dataset_id: int,
+    key: str,
+    db: Session = Depends(get_db),
+    user: User = Depends(current_user),
+):
+    """A stored clustering ordering: ids in leaf order, plus the linkage when it was exact."""
+    ds = db.query(Dataset).filter(Dataset.id == dataset_id, Dataset.owner_id == user.id).first()
+    if not ds:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    ordering = _dataset_ordering(ds, key)
+    Z = ordering["linkage"]
+    return {
+        "key": key,
+        "method": ordering["method"],
+        "distance": ordering["distance"],
+        "approximate": ordering["approximate"],
+        "ids": [ordering["ids"][i] for i in ordering["order"]],
+        "linkage": Z.tolist() if Z is not None else None,
+    }
+
+
 @router.post("/datasets/{dataset_id}/chart")
 def dataset_chart(
     dataset_id: int,
+    request: Request,
     payload: dict = Body(...),
+    format: Optional[str] = Query(None, pattern=FORMAT_PATTERN),
     db: Session = Depends(get_db),
     user: User = Depends(current_user),
 ):
+    import polars as pl
+    from app.utils.dataread import scan_any
+    from app.utils.filters import apply_filters_pl
+    from app.utils.catindex import load_index, split_filters
+
     ds = (
         db.query(Dataset)
         .filter(Dataset.id == dataset_id, Dataset.owner_id == user.id)
@@ -193,9 +393,12 @@ def dataset_chart(
     if not ds:
         raise HTTPException(404, "Dataset not found")
 
-    key = make_key(dataset_id, payload)
+    fmt = wanted_format(request, format)
+    mask, token = _view(db, ds, payload.get("view_id"))
+    # the file signature keys out results computed before an append rewrote the matrix
+    key = make_key(dataset_id, {**payload, "view_id": token, "sig": _file_signature(ds.storage_path)})
     if key in cache:
-        return cache[key]
+        return _chart_out(cache[key], fmt)
 
     kind = payload.get("kind")
     x = payload.get("x")
@@ -205,9 +408,27 @@ def dataset_chart(
     filters = payload.get("filters", [])
     sample = int(payload.get("sample", 0))
 
+    if kind == "sample_groups":
+        res = _sample_group_chart(ds, payload)
+        cache[key] = res
+        return _chart_out(res, fmt)
+
+    index = load_index(ds.storage_path)
+
+    if kind == "bar" and x and not y and not sample and index is not None and index.has(x):
+        # value counts straight from the categorical bitmaps (view rows and
+        # indexable filters ANDed in); anything else falls through to a scan
+        rows, rest = split_filters(index, filters, mask)
+        if not rest:
+            data = [{"x": str(v), "y": int(n)} for v, n in index.value_counts(x, rows)[:50]]
+            res = {"kind": "bar", "data": data}
+            cache[key] = res
+            return _chart_out(res, fmt)
+
     ldf = scan_any(ds.storage_path)
 
-    ldf = apply_filters_pl(ldf, filters)
+    # saved-view rows and indexed filters are bitmaps; the rest are polars predicates
+    ldf = apply_filters_pl(ldf, filters, index=index, rows=mask)
 
     if sample:
         ldf = ldf.sample(n=sample, shuffle=True, seed=42)
@@ -232,7 +453,7 @@ def dataset_chart(
         if not (minv < maxv):
             out = {"kind": "hist", "edges": [minv, maxv], "counts": [0]}
             cache[key] = out
-            return out
+            return _chart_out(out, fmt)
 
         b = max(5, min(50, bins))
         edges = [minv + (maxv - minv) * i / b for i in range(b + 1)]
@@ -251,7 +472,7 @@ def dataset_chart(
 
         res = {"kind": "hist", "edges": edges, "counts": counts}
         cache[key] = res
-        return res
+        return _chart_out(res, fmt)
 
     if kind == "bar":
         if not x:
@@ -273,7 +494,7 @@ def dataset_chart(
 
         res = {"kind": "bar", "data": data}
         cache[key] = res
-        return res
+        return _chart_out(res, fmt)
 
     if kind == "line":
         if not x or not y:
@@ -298,7 +519,7 @@ def dataset_chart(
         ]
         res = {"kind": "line", "data": data}
         cache[key] = res
-        return res
+        return _chart_out(res, fmt)
 
     if kind == "scatter":
         if not x or not y:
@@ -326,16 +547,76 @@ def dataset_chart(
                 df = df.sample(n=max_pts, seed=42)
             
             
-            data = [
-                {"x": float(x), "y": float(y)} 
-                for x, y in df.rows()
-            ]
-            
-            res = {"kind": "scatter", "data": data}
+            # columns straight from the polars buffers; JSON dicts only for format=json
+            res = Frame({"x": df["x"].to_numpy(), "y": df["y"].to_numpy()}, {"kind": "scatter"})
             cache[key] = res
-            return res
+            return _chart_out(res, fmt)
             
         except Exception as e:
             print(f"Error generating scatter plot: {e}")
             return {"kind": "scatter", "data": [], "error": "Could not generate scatter plot"}
-    raise HTTPException(400, "Unknown chart kind")
\ No newline at end of file
+    raise HTTPException(400, "Unknown chart kind")
+
+
+def _sample_group_chart(ds: Dataset, payload: dict) -> dict:
+    """
+    One gene's values per sample, grouped by a sample-metadata column
+    (payload: gene, by, agg=mean|median|count, sample_filters). Reads the
+    gene's row and joins it against the sample table.
+    """
+    import pandas as pd
+    from app.services.matrix_store import read_genes
+    from app.services.sample_meta import sample_groups, select_samples
+
+    gene, by = payload.get("gene"), payload.get("by")
+    agg = payload.get("agg", "mean")
+    if not gene or not by:
+        raise HTTPException(400, "gene and by are required")
+    if agg not in ("mean", "median", "count"):
+        raise HTTPException(400, "agg must be mean, median or count")
+    path = Path(ds.storage_path)
+    try:
+        groups = sample_groups(path, by)
+        keep = select_samples(path, payload.get("sample_filters"))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    rows, missing = read_genes(path, [gene])
+    if missing or rows.empty:
+        raise HTTPException(404, "Gene not found")
+
+    values = pd.to_numeric(rows.iloc[0].drop(labels=[rows.columns[0]]), errors="coerce")
+    values.index = values.index.astype(str)
+    if keep is not None:
+        values = values[values.index.isin(keep)]
+    joined = pd.DataFrame({"v": values}).join(groups.rename("g"), how="inner").dropna()
+    g = joined.groupby("g")["v"]
+    stat = g.size() if agg == "count" else getattr(g, agg)()
+    n = g.size()
+    data = [{"x": str(k), "y": float(stat[k]), "n": int(n[k])} for k in stat.index]
+    return {"kind": "sample_groups", "gene": gene, "by": by, "agg": agg, "data": data}
+
+
+def _chart_frame(res: dict) -> Frame:
+    """Frame of a JSON chart payload (hist: counts + edges in meta; bar/line: x, y)."""
+    import numpy as np
+
+    meta = {k: v for k, v in res.items() if k not in ("data", "counts")}
+    if "counts" in res:
+        return Frame({"counts": np.asarray(res["counts"], dtype=np.int64)}, meta)
+    data = res.get("data") or []
+    xs = [d["x"] for d in data]
+    x = np.asarray(xs, dtype=np.float64) if all(isinstance(v, (int, float)) for v in xs) else xs
+    return Frame({"x": x, "y": np.asarray([d["y"] for d in data], dtype=np.float64)}, meta)
+
+
+def _chart_legacy(f: Frame) -> dict:
+    x, y = f.columns["x"], f.columns["y"]
+    return {**f.meta, "data": [{"x": a, "y": b} for a, b in zip(list(x), y.tolist())]}
+
+
+def _chart_out(res, fmt: str):
+    if not isinstance(res, Frame):
+        if fmt == "json":
+            return res
+        res = _chart_frame(res)
+    return render(res, fmt, _chart_legacy)
@@ -1,17 +1,26 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Body
 from sqlalchemy.orm import Session
 
 from app.db import get_db
-from app.models import User
-from app.schemas import DatasetCreate, DatasetOut
+from app.models import Dataset, User
+from app.schemas import DatasetCreate, DatasetOut, SavedViewIn, SavedViewOut
 from app.utils.deps import current_user
-from app.services.dataset_service import create_dataset, list_datasets, delete_dataset
 
 router = APIRouter()
 
+ALLOWED_TYPES = {
+    "text/csv",
+    "text/plain",
+    "application/gzip",
+    "application/x-gzip",
+    "application/vnd.ms-excel",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
 @router.get("", response_model=List[DatasetOut])
 def get_my_datasets(db: Session = Depends(get_db), user: User = Depends(current_user)):
+    from app.services.dataset_service import list_datasets
     items = list_datasets(db, user)
     return items
 
@@ -19,26 +28,116 @@ def get_my_datasets(db: Session = Depends(get_db), user: User = Depends(current_
 async def upload_dataset(
     title: str = Form(...),
     description: str | None = Form(None),
+    sample_major: bool | None = Form(None),
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     user: User = Depends(current_user),
 ):
-    allowed = {
-    "text/csv",
-    "text/plain",                     
-    "application/gzip",               
-    "application/x-gzip",             
-    "application/vnd.ms-excel",
-    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    }
-    if file.content_type not in allowed:
+    if file.content_type not in ALLOWED_TYPES:
         raise HTTPException(status_code=400, detail="Unsupported file type")
+    _check_quota(db, user)
 
-    ds = create_dataset(db, user, title=title, description=description, upload=file)
+    from app.services.dataset_service import create_dataset
+
+    ds = create_dataset(db, user, title=title, description=description, upload=file, sample_major=sample_major)
     return ds
 
 @router.delete("/{dataset_id}", status_code=204)
 def remove_dataset(dataset_id: int, db: Session = Depends(get_db), user: User = Depends(current_user)):
+    from app.services.dataset_service import delete_dataset
     ok = delete_dataset(db, user, dataset_id)
     if not ok:
         raise HTTPException(status_code=404, detail="Dataset not found")
+
+
+def _check_quota(db: Session, user: User) -> None:
+    from app.services.storage_gc import check_upload_quota
+    try:
+        check_upload_quota(db, user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+def _own_dataset(db: Session, dataset_id: int, user: User) -> Dataset:
+    ds = db.query(Dataset).filter(Dataset.id == dataset_id, Dataset.owner_id == user.id).first()
+    if not ds:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return ds
+
+
+# ---------- versions ----------
+
+@router.post("/{dataset_id}/append")
+def append_to_dataset(
+    dataset_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    user: User = Depends(current_user),
+):
+    """Add new samples (or new genes) to the dataset as a new version."""
+    if file.content_type not in ALLOWED_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+    from app.services.versions import append_version
+
+    ds = _own_dataset(db, dataset_id, user)
+    _check_quota(db, user)
+    try:
+        version = append_version(db, user, ds, file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"dataset": DatasetOut.model_validate(ds), "version": version}
+
+@router.get("/{dataset_id}/versions")
+def get_versions(dataset_id: int, db: Session = Depends(get_db), user: User = Depends(current_user)):
+    from app.services.versions import list_versions
+    return list_versions(_own_dataset(db, dataset_id, user))
+
+
+# ---------- saved views ----------
+
+@router.get("/{dataset_id}/views", response_model=List[SavedViewOut])
+def get_views(dataset_id: int, db: Session = Depends(get_db), user: User = Depends(current_user)):
+    from app.services.view_service import list_views
+    return list_views(db, _own_dataset(db, dataset_id, user))
+
+@router.post("/{dataset_id}/views", response_model=SavedViewOut)
+def create_view(
+    dataset_id: int,
+    body: SavedViewIn = Body(...),
+    db: Session = Depends(get_db),
+    user: User = Depends(current_user),
+):
+    from app.services.view_service import save_view
+    ds = _own_dataset(db, dataset_id, user)
+    try:
+        return save_view(db, ds, body.name, body.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.put("/{dataset_id}/views/{view_id}", response_model=SavedViewOut)
+def update_view(
+    dataset_id: int,
+    view_id: int,
+    body: SavedViewIn = Body(...),
+    db: Session = Depends(get_db),
+    user: User = Depends(current_user),
+):
+    from app.services.view_service import get_view, save_view
+    ds = _own_dataset(db, dataset_id, user)
+    try:
+        view = get_view(db, ds, view_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    try:
+        return save_view(db, ds, body.name, body.filters, view=view)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/{dataset_id}/views/{view_id}", status_code=204)
+def remove_view(dataset_id: int, view_id: int, db: Session = Depends(get_db), user: User = Depends(current_user)):
+    from app.services.view_service import get_view, delete_view
+    ds = _own_dataset(db, dataset_id, user)
+    try:
+        delete_view(db, ds, get_view(db, ds, view_id))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
@@ -0,0 +1,141 @@
+import mimetypes
+import re
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db import get_db
+from app.models import AnalysisBatch, AnalysisRun, RunStatus, User
+from app.security import decode_access
+from app.services.artifacts import check_key, etag, resolve, variant
+from app.services.storage_gc import is_evicted, touch
+
+router = APIRouter()
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_CHUNK = 256 * 1024
+
+
+def _bearer_user(request: Request, db: Session) -> Optional[User]:
+    auth = request.headers.get("authorization", "")
+    if not auth.startswith("Bearer "):
+        return None
+    try:
+        return db.get(User, int(decode_access(auth[7:]).get("sub")))
+    except Exception:
+        return None
+
+
+def _owner_and_final(db: Session, kind: str, resource_id: int):
+    """(owner user id, finished?) of the run/batch behind an artifact."""
+    model = AnalysisRun if kind == "runs" else AnalysisBatch
+    obj = db.get(model, resource_id)
+    if obj is None:
+        return None, False
+    if kind == "runs":
+        return obj.user_id, obj.status == RunStatus.succeeded
+    return obj.user_id, obj.finished_at is not None
+
+
+def _gone_if_evicted(db: Session, path: str, request: Request, key: Optional[str]) -> None:
+    """410 for a file of a run whose artifacts storage GC evicted (to its owner or key holder)."""
+    parts = path.split("/")
+    if len(parts) < 2 or parts[0] != "runs" or not parts[1].isdigit():
+        return
+    run = db.get(AnalysisRun, int(parts[1]))
+    if run is None or not is_evicted(run):
+        return
+    if check_key("runs", run.id, key) or getattr(_bearer_user(request, db), "id", None) == run.user_id:
+        raise HTTPException(status_code=410, detail=f"Run artifacts were evicted; POST /analytics/runs/{run.id}/rebuild")
+
+
+def _accepted(request: Request) -> set:
+    value = request.headers.get("accept-encoding", "").lower()
+    return {p.split(";")[0].strip() for p in value.split(",") if p.strip()}
+
+
+def _byte_range(header: str, size: int):
+    """(start, end inclusive) of a single-range header; None to send the whole file."""
+    m = _RANGE.match(header.strip())
+    if m is None:
+        return None  # multiple or malformed ranges: a full response is allowed
+    lo, hi = m.groups()
+    if not lo and not hi:
+        return None
+    if not lo:
+        start, end = max(0, size - int(hi)), size - 1
+    else:
+        start, end = int(lo), min(int(hi), size - 1) if hi else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _read(path, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(_CHUNK, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@router.api_route("/files/{path:path}", methods=["GET", "HEAD"])
+def get_file(path: str, request: Request, key: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    A run/batch artifact. Needs the `key` of its URL or the owner's bearer
+    token; sends a strong ETag, immutable caching once the run is done,
+    precompressed variants when accepted and single byte ranges.
+    """
+    try:
+        kind, resource_id, file = resolve(path)
+    except FileNotFoundError:
+        _gone_if_evicted(db, path, request, key)
+        raise HTTPException(status_code=404, detail="File not found")
+    owner_id, final = _owner_and_final(db, kind, resource_id)
+    if not check_key(kind, resource_id, key):
+        user = _bearer_user(request, db)
+        if user is None:
+            raise HTTPException(status_code=401, detail="Missing file key or bearer token")
+        if user.id != owner_id:
+            raise HTTPException(status_code=404, detail="File not found")
+
+    if kind == "runs":
+        touch(resource_id)
+
+    range_header = request.headers.get("range")
+    encoding, body = (None, file) if range_header else variant(file, _accepted(request))
+    st = body.stat()
+    tag = etag(st, encoding)
+    media = mimetypes.guess_type(file.name)[0] or "application/octet-stream"
+    cache = f"private, max-age={settings.FILES_IMMUTABLE_MAX_AGE}, immutable" if final else "private, no-cache"
+    headers = {
+        "ETag": tag,
+        # no-transform: the compression middleware must not re-encode a tagged representation
+        "Cache-Control": f"{cache}, no-transform",
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
+    }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    if tag in {t.strip() for t in request.headers.get("if-none-match", "").split(",")}:
+        return Response(status_code=304, headers=headers)
+
+    status, start, length = 200, 0, st.st_size
+    if range_header and request.headers.get("if-range", tag) == tag:
+        span = _byte_range(range_header, st.st_size)
+        if span is not None:
+            status, start, length = 206, span[0], span[1] - span[0] + 1
+            headers["Content-Range"] = f"bytes {span[0]}-{span[1]}/{st.st_size}"
+    headers["Content-Length"] = str(length)
+
+    if request.method == "HEAD":
+        return Response(status_code=status, headers=headers, media_type=media)
+    return StreamingResponse(_read(body, start, length), status_code=status, headers=headers, media_type=media)
@@ -1,14 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Body
+from fastapi import APIRouter, Depends, HTTPException, Query, Body, Response, BackgroundTasks
 from sqlalchemy.orm import Session
 from app.db import get_db
-from app.models import AnalysisRecipeTemplate, AnalysisRun, RunStatus
-from app.schemas import RecipeTemplateOut, RunParams, RunOut
+from app.models import AnalysisRecipeTemplate, AnalysisRun, AnalysisBatch, RunStatus
+from app.schemas import RecipeTemplateOut, RunParams, RunOut, BatchParams, BatchOut, SweepParams
 from app.utils.deps import current_user
 from app.services.analysis_service import (
     ensure_dataset_access, dataset_fingerprint, make_cache_key, create_run, mark_run_cached
 )
-from app.services.analytics_exec import execute_inline
 from datetime import datetime
+import json
 router = APIRouter()
 
 @router.get("/recipes", response_model=list[RecipeTemplateOut])
@@ -28,6 +28,9 @@ def run_recipe(
     db: Session = Depends(get_db),
     user=Depends(current_user)
 ):
+    """Queue a run and return it; follow it with GET /analytics/runs/{id}/events."""
+    from app.services.run_queue import reservation, submit
+
     ds = ensure_dataset_access(db, dataset_id, user.id)
 
     tpl = db.query(AnalysisRecipeTemplate).filter(AnalysisRecipeTemplate.key == payload.recipe_key).first()
@@ -38,13 +41,30 @@ def run_recipe(
     ck = make_cache_key(payload.recipe_key, payload.params, fp)
     cached = None
     run = create_run(db, dataset=ds, user_id=user.id, recipe_key=payload.recipe_key, params=payload.params, cache_key=ck)
+    submit(run.id, reservation(run, ds))
+    return run
+
+@router.post("/datasets/{dataset_id}/analytics/sweep", response_model=RunOut)
+def run_sweep(
+    dataset_id: int,
+    payload: SweepParams = Body(...),
+    db: Session = Depends(get_db),
+    user=Depends(current_user)
+):
+    """One queued run over a parameter grid; artifacts_json["sweep"]["results"] is keyed by combination."""
+    from app.services.run_queue import reservation, submit
+    from app.services.sweep import expand
+
+    ds = ensure_dataset_access(db, dataset_id, user.id)
+    params = {**payload.params, "grid": payload.grid}
     try:
-        execute_inline(db, run, ds) 
-    except Exception as e:
-        run.status = RunStatus.failed
-        run.error_message = str(e)
-        run.finished_at = datetime.utcnow()
-        db.commit()
+        expand(payload.recipe_key, params)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    ck = make_cache_key(payload.recipe_key, params, dataset_fingerprint(ds))
+    run = create_run(db, dataset=ds, user_id=user.id, recipe_key=payload.recipe_key, params=params, cache_key=ck)
+    submit(run.id, reservation(run, ds))
     return run
 
 @router.get("/analytics/runs/{run_id}", response_model=RunOut)
@@ -53,3 +73,186 @@ def get_run(run_id: int, db: Session = Depends(get_db), user=Depends(current_use
     if not run:
         raise HTTPException(404, "Run not found")
     return run
+
+@router.post("/analytics/runs/{run_id}/rebuild", response_model=RunOut)
+def rebuild_run(run_id: int, db: Session = Depends(get_db), user=Depends(current_user)):
+    """Queue a run whose artifacts were evicted by storage GC again, from its recipe and params."""
+    from app.services.run_events import clear_cancel, publish
+    from app.services.run_queue import reservation, submit
+    from app.services.storage_gc import is_evicted
+
+    run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id, AnalysisRun.user_id == user.id).first()
+    if not run:
+        raise HTTPException(404, "Run not found")
+    if not is_evicted(run):
+        raise HTTPException(409, "Run artifacts are still available")
+    ds = ensure_dataset_access(db, run.dataset_id, user.id)
+    run.status = RunStatus.queued
+    run.cache_key = make_cache_key(run.recipe_key, run.params_json or {}, dataset_fingerprint(ds))
+    run.artifacts_json = None
+    run.error_message = None
+    run.finished_at = None
+    db.commit()
+    clear_cancel(run.id)
+    publish(run.id, status="queued", recipe_key=run.recipe_key, stage=None, percent=None, eta_s=None, error=None)
+    submit(run.id, reservation(run, ds))
+    return run
+
+@router.post("/analytics/runs/{run_id}/cancel", response_model=RunOut)
+def cancel_run(run_id: int, db: Session = Depends(get_db), user=Depends(current_user)):
+    """Ask a queued or running run to stop; a running one stops at its next stage or chunk."""
+    from app.services.run_events import publish, request_cancel
+
+    run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id, AnalysisRun.user_id == user.id).first()
+    if not run:
+        raise HTTPException(404, "Run not found")
+    if run.status not in (RunStatus.queued, RunStatus.running):
+        raise HTTPException(409, f"Run already {run.status.value}")
+    request_cancel(run.id)
+    if run.status == RunStatus.queued:
+        run.status = RunStatus.canceled
+        run.error_message = "Canceled"
+        run.finished_at = datetime.utcnow()
+        db.commit()
+        publish(run.id, status="canceled")
+    return run
+
+@router.get("/analytics/runs/{run_id}/events")
+async def run_events(run_id: int, db: Session = Depends(get_db), user=Depends(current_user)):
+    """
+    Server-Sent Events with the run's live state ({status, stage, percent,
+    eta_s, ...}); the stream ends once the run reaches a terminal status.
+    """
+    import asyncio
+    from fastapi.responses import StreamingResponse
+    from app.services.run_events import TERMINAL, snapshot, subscribe
+
+    run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id, AnalysisRun.user_id == user.id).first()
+    if not run:
+        raise HTTPException(404, "Run not found")
+    # the stored status is read once, here; after that only published events count
+    # (batch workers relay theirs to this process)
+    stored = {"run_id": run.id, "status": run.status.value}
+    first = stored if stored["status"] in TERMINAL else (snapshot(run.id) or stored)
+    db.close()  # the stream itself never reads the database
+
+    def _frame(state: dict) -> str:
+        return f"event: status\ndata: {json.dumps(state, default=str)}\n\n"
+
+    async def stream():
+        with subscribe(run_id) as q:
+            state = first if first["status"] in TERMINAL else (snapshot(run_id) or first)
+            yield _frame(state)
+            while state.get("status") not in TERMINAL:
+                try:
+                    state = await asyncio.wait_for(q.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _frame(state)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _batch_out(db: Session, batch: AnalysisBatch) -> BatchOut:
+    from app.services.batch_exec import progress
+
+    out = BatchOut.model_validate(batch)
+    out.progress = progress(db, batch)
+    return out
+
+def _own_batch(db: Session, batch_id: int, user) -> AnalysisBatch:
+    batch = db.query(AnalysisBatch).filter(AnalysisBatch.id == batch_id, AnalysisBatch.user_id == user.id).first()
+    if not batch:
+        raise HTTPException(404, "Batch not found")
+    return batch
+
+@router.post("/analytics/batches", response_model=BatchOut)
+def create_batch_run(
+    background: BackgroundTasks,
+    payload: BatchParams = Body(...),
+    db: Session = Depends(get_db),
+    user=Depends(current_user),
+):
+    """Queue one recipe over many datasets; poll GET /analytics/batches/{id} for progress."""
+    from app.services.batch_exec import create_batch, run_batch
+
+    tpl = db.query(AnalysisRecipeTemplate).filter(AnalysisRecipeTemplate.key == payload.recipe_key).first()
+    if not tpl:
+        raise HTTPException(400, "Unknown recipe_key")
+    try:
+        batch = create_batch(db, user, payload.recipe_key, payload.params, payload.dataset_ids)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    background.add_task(run_batch, batch.id)
+    return _batch_out(db, batch)
+
+@router.get("/analytics/batches/{batch_id}", response_model=BatchOut)
+def get_batch(batch_id: int, db: Session = Depends(get_db), user=Depends(current_user)):
+    return _batch_out(db, _own_batch(db, batch_id, user))
+
+@router.get("/analytics/batches/{batch_id}/runs", response_model=list[RunOut])
+def get_batch_runs(batch_id: int, db: Session = Depends(get_db), user=Depends(current_user)):
+    batch = _own_batch(db, batch_id, user)
+    return db.query(AnalysisRun).filter(AnalysisRun.batch_id == batch.id).order_by(AnalysisRun.id).all()
+
+@router.get("/analytics/workers")
+def get_workers(user=Depends(current_user)):
+    """
+    Resident-dataset cache stats of this API process and of each batch worker
+    (as of its last finished run). Dataset ids are left out; they span users.
+    """
+    import sys
+    from app.services.batch_exec import workers
+
+    res = sys.modules.get("app.services.residency")
+    api = {k: v for k, v in res.stats().items() if k != "datasets"} if res else None
+    lanes = [{**{k: v for k, v in w.items() if k != "datasets"}, "n_datasets": len(w["datasets"])}
+             for w in workers()]
+    return {"api": api, "workers": lanes}
+
+@router.get("/analytics/runs/{run_id}/tiles/{z}/{x}/{y}")
+def get_heatmap_tile(
+    run_id: int, z: int, x: int, y: int,
+    agg: str = Query("mean", pattern="^(mean|max)$"),
+    format: str = Query("json", pattern="^(json|f16|f32)$"),
+    db: Session = Depends(get_db),
+    user=Depends(current_user),
+):
+    """
+    One tile of a heatmap run's pyramid. format=f32 / f16 return the raw
+    little-endian float32 / float16 cells (row-major, shape in X-Tile-Shape);
+    f16 is refused for pyramids with values outside the float16 range.
+    """
+    import numpy as np
+    from app.services.heatmap_tiles import load_meta, read_tile, tiles_dir
+    from app.services.storage_gc import touch
+
+    run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id, AnalysisRun.user_id == user.id).first()
+    if not run:
+        raise HTTPException(404, "Run not found")
+    if run.recipe_key != "heatmap" or run.status != RunStatus.succeeded:
+        raise HTTPException(400, "Run has no heatmap tiles")
+    try:
+        tile, pos = read_tile(tiles_dir(run.id), z, x, y, agg)
+    except ValueError as e:
+        raise HTTPException(404, str(e))
+    touch(run.id)
+
+    # a run's tiles never change
+    headers = {"Cache-Control": "private, max-age=86400, immutable"}
+    if format in ("f16", "f32"):
+        if format == "f16" and not load_meta(tiles_dir(run.id)).get("fits_f16", True):
+            raise HTTPException(400, "Values exceed the float16 range; request format=f32")
+        headers["X-Tile-Shape"] = ",".join(map(str, tile.shape))
+        headers["X-Tile-Origin"] = f"{pos['row_start']},{pos['col_start']},{pos['step']}"
+        dtype = "<f2" if format == "f16" else "<f4"
+        return Response(tile.astype(dtype).tobytes(), media_type="application/octet-stream", headers=headers)
+
+    vals = np.round(tile.astype(np.float64), 4)
+    rows = [[None if v != v else v for v in row] for row in vals.tolist()]
+    return Response(
+        content=json.dumps({**pos, "values": rows}),
+        media_type="application/json",
+        headers=headers,
+    )
@@ -1,64 +1,118 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request
 from sqlalchemy.orm import Session
 from app.db import get_db
 from app.models import Dataset, User
 from app.utils.deps import current_user
-from app.utils.io_polars import read_table_any
-from app.utils.filters import apply_filters
 from app.utils.cache import cache, make_key
-import polars as pl
-import numpy as np
+from app.utils.payloads import FORMAT_PATTERN, Frame, render, wanted_format
 
 router = APIRouter()
 
+def _view(db: Session, ds: Dataset, body: dict):
+    """(row mask, cache token) for body["view_id"], or (None, None)."""
+    from app.services.view_service import resolve_view
+
+    try:
+        return resolve_view(db, ds, body.get("view_id"))
+    except ValueError as e:
+        raise HTTPException(404, str(e))
+
+def _key(ds: Dataset, kind: str, body: dict, token):
+    """Cache key of a stats result; the file signature changes when an append rewrites the matrix."""
+    from app.services.view_service import file_signature
+
+    try:
+        sig = file_signature(ds.storage_path)
+    except FileNotFoundError:
+        raise HTTPException(404, "File not found on server")
+    return make_key(ds.id, {kind: {**body, "view_id": token}, "sig": sig})
+
+def _read(ds: Dataset, body: dict, mask):
+    """
+    Dataset frame with the view rows and body["filters"] applied;
+    body["sample_filters"] (on the sample metadata) keep only the matching
+    sample columns.
+    """
+    from pathlib import Path
+    from app.utils.io_polars import read_table_any
+    from app.utils.filters import apply_filters
+    from app.utils.catindex import load_index
+    from app.services.sample_meta import load_sample_meta, select_samples
+
+    df = read_table_any(ds.storage_path)
+    if mask is not None and len(mask) != df.height:
+        raise HTTPException(409, "View does not match the dataset rows")
+    try:
+        keep = select_samples(Path(ds.storage_path), body.get("sample_filters"))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if keep is not None:
+        samples = set(load_sample_meta(Path(ds.storage_path))["sample_id"]) - set(keep)
+        df = df.select([c for c in df.columns if c not in samples])
+    return apply_filters(df, body.get("filters"), index=load_index(ds.storage_path), rows=mask)
+
 @router.post("/datasets/{dataset_id}/stats/corr")
 def corr_matrix(dataset_id: int,
+                request: Request,
                 body: dict = Body(...),
+                format: Optional[str] = Query(None, pattern=FORMAT_PATTERN),
                 db: Session = Depends(get_db),
                 user: User = Depends(current_user)):
+    import numpy as np
+    import polars as pl
+
     ds = db.query(Dataset).filter(Dataset.id==dataset_id, Dataset.owner_id==user.id).first()
     if not ds: raise HTTPException(404, "Dataset not found")
 
-    key = make_key(dataset_id, {"corr": body})
-    if key in cache: return cache[key]
+    fmt = wanted_format(request, format)
+    legacy = lambda f: {"cols": f.names, "matrix": [a.tolist() for a in f.columns.values()]}
+    mask, token = _view(db, ds, body)
+    key = _key(ds, "corr", body, token)
+    if key in cache: return render(cache[key], fmt, legacy)
 
-    df = read_table_any(ds.storage_path)
-    df = apply_filters(df, body.get("filters"))
+    df = _read(ds, body, mask)
     cols = body.get("columns")
     if cols: df = df.select([c for c in cols if c in df.columns])
 
     num = df.select([pl.col(c).cast(pl.Float64) for c in df.columns]).drop_nulls()
     if num.width == 0 or num.height == 0:
-        out = {"cols": [], "matrix": []}
-        cache[key] = out; return out
+        out = Frame({})
+        cache[key] = out; return render(out, fmt, legacy)
 
     arr = np.array(num.to_numpy(), dtype=float)
-    mat = np.corrcoef(arr, rowvar=False)
-    out = {"cols": num.columns, "matrix": mat.tolist()}
+    mat = np.atleast_2d(np.corrcoef(arr, rowvar=False))
+    # symmetric, so column i is row i of the JSON matrix
+    out = Frame.from_matrix(num.columns, mat)
     cache[key] = out
-    return out
+    return render(out, fmt, legacy)
 
 @router.post("/datasets/{dataset_id}/stats/pca")
 def pca_scores(dataset_id: int,
+               request: Request,
                body: dict = Body(...),
+               format: Optional[str] = Query(None, pattern=FORMAT_PATTERN),
                db: Session = Depends(get_db),
                user: User = Depends(current_user)):
+    import polars as pl
+
     ds = db.query(Dataset).filter(Dataset.id==dataset_id, Dataset.owner_id==user.id).first()
     if not ds: raise HTTPException(404, "Dataset not found")
 
-    key = make_key(dataset_id, {"pca": body})
-    if key in cache: return cache[key]
+    fmt = wanted_format(request, format)
+    mask, token = _view(db, ds, body)
+    key = _key(ds, "pca", body, token)
+    if key in cache: return render(cache[key], fmt, _pca_legacy)
 
-    df = read_table_any(ds.storage_path)
-    df = apply_filters(df, body.get("filters"))
+    df = _read(ds, body, mask)
     cols = body.get("columns") or []
     if not cols:
         cand = [c for c in df.columns if df[c].dtype in (pl.Float64, pl.Float32, pl.Int64, pl.Int32)]
         cols = cand[:20]
     num = df.select([pl.col(c).cast(pl.Float64) for c in cols]).drop_nulls()
     if num.height < 3 or num.width < 2:
-        out = {"scores": [], "explained": []}
-        cache[key] = out; return out
+        out = Frame({}, {"explained": []})
+        cache[key] = out; return render(out, fmt, _pca_legacy)
 
     import numpy as np
     from sklearn.preprocessing import StandardScaler
@@ -69,7 +123,11 @@ def pca_scores(dataset_id: int,
     k = int(body.get("n_components", 2))
     pca = PCA(n_components=max(2, k)).fit(Z)
     S = pca.transform(Z)
-    scores = [{"pc1": float(a), "pc2": float(b)} for a,b in S[:, :2]]
-    out = {"scores": scores, "explained": pca.explained_variance_ratio_[:2].tolist(), "columns": cols}
+    out = Frame({"pc1": S[:, 0], "pc2": S[:, 1]},
+                {"explained": pca.explained_variance_ratio_[:2].tolist(), "columns": cols})
     cache[key] = out
-    return out
+    return render(out, fmt, _pca_legacy)
+
+def _pca_legacy(f: Frame) -> dict:
+    scores = [{"pc1": a, "pc2": b} for a, b in zip(f.columns["pc1"].tolist(), f.columns["pc2"].tolist())] if f.columns else []
+    return {"scores": scores, **f.meta}
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db import get_db
+from app.models import User
+from app.utils.deps import current_user
+
+router = APIRouter()
+
+@router.get("/storage/usage")
+def storage_usage(db: Session = Depends(get_db), user: User = Depends(current_user)):
+    """Bytes the user holds by kind, against the per-user quota (0 = none)."""
+    from app.services.storage_gc import quota_bytes, user_usage
+
+    return {"usage": user_usage(db, user.id), "quota_bytes": quota_bytes()}
+
+@router.get("/storage/gc")
+def gc_report(user: User = Depends(current_user)):
+    """Report of the last garbage collection pass (admins only)."""
+    from app.services.storage_gc import last_report
+
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admins only")
+    return {"interval_s": settings.GC_INTERVAL_S, "last": last_report()}
+
+@router.post("/storage/gc")
+def gc_now(
+    dry_run: bool = Query(False, description="Report what would be removed without removing it"),
+    user: User = Depends(current_user),
+):
+    """Run a garbage collection pass now (admins only); 409 while another pass runs."""
+    from app.services.storage_gc import locked_pass
+
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admins only")
+    report = locked_pass(dry_run=dry_run)
+    if report is None:
+        raise HTTPException(status_code=409, detail="A garbage collection pass is already running")
+    return report
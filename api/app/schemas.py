@@ -59,4 +59,43 @@ class RunOut(BaseModel):
     cache_hit: bool = False
     artifacts_json: Optional[Dict[str, Any]] = None
     error_message: Optional[str] = None
-    class Config: from_attributes = True
\ No newline at end of file
+    exec_mode: Optional[str] = None
+    mem_estimate_bytes: Optional[int] = None
+    peak_rss_bytes: Optional[int] = None
+    timings_json: Optional[Dict[str, Any]] = None
+    batch_id: Optional[int] = None
+    class Config: from_attributes = True
+
+class SweepParams(BaseModel):
+    recipe_key: Literal["pca", "correlation"]
+    params: Dict[str, Any] = Field(default_factory=dict)
+    grid: Dict[str, list] = Field(min_length=1)
+
+class BatchParams(RunParams):
+    dataset_ids: list[int] = Field(min_length=1)
+
+class BatchOut(BaseModel):
+    id: int
+    recipe_key: str
+    status: str
+    n_total: int
+    progress: Dict[str, int] = Field(default_factory=dict)
+    summary_json: Optional[Dict[str, Any]] = None
+    error_message: Optional[str] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    class Config: from_attributes = True
+class SavedViewIn(BaseModel):
+    name: str = Field(min_length=1, max_length=120)
+    filters: list[Dict[str, Any]] = Field(default_factory=list)
+
+class SavedViewOut(BaseModel):
+    id: int
+    dataset_id: int
+    name: str
+    filters_json: list[Dict[str, Any]]
+    row_count: Optional[int] = None
+    total_rows: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    class Config: from_attributes = True
@@ -5,6 +5,49 @@ from app.models import AnalysisRecipeTemplate
 from app.config import settings
 print("DATABASE_URL ->", settings.DATABASE_URL)
 
+# Inserted by key, so templates added later reach databases seeded before them.
+TEMPLATES = [
+    dict(
+        key="correlation",
+        display_name="Correlation Matrix",
+        description="Pearson/Spearman correlation with heatmap",
+        params_schema={"properties":{
+            "method":{"type":"string","enum":["pearson","spearman"],"default":"spearman"},
+            "max_features":{"type":"integer","default":300},
+            "linkage":{"type":"string","enum":["average","complete","single","ward"],"default":"average"}
+        }},
+    ),
+    dict(
+        key="pca",
+        display_name="PCA",
+        description="Standardize → PCA → scree + scatter",
+        params_schema={"properties":{"n_components":{"type":"integer","default":10}}},
+    ),
+    dict(
+        key="de",
+        display_name="Differential Expression",
+        description="Two-group t-test + BH-FDR",
+        params_schema={"properties":{
+            "group_col":{"type":"string","default":"group"},
+            "groups":{"type":"array","items":{"type":"string"}},
+            "alpha":{"type":"number","default":0.05}
+        }},
+    ),
+    dict(
+        key="heatmap",
+        display_name="Clustered Heatmap",
+        description="Ordered expression heatmap served as zoomable tiles",
+        params_schema={"properties":{
+            "top_genes":{"type":"integer"},
+            "scale":{"type":"string","enum":["row","none"],"default":"row"},
+            "log1p":{"type":"boolean","default":False},
+            "cluster_rows":{"type":"boolean","default":True},
+            "cluster_cols":{"type":"boolean","default":True},
+            "linkage":{"type":"string","enum":["average","complete","single","ward"],"default":"average"}
+        }},
+    ),
+]
+
 
 def main():
     print("Connecting to DB…")
@@ -13,34 +56,11 @@ def main():
         existing = db.query(AnalysisRecipeTemplate).count()
         print(f"analysis_recipe_templates rows before: {existing}")
 
-        if existing == 0:
-            print("Seeding templates…")
-            db.add_all([
-                AnalysisRecipeTemplate(
-                    key="correlation",
-                    display_name="Correlation Matrix",
-                    description="Pearson/Spearman correlation with heatmap",
-                    params_schema={"properties":{
-                        "method":{"type":"string","enum":["pearson","spearman"],"default":"spearman"},
-                        "max_features":{"type":"integer","default":300}
-                    }},
-                ),
-                AnalysisRecipeTemplate(
-                    key="pca",
-                    display_name="PCA",
-                    description="Standardize → PCA → scree + scatter",
-                    params_schema={"properties":{"n_components":{"type":"integer","default":10}}},
-                ),
-                AnalysisRecipeTemplate(
-                    key="de",
-                    display_name="Differential Expression",
-                    description="Two-group t-test + BH-FDR",
-                    params_schema={"properties":{
-                        "group_col":{"type":"string","default":"group"},
-                        "alpha":{"type":"number","default":0.05}
-                    }},
-                ),
-            ])
+        have = {k for (k,) in db.query(AnalysisRecipeTemplate.key)}
+        missing = [t for t in TEMPLATES if t["key"] not in have]
+        if missing:
+            print(f"Seeding templates: {', '.join(t['key'] for t in missing)}")
+            db.add_all([AnalysisRecipeTemplate(**t) for t in missing])
             db.commit()
             print("Seeded analysis_recipe_templates")
         else:
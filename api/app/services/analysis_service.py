@@ -2,6 +2,7 @@ from datetime import datetime
 from hashlib import sha256
 from sqlalchemy.orm import Session
 from app.models import AnalysisRun, AnalysisRecipeTemplate, RunStatus, Dataset
+from app.services.run_events import publish
 
 def ensure_dataset_access(db: Session, dataset_id: int, user_id: int) -> Dataset:
     ds = db.query(Dataset).filter(Dataset.id == dataset_id, Dataset.owner_id == user_id).first()
@@ -23,6 +24,7 @@ def create_run(db: Session, *, dataset: Dataset, user_id: int, recipe_key: str,
         status=RunStatus.queued, cache_key=cache_key
     )
     db.add(run); db.commit(); db.refresh(run)
+    publish(run.id, status="queued", recipe_key=recipe_key)
     return run
 
 def mark_run_cached(db: Session, run: AnalysisRun, artifacts: dict) -> AnalysisRun:
@@ -1,14 +1,26 @@
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-
 from pathlib import Path
 from datetime import datetime
 import pandas as pd, numpy as np
 from sqlalchemy.orm import Session
 from app.models import AnalysisRun, RunStatus, Dataset
 from app.config import settings
-import os, re
+from app.services.matrix_store import is_canonical, plan_orientation, read_oriented
+from app.services.gene_stats import load_gene_stats, variance
+from app.services.analysis_service import dataset_fingerprint
+from app.services.artifacts import precompress, sign
+from app.services.clustering import EXACT_MAX, get_ordering
+from app.services.stage_cache import Stage, StageGraph
+from app.services.sweep import envelope, run_sweep
+from app.services.run_events import RunCanceled, clear_cancel, is_canceled, publish, tick, track
+from app.services.residency import resident
+from app.services.memory_budget import (
+    MemoryBudgetExceeded, choose_mode, CORR_BLOCK, VAR_CHUNK, PCA_BATCH, GRID
+)
+from app.utils.rss import PeakRSS
+from app.utils.profiling import Timeline, SamplingProfiler, span
+from app.metrics import ANALYTICS_QUEUE, ANALYTICS_RUN
+from contextlib import nullcontext
+import gc, os, re, time, warnings
 
 STORAGE_ROOT = Path(settings.STORAGE_DIR)
 UPLOAD_ROOT  = Path(settings.UPLOAD_DIR)
@@ -20,6 +32,13 @@ BASE = settings.PUBLIC_API_BASE.rstrip("/")
 def _log(msg, *args):
     print("[analytics]", msg.format(*args))
 
+def _plt():
+    # imported on first render; selecting the Agg backend is a process-wide switch
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
 def _slug(s: str) -> str:
     try:
         return re.sub(r"[^a-z0-9]+", "-", (s or "").lower()).strip("-")
@@ -105,6 +124,10 @@ def _dataset_path(ds: Dataset) -> Path:
     raise ValueError("Dataset file path not found")
 
 def _load_df(p: Path) -> pd.DataFrame:
+    """The parsed file, kept resident in this process while it is unchanged (read-only)."""
+    return resident(p, "raw", lambda: _parse_df(p))
+
+def _parse_df(p: Path) -> pd.DataFrame:
     compression = "infer" if p.suffix.lower() == ".gz" or str(p).endswith(".txt.gz") else None
     name = p.name
     if name.endswith(".txt.gz"):
@@ -138,138 +161,458 @@ def _outdir(run_id: int) -> Path:
     out.mkdir(parents=True, exist_ok=True)
     return out
 def _u(path: str) -> str:
-    return f"{BASE}{path}"
+    return f"{BASE}{sign(path)}"
+
+def _numeric(p: Path, want: str) -> pd.DataFrame:
+    """
+    Numeric block of the dataset with ids as index, in the wanted orientation
+    ("genes": genes as rows, "samples": samples as rows). Canonical datasets go
+    through the layout planner; anything else is loaded and reshaped here.
+    The result is kept resident in this process (shared, so read-only).
+    """
+    with span("load"):
+        return resident(p, f"numeric:{want}", lambda: _numeric_block(p, want))
+
+def _numeric_block(p: Path, want: str) -> pd.DataFrame:
+    if is_canonical(p):
+        return read_oriented(p, want)
+    df = _load_df(p)
+    num = df.select_dtypes(include=np.number)
+    if "gene_id" in df.columns and df.columns[0].lower() == "gene_id":
+        num.index = df["gene_id"].astype(str)
+    else:
+        num.index = pd.Index([f"gene_{i}" for i in range(len(df))], name="gene_id")
+    return num if want == "genes" else num.T
+
+def _top_variance(p: Path, top_genes: int, log1p: bool) -> pd.DataFrame:
+    """
+    samples x top-N variable genes. Reads the sample-major layout when it
+    exists; otherwise selects on the gene-major matrix and transposes only
+    the kept rows.
+    """
+    if is_canonical(p) and plan_orientation(p, "samples") == "samples":
+        S = _numeric(p, "samples")
+        with span("preprocess"):
+            if log1p:
+                S = np.log1p(S)
+            k = int(min(top_genes, S.shape[1]))
+            keep = S.var(axis=0, skipna=True).nlargest(k).index
+            return S[keep]
+
+    G = _numeric(p, "genes")
+    with span("preprocess"):
+        k = int(min(top_genes, G.shape[0]))
+        stats = load_gene_stats(p) if is_canonical(p) and not log1p else None
+        if stats is not None and len(stats) == G.shape[0]:
+            # per-gene variances kept up to date at ingest/append: no pass over the matrix
+            var = variance(stats)
+            ranked = np.argsort(-np.where(np.isnan(var), -np.inf, var), kind="stable")
+            return G.iloc[ranked[: min(k, int((~np.isnan(var)).sum()))]].T
+        if log1p:
+            G = np.log1p(G)
+        keep = G.var(axis=1, skipna=True).nlargest(k).index
+        return G.loc[keep].T
+
+# ---------- chunked (out-of-core) paths, picked by memory_budget ----------
+
+def _chunked_top_variance(G: pd.DataFrame, k: int, log1p: bool) -> pd.DataFrame:
+    """
+    Same selection as _top_variance on a genes x samples frame, but the
+    variance is computed in row blocks so only the kept rows are ever copied.
+    Returns samples x top-k as float32.
+    """
+    A = G.to_numpy(copy=False)
+    var = np.empty(A.shape[0])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for i in range(0, A.shape[0], VAR_CHUNK):
+            blk = A[i:i + VAR_CHUNK].astype(np.float64)
+            if log1p:
+                blk = np.log1p(blk)
+            var[i:i + VAR_CHUNK] = np.nanvar(blk, axis=1, ddof=1)
+            tick(min(i + VAR_CHUNK, A.shape[0]), A.shape[0])
+    keep = np.argsort(-np.nan_to_num(var, nan=-np.inf), kind="stable")[:k]
+    X = A[keep].astype(np.float32)
+    if log1p:
+        X = np.log1p(X)
+    return pd.DataFrame(X.T, index=G.columns, columns=G.index[keep])
+
+def _corr_chunked(X: pd.DataFrame, method: str, out_csv: Path) -> np.ndarray:
+    """
+    Correlation between the columns of X, written to out_csv in row blocks
+    without holding the k x k matrix. NaNs are mean-imputed (pandas uses
+    pairwise-complete observations instead). Returns a block-averaged
+    grid of at most GRID x GRID cells for the heatmap.
+    """
+    cols = [str(c) for c in X.columns]
+    k = len(cols)
+    Z = np.array(X.rank(axis=0) if method == "spearman" else X, dtype=np.float32)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(Z, axis=0)
+    miss = np.isnan(Z)
+    Z[miss] = np.take(mean, np.nonzero(miss)[1])
+    Z -= mean
+    norm = np.linalg.norm(Z, axis=0)
+    norm[norm == 0] = np.nan
+    Z /= norm
+
+    g = min(k, GRID)
+    bins = (np.arange(k) * g) // k
+    starts = np.searchsorted(bins, np.arange(g))
+    grid = np.zeros((g, g))
+    counts = np.bincount(bins, minlength=g)
+
+    with out_csv.open("w", newline="") as f:
+        pd.DataFrame(columns=cols).to_csv(f)
+        for i in range(0, k, CORR_BLOCK):
+            C = Z[:, i:i + CORR_BLOCK].T @ Z
+            np.clip(C, -1.0, 1.0, out=C)
+            pd.DataFrame(C, index=cols[i:i + CORR_BLOCK], columns=cols).to_csv(f, header=False)
+            np.add.at(grid, bins[i:i + CORR_BLOCK], np.add.reduceat(np.nan_to_num(C), starts, axis=1))
+            tick(min(i + CORR_BLOCK, k), k)
+    return grid / np.outer(counts, counts)
+
+def _pca_chunked(X: np.ndarray, n: int):
+    """Standardize + IncrementalPCA over sample batches; (scores, loadings, evr)."""
+    from sklearn.decomposition import IncrementalPCA
+
+    mean = np.nanmean(X, axis=0)
+    std = np.nanstd(X, axis=0)
+    std[std == 0] = 1.0
+    parts = max(1, X.shape[0] // max(PCA_BATCH, n))
+    batches = np.array_split(np.arange(X.shape[0]), parts)
+
+    ipca = IncrementalPCA(n_components=n)
+    for i, b in enumerate(batches):
+        ipca.partial_fit((X[b] - mean) / std)
+        tick(i + 1, 2 * len(batches))
+    scores = []
+    for i, b in enumerate(batches):
+        scores.append(ipca.transform((X[b] - mean) / std))
+        tick(len(batches) + i + 1, 2 * len(batches))
+    scores = np.vstack(scores)
+    return scores, ipca.components_.T, ipca.explained_variance_ratio_
 
 def execute_inline(db: Session, run: AnalysisRun, ds):
+    t0 = time.perf_counter()
+    status = "failed"
+    ANALYTICS_QUEUE.inc(state="running")
+    try:
+        with track(run.id) as tracker:
+            _execute(db, run, ds, tracker.on_stage)
+        status = "succeeded"
+    except RunCanceled:
+        status = "canceled"
+        _mark_canceled(db, run)
+    except Exception as e:
+        publish(run.id, status="failed", error=str(e))
+        raise
+    finally:
+        ANALYTICS_QUEUE.dec(state="running")
+        ANALYTICS_RUN.observe(time.perf_counter() - t0, recipe_key=run.recipe_key, status=status)
+
+def _mark_canceled(db: Session, run: AnalysisRun):
+    run.status = RunStatus.canceled
+    run.error_message = "Canceled"
+    run.finished_at = datetime.utcnow()
+    db.commit()
+    clear_cancel(run.id)
+    publish(run.id, status="canceled", percent=None, eta_s=None)
+    gc.collect()  # hand the run's intermediates back before the next one starts
+
+def _execute(db: Session, run: AnalysisRun, ds, on_stage=None):
+    if is_canceled(run.id):
+        raise RunCanceled()
     run.status = RunStatus.running
     run.started_at = datetime.utcnow()
     db.commit()
+    publish(run.id, status="running", recipe_key=run.recipe_key)
 
-    p = _dataset_path(ds)
-    df = _load_df(p)
-    outdir = _outdir(run.id)
+    tl = Timeline(on_span=on_stage)
+    want_profile = bool((run.params_json or {}).get("profile")) or settings.ANALYTICS_PROFILE
+    prof = SamplingProfiler() if want_profile else None
+    try:
+        with tl.activate():
+            with span("resolve_path"):
+                p = _dataset_path(ds)
+                outdir = _outdir(run.id)
+
+            params = run.params_json or {}
+            if "grid" in params:
+                params = envelope(run.recipe_key, params)
+            try:
+                exec_mode, estimate = choose_mode(run.recipe_key, params, ds.n_rows, ds.n_cols)
+            except MemoryBudgetExceeded as e:
+                run.exec_mode = "rejected"
+                run.mem_estimate_bytes = e.estimate
+                raise
+            run.exec_mode = exec_mode
+            run.mem_estimate_bytes = estimate
+            _log("run {} recipe={} mode={} estimate={}", run.id, run.recipe_key, exec_mode, estimate)
+
+            rss = PeakRSS()
+            try:
+                with rss, (prof or nullcontext()):
+                    arts = _run_recipe(run, ds, p, outdir, exec_mode)
+            finally:
+                run.peak_rss_bytes = rss.peak
+    finally:
+        run.timings_json = tl.summary()
+
+    if prof is not None:
+        prof.write_folded(outdir / "profile.folded.txt")
+        prof.write_svg(outdir / "profile.svg")
+        arts["profile"] = {
+            "folded_url": _u(f"/files/runs/{run.id}/profile.folded.txt"),
+            "svg_url": _u(f"/files/runs/{run.id}/profile.svg"),
+            "samples": int(sum(prof.stacks.values())),
+        }
+
+    try:
+        precompress(outdir)
+    except OSError:
+        pass
+
+    run.artifacts_json = arts
+    run.status = RunStatus.succeeded
+    run.finished_at = datetime.utcnow()
+    db.commit()
+    publish(run.id, status="succeeded", stage=None, percent=100.0, eta_s=0.0)
+
+def _sample_groups(p: Path, column: str):
+    """sample_id -> group from the dataset's sample metadata, or None when it has no such column."""
+    from app.services.sample_meta import sample_groups
+
+    if not is_canonical(p):
+        return None
+    try:
+        return sample_groups(p, column)
+    except ValueError:
+        return None
+
+def _two_groups(wanted, present) -> list:
+    present = [str(g) for g in present]
+    if wanted:
+        groups = [str(g) for g in wanted]
+        missing = [g for g in groups if g not in present]
+        if len(groups) != 2 or missing:
+            raise ValueError(f"groups must be two of: {', '.join(present[:20])}")
+        return groups
+    if len(present) != 2:
+        raise ValueError("DE requires exactly 2 groups (pass params.groups to pick two)")
+    return present
+
+def _cluster(ds, distance: str, ids, method: str, **kw) -> dict:
+    with span("cluster") as rec:
+        ordering = get_ordering(dataset_id=ds.id, fp=dataset_fingerprint(ds), ids=ids,
+                                distance=distance, method=method, **kw)
+        if rec is not None:
+            rec["cached"] = ordering["cached"]
+    return ordering
+
+def _ordering_art(ordering: dict) -> dict:
+    return {"key": ordering["key"], "method": ordering["method"],
+            "approximate": ordering["approximate"], "cached": ordering["cached"]}
+
+# ---------- memoized preprocessing stages (in-memory mode) ----------
+
+def _st_top_variance(ctx, prm):
+    return _top_variance(ctx["path"], int(prm["top_genes"]), bool(prm["log1p"]))
+
+def _st_standardized(ctx, prm, X):
+    from sklearn.preprocessing import StandardScaler
+    return pd.DataFrame(StandardScaler(with_mean=True, with_std=True).fit_transform(X.values),
+                        index=X.index, columns=X.columns)
+
+def _st_corr_input(ctx, prm):
+    max_n = int(prm["max_n"])
+    if prm["axis"] == "samples":
+        num = _numeric(ctx["path"], "genes")
+        with span("preprocess"):
+            return num.iloc[:, :max_n]
+    num = _numeric(ctx["path"], "samples")
+    with span("preprocess"):
+        keep = num.var(axis=0, skipna=True).nlargest(max_n).index
+        return num[keep]
+
+def _st_corr(ctx, prm, X):
+    return X.corr(method=prm["method"])
+
+def _st_heatmap_matrix(ctx, prm):
+    """genes x samples float32, optionally top-variance genes, log1p and row z-scores."""
+    p, top_genes, use_log1p = ctx["path"], prm["top_genes"], bool(prm["log1p"])
+    if top_genes:
+        G = _top_variance(p, int(top_genes), use_log1p).T
+    else:
+        G = _numeric(p, "genes")
+        if use_log1p:
+            with span("preprocess"):
+                G = np.log1p(G)
+    with span("preprocess"):
+        M = np.array(G, dtype=np.float32)
+        if prm["scale"] == "row":
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                M -= np.nanmean(M, axis=1, keepdims=True)
+                sd = np.nanstd(M, axis=1, keepdims=True)
+                sd[~(sd > 0)] = 1.0
+                M /= sd
+    return pd.DataFrame(M, index=G.index.astype(str), columns=G.columns.astype(str))
+
+STAGES = StageGraph(
+    Stage("top_variance", _st_top_variance, params={"top_genes": 1000, "log1p": False}),
+    Stage("standardized", _st_standardized, deps=("top_variance",)),
+    Stage("corr_input", _st_corr_input, params={"axis": "samples", "max_n": 300}),
+    Stage("corr", _st_corr, deps=("corr_input",), params={"method": "spearman"}),
+    Stage("heatmap_matrix", _st_heatmap_matrix, params={"top_genes": None, "log1p": False, "scale": "row"}),
+)
+
+def _run_recipe(run: AnalysisRun, ds, p: Path, outdir: Path, exec_mode: str) -> dict:
+    chunked = exec_mode == "chunked"
     arts = {}
+    ctx = {"fp": dataset_fingerprint(ds), "path": p}
+
+    if "grid" in (run.params_json or {}):
+        if chunked:
+            raise ValueError("Sweep does not fit the memory budget; run the combinations individually")
+        return run_sweep(run, ctx, outdir)
 
     if run.recipe_key == "correlation":
-        from scipy.cluster.hierarchy import linkage, leaves_list
         method = (run.params_json or {}).get("method", "spearman")
         mode   = (run.params_json or {}).get("axis", "samples")  
         max_n  = int((run.params_json or {}).get("max_n", 300))
         do_cluster = bool((run.params_json or {}).get("cluster", True))
-
-        num = df.select_dtypes(include=np.number)
-
-        if mode == "samples":
-            X = num.iloc[:, :max_n]                
-            corr = X.corr(method=method)
-        else:  
-            X = num.T                            
-            keep = X.var(axis=0, skipna=True).nlargest(max_n).index
-            corr = X[keep].corr(method=method)
-
-        if do_cluster and corr.shape[0] > 2:
-            order = leaves_list(linkage(corr.fillna(0.0).values, method="average"))
-            corr = corr.iloc[order, order]
-
-        outdir = _outdir(run.id)
-        corr.to_csv(outdir / "correlation.csv")
-        plt.figure(figsize=(6,5))
-        plt.imshow(corr.values, aspect="auto")
-        plt.colorbar(); plt.title(f"Correlation ({method})")
-        plt.tight_layout(); plt.savefig(outdir / "correlation.png"); plt.close()
+        link   = (run.params_json or {}).get("linkage", "average")
+        ordering = None
+
+        if chunked:
+            G = _numeric(p, "genes")
+            with span("preprocess"):
+                if mode == "samples":
+                    X = G.iloc[:, :max_n]
+                else:
+                    X = _chunked_top_variance(G, max_n, False)
+            if do_cluster and X.shape[1] > 2:
+                # out of core there is no k x k matrix to cluster on, so order
+                # from the profiles (approximate unless an exact ordering is cached)
+                prof = np.array(X.rank(axis=0) if method == "spearman" else X, dtype=np.float32).T
+                ordering = _cluster(ds, f"corr:{method}:{mode}", X.columns, link,
+                                    profiles=prof, approximate=True)
+                del prof
+                X = X.iloc[:, ordering["order"]]
+            with span("compute"):
+                # streams row blocks straight to the CSV
+                image = _corr_chunked(X, method, outdir / "correlation.csv")
+        else:
+            # corr_input -> corr are memoized; a rerun with other clustering reuses both
+            corr = STAGES.run("corr", ctx, run.params_json or {})
+            if do_cluster and corr.shape[0] > 2:
+                prof = None
+                if corr.shape[0] > EXACT_MAX:
+                    X = STAGES.run("corr_input", ctx, run.params_json or {})
+                    prof = np.array(X.rank(axis=0) if method == "spearman" else X, dtype=np.float32).T
+                ordering = _cluster(ds, f"corr:{method}:{mode}", corr.columns, link,
+                                    corr=corr.values, profiles=prof)
+                corr = corr.iloc[ordering["order"], ordering["order"]]
+
+            with span("write_artifacts"):
+                corr.to_csv(outdir / "correlation.csv")
+            image = corr.values
+
+        with span("render"):
+            plt = _plt()
+            plt.figure(figsize=(6,5))
+            plt.imshow(image, aspect="auto")
+            plt.colorbar(); plt.title(f"Correlation ({method})")
+            plt.tight_layout(); plt.savefig(outdir / "correlation.png"); plt.close()
 
         arts = {
             "csv_url": _u(f"/files/runs/{run.id}/correlation.csv"),
             "pngs":   [_u(f"/files/runs/{run.id}/correlation.png")],
+            "clustered": ordering is not None,
         }
+        if ordering is not None:
+            arts["ordering"] = _ordering_art(ordering)
 
     elif run.recipe_key == "pca":
-        from sklearn.preprocessing import StandardScaler
         from sklearn.decomposition import PCA
 
-        p = run.params_json or {}
-        n_req      = int(p.get("n_components", 10))
-        top_genes  = int(p.get("top_genes", 1000))   
-        use_log1p  = bool(p.get("log1p", False))     
-
-        num_df = df.select_dtypes(include=np.number).copy()     
-        sample_ids = list(num_df.columns)
-
-        if use_log1p:
-            num_df = np.log1p(num_df)
+        params = run.params_json or {}
+        n_req      = int(params.get("n_components", 10))
+        top_genes  = int(params.get("top_genes", 1000))   
+        use_log1p  = bool(params.get("log1p", False))     
 
-        # choose top-N variable genes (rows) by variance across samples
-        # use df['gene_id'] when present to carry gene names into loadings
-        if "gene_id" in df.columns and df.columns[0].lower() == "gene_id":
-            gene_ids_all = df["gene_id"].astype(str)
+        # samples x top-N variable genes; the planner picks the layout
+        if chunked:
+            G = _numeric(p, "genes")
+            with span("preprocess"):
+                X_df = _chunked_top_variance(G, top_genes, use_log1p)
         else:
-            # fallback: synthetic gene ids if not present
-            gene_ids_all = pd.Index([f"gene_{i}" for i in range(len(df))], name="gene_id")
-
-        # Align gene ids with numeric subset (same row order as df)
-        # num_df has the same index as df
-        variances = num_df.var(axis=1, skipna=True)
-        k = int(min(top_genes, len(variances)))
-        keep_idx = variances.nlargest(k).index
-        M = num_df.loc[keep_idx]                   
-        kept_gene_ids = gene_ids_all.loc[keep_idx].astype(str).to_numpy()
-
-        X = M.T.values                             
-
-        Xz = StandardScaler(with_mean=True, with_std=True).fit_transform(X)
+            # top_variance -> standardized are memoized; only the PCA fit depends on n_components
+            X_df = STAGES.run("top_variance", ctx, params)
+        sample_ids = list(X_df.index)
+        kept_gene_ids = X_df.columns.astype(str).to_numpy()
 
         # n cannot exceed min(n_samples, n_features)
-        n = max(2, min(n_req, Xz.shape[0], Xz.shape[1]))
-
-        pca = PCA(n_components=n, svd_solver="auto", random_state=0)
-        scores   = pca.fit_transform(Xz)          
-        loadings = pca.components_.T               
-        evr      = pca.explained_variance_ratio_   
-
-        outdir = _outdir(run.id)
-
-        # 1) scores per sample with sample_id
-        scores_df = pd.DataFrame(scores, columns=[f"PC{i+1}" for i in range(n)])
-        scores_df.insert(0, "sample_id", sample_ids)
-        scores_df.to_csv(outdir / "pca_scores.csv", index=False)
-
-        # 2) loadings per gene with gene_id
-        load_df = pd.DataFrame(loadings, columns=[f"PC{i+1}" for i in range(n)])
-        load_df.insert(0, "gene_id", kept_gene_ids)
-        load_df.to_csv(outdir / "pca_loadings.csv", index=False)
-
-        # 3) explained variance (+ cumulative) per PC
-        explained_df = pd.DataFrame({
-            "pc":        [f"PC{i+1}" for i in range(n)],
-            "explained": evr,
-            "cumulative": np.cumsum(evr)
-        })
-        explained_df.to_csv(outdir / "pca_explained.csv", index=False)
-
-        # Scree with cumulative
-        plt.figure()
-        x = np.arange(1, n + 1)
-        plt.plot(x, evr, marker="o", label="Explained")
-        plt.plot(x, np.cumsum(evr), marker="o", linestyle="--", label="Cumulative")
-        plt.xlabel("Principal component")
-        plt.ylabel("Explained variance ratio")
-        plt.title("PCA Scree")
-        plt.legend()
-        plt.tight_layout()
-        plt.savefig(outdir / "pca_scree.png")
-        plt.close()
-
-        pc1_pct = round(100 * evr[0], 1) if n >= 1 else 0.0
-        pc2_pct = round(100 * evr[1], 1) if n >= 2 else 0.0
-
-        plt.figure()
-        plt.scatter(scores[:, 0], scores[:, 1], s=12)
-        plt.xlabel(f"PC1 ({pc1_pct}%)")
-        plt.ylabel(f"PC2 ({pc2_pct}%)")
-        plt.title("PCA (samples)")
-        plt.tight_layout()
-        plt.savefig(outdir / "pca_scatter.png")
-        plt.close()
+        n = max(2, min(n_req, X_df.shape[0], X_df.shape[1]))
+
+        if chunked:
+            with span("compute"):
+                scores, loadings, evr = _pca_chunked(X_df.to_numpy(copy=False), n)
+        else:
+            Xz = STAGES.run("standardized", ctx, params).to_numpy()
+            with span("compute"):
+                pca = PCA(n_components=n, svd_solver="auto", random_state=0)
+                scores   = pca.fit_transform(Xz)          
+                loadings = pca.components_.T               
+                evr      = pca.explained_variance_ratio_   
+
+        with span("write_artifacts"):
+            # 1) scores per sample with sample_id
+            scores_df = pd.DataFrame(scores, columns=[f"PC{i+1}" for i in range(n)])
+            scores_df.insert(0, "sample_id", sample_ids)
+            scores_df.to_csv(outdir / "pca_scores.csv", index=False)
+
+            # 2) loadings per gene with gene_id
+            load_df = pd.DataFrame(loadings, columns=[f"PC{i+1}" for i in range(n)])
+            load_df.insert(0, "gene_id", kept_gene_ids)
+            load_df.to_csv(outdir / "pca_loadings.csv", index=False)
+
+            # 3) explained variance (+ cumulative) per PC
+            explained_df = pd.DataFrame({
+                "pc":        [f"PC{i+1}" for i in range(n)],
+                "explained": evr,
+                "cumulative": np.cumsum(evr)
+            })
+            explained_df.to_csv(outdir / "pca_explained.csv", index=False)
+
+        with span("render"):
+            plt = _plt()
+            # Scree with cumulative
+            plt.figure()
+            x = np.arange(1, n + 1)
+            plt.plot(x, evr, marker="o", label="Explained")
+            plt.plot(x, np.cumsum(evr), marker="o", linestyle="--", label="Cumulative")
+            plt.xlabel("Principal component")
+            plt.ylabel("Explained variance ratio")
+            plt.title("PCA Scree")
+            plt.legend()
+            plt.tight_layout()
+            plt.savefig(outdir / "pca_scree.png")
+            plt.close()
+
+            pc1_pct = round(100 * evr[0], 1) if n >= 1 else 0.0
+            pc2_pct = round(100 * evr[1], 1) if n >= 2 else 0.0
+
+            plt.figure()
+            plt.scatter(scores[:, 0], scores[:, 1], s=12)
+            plt.xlabel(f"PC1 ({pc1_pct}%)")
+            plt.ylabel(f"PC2 ({pc2_pct}%)")
+            plt.title("PCA (samples)")
+            plt.tight_layout()
+            plt.savefig(outdir / "pca_scatter.png")
+            plt.close()
 
         arts = {
             "scores_csv":    _u(f"/files/runs/{run.id}/pca_scores.csv"),
@@ -279,148 +622,126 @@ def execute_inline(db: Session, run: AnalysisRun, ds):
                 _u(f"/files/runs/{run.id}/pca_scree.png"),
                 _u(f"/files/runs/{run.id}/pca_scatter.png"),
             ],
+            "explained_variance_ratio": evr.tolist(),
         }
 
-        from sklearn.preprocessing import StandardScaler
-        from sklearn.decomposition import PCA
-
-        p = run.params_json or {}
-        n = int(p.get("n_components", 10))
-        top_genes = int(p.get("top_genes", 1000))     
-        use_log1p = bool(p.get("log1p", False))       
-
-        M = df.select_dtypes(include=np.number).copy()
-        if use_log1p:
-            M = np.log1p(M)
-
-        # keep top-N variable genes (rows if genes are rows; if genes are columns, transpose)
-        # Our canonical matrix is genes in rows, samples in columns (first col 'gene_id').
-        if "gene_id" in df.columns and df.columns[0].lower() == "gene_id":
-            genes = df["gene_id"].astype(str).values
-            X = M.values  
-            if X.shape[0] > top_genes:
-                keep_idx = np.argsort(X.var(axis=1))[-top_genes:]
-                X = X[keep_idx, :]
-                genes = genes[keep_idx]
-            X = StandardScaler(with_mean=True, with_std=True).fit_transform(X)
-            Xs = X.T
-            pca = PCA(n_components=max(2, min(n, Xs.shape[1])))
-            scores = pca.fit_transform(Xs)  
-            loadings = pca.components_.T   
-            pd.DataFrame(
-                scores[:, :2], columns=["PC1","PC2"]
-            ).to_csv(outdir/"pca_scores.csv", index=False)
-            pd.DataFrame(
-                loadings, index=genes, columns=[f"PC{i+1}" for i in range(pca.n_components_)]
-            ).to_csv(outdir/"pca_loadings.csv")
+    elif run.recipe_key == "de":
+        from scipy import stats
+        params = run.params_json or {}
+        group_col = params.get("group_col","group")
+        wanted = params.get("groups")
+        meta = _sample_groups(p, group_col)
+        if meta is not None:
+            # samples are matrix columns; their groups come from the sample table
+            G = _numeric(p, "genes")
+            with span("preprocess"):
+                gvals = meta.reindex(G.columns.astype(str)).to_numpy()
+                groups = _two_groups(wanted, pd.unique(gvals[pd.notnull(gvals)]))
+                X = G.to_numpy(copy=False)
+                ia, ib = np.flatnonzero(gvals == groups[0]), np.flatnonzero(gvals == groups[1])
+            with span("compute"):
+                # gene blocks: bounded float64 temporaries and a cancel check per block
+                n_genes = X.shape[0]
+                pv, mean_a, mean_b = (np.empty(n_genes) for _ in range(3))
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    for i in range(0, n_genes, VAR_CHUNK):
+                        blk = X[i:i + VAR_CHUNK]
+                        A, B = blk[:, ia].astype(np.float64), blk[:, ib].astype(np.float64)
+                        _, p_blk = stats.ttest_ind(A, B, axis=1, equal_var=False, nan_policy="omit")
+                        pv[i:i + VAR_CHUNK] = np.ma.filled(p_blk, np.nan).astype(float)
+                        mean_a[i:i + VAR_CHUNK] = np.nanmean(A, axis=1)
+                        mean_b[i:i + VAR_CHUNK] = np.nanmean(B, axis=1)
+                        tick(min(i + VAR_CHUNK, n_genes), n_genes)
+                out = pd.DataFrame({
+                    "feature": G.index.astype(str),
+                    "pval": pv,
+                    "mean_a": mean_a,
+                    "mean_b": mean_b,
+                })
+                out = out.sort_values("pval", na_position="last")
+                m = len(out); out["fdr"] = (out["pval"]*m/(np.arange(m)+1)).clip(upper=1.0)
         else:
-            X = M.values.T
-            X = StandardScaler(with_mean=True, with_std=True).fit_transform(X)
-            pca = PCA(n_components=max(2, min(n, X.shape[1])))
-            scores = pca.fit_transform(X)
-            pd.DataFrame(scores[:, :2], columns=["PC1","PC2"]).to_csv(outdir/"pca_scores.csv", index=False)
-
-        evr = pca.explained_variance_ratio_
-        pc1_pct = round(100*evr[0], 1)
-        pc2_pct = round(100*evr[1], 1)
-
-        # Scree + cumulative
-        plt.figure()
-        x = np.arange(1, len(evr)+1)
-        plt.plot(x, evr, marker="o", label="Explained")
-        plt.plot(x, np.cumsum(evr), marker="o", linestyle="--", label="Cumulative")
-        plt.xlabel("Principal component"); plt.ylabel("Explained variance ratio")
-        plt.title("PCA Scree"); plt.legend(); plt.tight_layout()
-        plt.savefig(outdir/"pca_scree.png"); plt.close()
-
-        # Scatter
-        plt.figure()
-        plt.scatter(scores[:,0], scores[:,1], s=12)
-        plt.xlabel(f"PC1 ({pc1_pct}%)"); plt.ylabel(f"PC2 ({pc2_pct}%)")
-        plt.title("PCA (samples)"); plt.tight_layout()
-        plt.savefig(outdir/"pca_scatter.png"); plt.close()
+            with span("load"):
+                df = _load_df(p)
+            if group_col not in df.columns: raise ValueError(f"Column '{group_col}' not in dataset or its sample metadata")
+            gvals = df[group_col].astype(str)
+            groups = _two_groups(wanted, gvals.unique())
+            num = df.select_dtypes(include=np.number)
+            with span("compute"):
+                res = []
+                for j, col in enumerate(num.columns):
+                    a = num[gvals==groups[0]][col].dropna()
+                    b = num[gvals==groups[1]][col].dropna()
+                    t, pval = stats.ttest_ind(a, b, equal_var=False)
+                    res.append((col, float(pval)))
+                    tick(j + 1, num.shape[1])
+                out = pd.DataFrame(res, columns=["feature","pval"]).sort_values("pval")
+                m = len(out); out["fdr"] = (out["pval"]*m/(np.arange(m)+1)).clip(upper=1.0)
+        with span("write_artifacts"):
+            out.to_csv(outdir/"de.csv", index=False)
+        arts = {"csv_url": sign(f"/files/runs/{run.id}/de.csv"), "groups": [str(g) for g in groups], "group_col": group_col}
+
+    elif run.recipe_key == "heatmap":
+        from app.services.heatmap_tiles import build_pyramid, read_tile
+
+        params = run.params_json or {}
+        top_genes = params.get("top_genes")
+        use_log1p = bool(params.get("log1p", False))
+        scale = params.get("scale", "row")
+        if scale not in ("row", "none"):
+            raise ValueError("scale must be 'row' or 'none'")
+
+        # genes x samples (top-variance / log1p / row z-score), memoized across runs
+        G = STAGES.run("heatmap_matrix", ctx, params)
+
+        with span("preprocess"):
+            M = np.array(G, dtype=np.float32)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                # ordering needs finite, row-centred values
+                filled = np.nan_to_num(M if scale == "row" else M - np.nanmean(M, axis=1, keepdims=True))
+
+        # ordering is computed (or reused) once here; every zoom level shares it.
+        # Row correlations do not depend on row scaling; column ones do.
+        link = params.get("linkage", "average")
+        orderings = {}
+        row_order, col_order = np.arange(M.shape[0]), np.arange(M.shape[1])
+        if params.get("cluster_rows", True) and M.shape[0] > 2:
+            orderings["rows"] = _cluster(ds, f"heatmap:log1p={use_log1p}", G.index, link, profiles=filled)
+            row_order = orderings["rows"]["order"]
+        if params.get("cluster_cols", True) and M.shape[1] > 2:
+            orderings["cols"] = _cluster(ds, f"heatmap:log1p={use_log1p}:scale={scale}:top={top_genes}",
+                                         G.columns, link, profiles=filled.T)
+            col_order = orderings["cols"]["order"]
+        with span("compute"):
+            M = M[np.ix_(row_order, col_order)]
+
+        with span("write_artifacts"):
+            meta = build_pyramid(M, outdir / "tiles")
+            pd.DataFrame({"gene_id": G.index.astype(str)[row_order]}).to_csv(outdir / "heatmap_rows.csv", index_label="position")
+            pd.DataFrame({"sample_id": G.columns.astype(str)[col_order]}).to_csv(outdir / "heatmap_cols.csv", index_label="position")
+
+        with span("render"):
+            overview, _ = read_tile(outdir / "tiles", 0, 0, 0, "mean")
+            plt = _plt()
+            plt.figure(figsize=(6, 5))
+            plt.imshow(overview.astype(np.float32), aspect="auto", cmap="RdBu_r",
+                       vmin=meta["value_range"][0], vmax=meta["value_range"][1], interpolation="nearest")
+            plt.colorbar(); plt.title("Expression heatmap (overview)")
+            plt.tight_layout(); plt.savefig(outdir / "heatmap.png"); plt.close()
 
         arts = {
-            "scores_csv": f"/files/runs/{run.id}/pca_scores.csv",
-            "loadings_csv": f"/files/runs/{run.id}/pca_loadings.csv",
-            "explained_csv": f"/files/runs/{run.id}/pca_explained.csv",
-            "pngs": [
-                f"/files/runs/{run.id}/pca_scree.png",
-                f"/files/runs/{run.id}/pca_scatter.png",
-            ],
+            "tiles_url": _u(f"/analytics/runs/{run.id}/tiles/{{z}}/{{x}}/{{y}}"),
+            "rows_csv": _u(f"/files/runs/{run.id}/heatmap_rows.csv"),
+            "cols_csv": _u(f"/files/runs/{run.id}/heatmap_cols.csv"),
+            "pngs": [_u(f"/files/runs/{run.id}/heatmap.png")],
+            "orderings": {k: _ordering_art(v) for k, v in orderings.items()},
+            "scale": scale,
+            **meta,
         }
 
-        from sklearn.preprocessing import StandardScaler
-        from sklearn.decomposition import PCA
-
-        num_df = df.select_dtypes(include=np.number)
-
-        X = num_df.T.values  
-
-        X = StandardScaler(with_mean=True, with_std=True).fit_transform(X)
-
-        req_n = int((run.params_json or {}).get("n_components", 10))
-        n = max(2, min(req_n, X.shape[1]))  
-
-        pca = PCA(n_components=n, svd_solver="auto", random_state=0)
-        scores = pca.fit_transform(X)  
-
-        # Save PC1/PC2 coordinates per sample
-        pc12 = pd.DataFrame(scores[:, :2], columns=["PC1", "PC2"])
-        pc12.to_csv(outdir / "pca_scores.csv", index=False)
-
-        # Scree plot
-        plt.figure()
-        plt.plot(np.arange(1, n + 1), pca.explained_variance_ratio_, marker="o")
-        plt.xlabel("Principal component")
-        plt.ylabel("Explained variance ratio")
-        plt.title("PCA Scree")
-        plt.tight_layout()
-        plt.savefig(outdir / "pca_scree.png")
-        plt.close()
-
-        # Scatter of PC1 vs PC2 (samples)
-        plt.figure()
-        plt.scatter(pc12["PC1"], pc12["PC2"], s=12)
-        plt.xlabel("PC1")
-        plt.ylabel("PC2")
-        plt.title("PCA (samples)")
-        plt.tight_layout()
-        plt.savefig(outdir / "pca_scatter.png")
-        plt.close()
-
-        arts = {
-            "scores_csv": _u(f"/files/runs/{run.id}/pca_scores.csv"),
-            "pngs": [
-                _u(f"/files/runs/{run.id}/pca_scree.png"),
-                _u(f"/files/runs/{run.id}/pca_scatter.png"),
-            ],
-            "explained_variance_ratio": pca.explained_variance_ratio_.tolist(),
-        }
-
-    elif run.recipe_key == "de":
-        from scipy import stats
-        group_col = (run.params_json or {}).get("group_col","group")
-        if group_col not in df.columns: raise ValueError(f"Column '{group_col}' not in dataset")
-        gvals = df[group_col].astype(str)
-        groups = gvals.unique()
-        if len(groups) != 2: raise ValueError("DE requires exactly 2 groups")
-        num = df.select_dtypes(include=np.number)
-        res = []
-        for col in num.columns:
-            a = num[gvals==groups[0]][col].dropna()
-            b = num[gvals==groups[1]][col].dropna()
-            t, p = stats.ttest_ind(a, b, equal_var=False)
-            res.append((col, float(p)))
-        out = pd.DataFrame(res, columns=["feature","pval"]).sort_values("pval")
-        m = len(out); out["fdr"] = (out["pval"]*m/(np.arange(m)+1)).clip(upper=1.0)
-        out.to_csv(outdir/"de.csv", index=False)
-        arts = {"csv_url": f"/files/runs/{run.id}/de.csv"}
-
     else:
         raise ValueError("Unsupported recipe")
 
-    run.artifacts_json = arts
-    run.status = RunStatus.succeeded
-    run.finished_at = datetime.utcnow()
-    db.commit()
+    return arts
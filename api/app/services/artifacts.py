@@ -0,0 +1,145 @@
+"""
+Run and batch artifacts under /files.
+
+Artifacts live under storage/runs/<run_id>/ and storage/batches/<batch_id>/
+and are written once: when a run or batch has finished its files no longer
+change. Serving (app.routers.files) therefore gives every file a strong
+ETag from its size and mtime, and marks files of finished runs/batches
+Cache-Control: immutable. Single byte ranges are honoured, for paging
+through large CSV/parquet artifacts.
+
+Text artifacts are compressed once when the run finishes (precompress):
+<file>.gz and, when pyarrow has the codec, <file>.zst sit next to the
+original and are served as-is to clients that accept them, so the response
+path never compresses.
+
+Artifact URLs carry a key, an HMAC of the owning run/batch ("runs/<id>"),
+so links work from <img>/<a> without a bearer token; requests without a
+valid key must come from the owner.
+"""
+from __future__ import annotations
+
+import gzip
+import hmac
+import os
+import re
+import shutil
+import uuid
+from hashlib import sha256
+from pathlib import Path
+from typing import Optional, Tuple
+
+from app.config import settings
+
+PRECOMPRESS_EXTS = {".csv", ".tsv", ".txt", ".json", ".svg", ".html", ".ipynb"}
+# encoding -> suffix, in order of preference
+VARIANTS = (("zstd", ".zst"), ("gzip", ".gz"))
+KINDS = ("runs", "batches")
+_URL_PATH = re.compile(r"^/files/(runs|batches)/(\d+)/")
+
+
+def storage_root() -> Path:
+    return Path(settings.STORAGE_DIR).resolve()
+
+
+# ---------- keys ----------
+
+def resource_key(kind: str, resource_id: int) -> str:
+    secret = (settings.FILES_URL_SECRET or settings.JWT_ACCESS_SECRET).encode()
+    return hmac.new(secret, f"{kind}/{int(resource_id)}".encode(), sha256).hexdigest()[:32]
+
+
+def check_key(kind: str, resource_id: int, key: Optional[str]) -> bool:
+    return bool(key) and hmac.compare_digest(resource_key(kind, resource_id), key)
+
+
+def sign(path: str) -> str:
+    """`path` with the key of the run/batch it belongs to (other paths unchanged)."""
+    m = _URL_PATH.match(path)
+    if m is None:
+        return path
+    return f"{path}?key={resource_key(m.group(1), int(m.group(2)))}"
+
+
+# ---------- files ----------
+
+def resolve(rel: str) -> Tuple[str, int, Path]:
+    """
+    (kind, id, absolute path) for a /files path "<kind>/<id>/<file>"; raises
+    FileNotFoundError for anything outside a run/batch directory.
+    """
+    parts = Path(rel).parts
+    if len(parts) < 3 or parts[0] not in KINDS or not parts[1].isdigit():
+        raise FileNotFoundError(rel)
+    base = (storage_root() / parts[0] / parts[1]).resolve()
+    path = (base / Path(*parts[2:])).resolve()
+    if base not in path.parents or not path.is_file():
+        raise FileNotFoundError(rel)
+    return parts[0], int(parts[1]), path
+
+
+def etag(st: os.stat_result, encoding: Optional[str] = None) -> str:
+    tag = f"{st.st_size:x}-{st.st_mtime_ns:x}"
+    return f'"{tag}-{encoding}"' if encoding else f'"{tag}"'
+
+
+def variant(path: Path, accepted: set) -> Tuple[Optional[str], Path]:
+    """(encoding, file) of the best precompressed copy the client accepts, else (None, path)."""
+    mtime = path.stat().st_mtime_ns
+    for encoding, suffix in VARIANTS:
+        if encoding not in accepted:
+            continue
+        p = path.with_name(path.name + suffix)
+        try:
+            if p.stat().st_mtime_ns >= mtime:
+                return encoding, p
+        except OSError:
+            continue
+    return None, path
+
+
+def _zstd_stream(dst: Path):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+    if not pa.Codec.is_available("zstd"):
+        return None
+    return pa.CompressedOutputStream(str(dst), "zstd")
+
+
+def _write_variant(src: Path, suffix: str) -> bool:
+    dst = src.with_name(src.name + suffix)
+    tmp = dst.with_name(f"{dst.name}.{uuid.uuid4().hex}.tmp")
+    if suffix == ".gz":
+        out = gzip.GzipFile(tmp, "wb", compresslevel=settings.COMPRESS_GZIP_LEVEL, mtime=0)
+    else:
+        out = _zstd_stream(tmp)
+        if out is None:
+            return False
+    try:
+        with src.open("rb") as f, out:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+        if tmp.stat().st_size >= src.stat().st_size:
+            tmp.unlink()  # incompressible: serve the original
+            return False
+        os.replace(tmp, dst)
+        return True
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def precompress(directory: Path) -> int:
+    """Write .gz/.zst copies of the text artifacts under `directory`; returns how many."""
+    n = 0
+    for p in sorted(Path(directory).rglob("*")):
+        if not p.is_file() or p.suffix.lower() not in PRECOMPRESS_EXTS:
+            continue
+        if p.stat().st_size < settings.COMPRESS_MIN_BYTES:
+            continue
+        for _, suffix in VARIANTS:
+            try:
+                n += _write_variant(p, suffix)
+            except OSError:
+                pass
+    return n
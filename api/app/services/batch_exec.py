@@ -0,0 +1,386 @@
+"""
+Batch runs: one recipe over many datasets.
+
+A batch owns one AnalysisRun per dataset. Runs are fanned out to a shared
+set of BATCH_WORKERS worker processes ("lanes", one single-process pool
+each) that are warmed once (app.services.warmup) and then reused by every
+later batch, so per-dataset cost is the analysis itself. When all runs have
+finished a combined summary is written under storage/batches/<id>/.
+
+Workers relay every run event they publish (stage, percent, ETA, status)
+through a multiprocessing queue that a thread of the API process drains
+into run_events.publish, so batch runs stream live on
+/analytics/runs/{id}/events.
+
+Each worker keeps recently used datasets resident (app.services.residency)
+and reports which ones with every result. A lane takes one run at a time;
+when a lane frees up it is given a queued run whose dataset it already
+holds, if there is one, before anything else.
+"""
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Condition, Thread
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import AnalysisBatch, AnalysisRun, Dataset, RunStatus, User
+from app.services.analysis_service import create_run, dataset_fingerprint, make_cache_key
+from app.services.artifacts import precompress, sign
+from app.services.run_events import publish
+
+_cond = Condition()
+_lanes: List["_Lane"] = []
+_events = None  # multiprocessing queue of (run_id, event) from the workers
+
+
+def _outdir(batch_id: int) -> Path:
+    out = Path(settings.STORAGE_DIR) / "batches" / str(batch_id)
+    out.mkdir(parents=True, exist_ok=True)
+    return out
+
+
+def _u(path: str) -> str:
+    return f"{settings.PUBLIC_API_BASE.rstrip('/')}{sign(path)}"
+
+
+def _init_worker(events=None):
+    from app.services.run_events import set_relay
+    from app.services.warmup import preload
+
+    if events is not None:
+        set_relay(lambda run_id, event: events.put((run_id, event)))
+    preload()
+
+
+def _drain(events) -> None:
+    while True:
+        try:
+            run_id, event = events.get()
+            publish(run_id, **event)
+        except Exception:
+            pass
+
+
+def _event_queue():
+    """The workers' event queue, with the API-side thread that relays it (created once)."""
+    global _events
+    with _cond:
+        if _events is None:
+            _events = get_context("spawn").Queue()
+            Thread(target=_drain, args=(_events,), name="batch-events", daemon=True).start()
+        return _events
+
+
+class _Lane:
+    """One warmed worker process and what it last reported holding."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.busy = False
+        self.datasets: Set[int] = set()
+        self.residency: dict = {}
+
+    def executor(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            # spawn: the API process has threads and open DB connections that must not be forked
+            self.pool = ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"),
+                                            initializer=_init_worker, initargs=(_event_queue(),))
+        return self.pool
+
+    def reset(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = None
+        self.datasets, self.residency = set(), {}
+
+
+def _get_lanes() -> List[_Lane]:
+    with _cond:
+        while len(_lanes) < settings.BATCH_WORKERS:
+            _lanes.append(_Lane(len(_lanes)))
+        return _lanes[: settings.BATCH_WORKERS]
+
+
+def workers() -> List[dict]:
+    """Last reported state of each batch worker (for /metrics and the workers endpoint)."""
+    with _cond:
+        out = []
+        for lane in _lanes:
+            stats = {k: v for k, v in lane.residency.items() if k != "datasets"}
+            out.append({"worker": str(lane.index), "started": lane.pool is not None,
+                        "pending": int(lane.busy), "datasets": sorted(lane.datasets), **stats})
+        return out
+
+
+def _pick(queue: deque, free: List[_Lane]) -> List[tuple]:
+    """(lane, run_id, dataset_id) assignments: dataset holders first, then queue order."""
+    picks = []
+    for lane in list(free):
+        for item in queue:
+            if item[1] in lane.datasets:
+                queue.remove(item)
+                free.remove(lane)
+                picks.append((lane, *item))
+                break
+    while free and queue:
+        picks.append((free.pop(0), *queue.popleft()))
+    return picks
+
+
+def _submit(lane: _Lane, run_id: int) -> Future:
+    fut = lane.executor().submit(_run_one, run_id)
+
+    def _done(f: Future):
+        with _cond:
+            lane.busy = False
+            if not f.cancelled() and f.exception() is None:
+                res = f.result()
+                lane.datasets = set(res["resident"])
+                lane.residency = res["residency"]
+            _cond.notify_all()
+
+    fut.add_done_callback(_done)
+    return fut
+
+
+def create_batch(db: Session, user: User, recipe_key: str, params: dict, dataset_ids: List[int]) -> AnalysisBatch:
+    ids = list(dict.fromkeys(dataset_ids))
+    if len(ids) > settings.BATCH_MAX_DATASETS:
+        raise ValueError(f"At most {settings.BATCH_MAX_DATASETS} datasets per batch")
+    found = {d.id: d for d in db.query(Dataset).filter(Dataset.id.in_(ids), Dataset.owner_id == user.id)}
+    missing = [i for i in ids if i not in found]
+    if missing:
+        raise ValueError(f"Dataset(s) not found: {', '.join(map(str, missing))}")
+
+    batch = AnalysisBatch(user_id=user.id, recipe_key=recipe_key, params_json=params,
+                          status=RunStatus.queued, n_total=len(ids))
+    db.add(batch)
+    db.commit()
+    for i in ids:
+        ds = found[i]
+        run = create_run(db, dataset=ds, user_id=user.id, recipe_key=recipe_key, params=params,
+                         cache_key=make_cache_key(recipe_key, params, dataset_fingerprint(ds)))
+        run.batch_id = batch.id
+    db.commit()
+    db.refresh(batch)
+    return batch
+
+
+def progress(db: Session, batch: AnalysisBatch) -> dict:
+    counts = dict(
+        db.query(AnalysisRun.status, func.count(AnalysisRun.id))
+        .filter(AnalysisRun.batch_id == batch.id)
+        .group_by(AnalysisRun.status)
+        .all()
+    )
+    out = {s.value: int(counts.get(s, 0)) for s in RunStatus}
+    out["done"] = out["succeeded"] + out["failed"] + out["canceled"]
+    return out
+
+
+# dataset id -> resident paths its runs read, in this worker process
+_held: Dict[int, Set[str]] = {}
+
+
+def _run_one(run_id: int) -> dict:
+    """
+    Execute one run of a batch (in a pool worker); failures are recorded on
+    the run. Returns the run status plus the datasets this worker now holds.
+    """
+    from app.db import SessionLocal
+    from app.services import residency
+    from app.services.analytics_exec import execute_inline
+
+    db = SessionLocal()
+    try:
+        run = db.get(AnalysisRun, run_id)
+        if run.status == RunStatus.queued:
+            ds = db.get(Dataset, run.dataset_id)
+            tick = residency.mark()
+            try:
+                execute_inline(db, run, ds)
+            except Exception as e:
+                db.rollback()
+                run.status = RunStatus.failed
+                run.error_message = str(e)
+                run.finished_at = datetime.utcnow()
+                db.commit()
+            _held[ds.id] = _held.get(ds.id, set()) | set(residency.used_since(tick))
+        # else: canceled while waiting for a worker
+        stats = residency.stats()
+        live = set(stats["datasets"])
+        return {
+            "status": run.status.value,
+            "resident": [d for d, paths in _held.items() if paths & live],
+            "residency": stats,
+        }
+    finally:
+        db.close()
+
+
+def _fail(db: Session, run_id: int, message: str) -> None:
+    run = db.get(AnalysisRun, run_id)
+    if run.status not in (RunStatus.succeeded, RunStatus.failed):
+        run.status = RunStatus.failed
+        run.error_message = message
+        run.finished_at = datetime.utcnow()
+        db.commit()
+        publish(run_id, status="failed", error=message)
+
+
+def run_batch(batch_id: int) -> None:
+    """Run every queued run of the batch, then write the summary."""
+    from app.db import SessionLocal
+
+    db = SessionLocal()
+    batch = db.get(AnalysisBatch, batch_id)
+    try:
+        batch.status = RunStatus.running
+        batch.started_at = datetime.utcnow()
+        db.commit()
+
+        runs = db.query(AnalysisRun.id, AnalysisRun.dataset_id).filter(
+            AnalysisRun.batch_id == batch_id, AnalysisRun.status == RunStatus.queued
+        ).order_by(AnalysisRun.id).all()
+
+        if settings.BATCH_WORKERS <= 1:
+            for rid, _ in runs:
+                _run_one(rid)
+        else:
+            _dispatch(db, deque((r.id, r.dataset_id) for r in runs))
+
+        db.expire_all()
+        batch.summary_json = write_summary(db, batch)
+        try:
+            precompress(_outdir(batch.id))
+        except OSError:
+            pass
+        done = progress(db, batch)
+        batch.status = RunStatus.succeeded if done["succeeded"] else RunStatus.failed
+        if done["failed"]:
+            batch.error_message = f"{done['failed']} of {batch.n_total} runs failed"
+    except Exception as e:
+        db.rollback()
+        batch = db.get(AnalysisBatch, batch_id)
+        batch.status = RunStatus.failed
+        batch.error_message = str(e)
+    finally:
+        batch.finished_at = datetime.utcnow()
+        db.commit()
+        db.close()
+
+
+def _dispatch(db: Session, queue: deque) -> None:
+    """Feed the queued (run_id, dataset_id) pairs to free lanes until all have finished."""
+    lanes = _get_lanes()
+    inflight: Dict[Future, tuple] = {}
+    while queue or inflight:
+        with _cond:
+            picks = _pick(queue, [lane for lane in lanes if not lane.busy])
+            for lane, _, _ in picks:
+                lane.busy = True
+            if not picks and not any(f.done() for f in inflight):
+                # woken by any lane finishing, including lanes serving other batches
+                _cond.wait()
+                continue
+        # submitted outside the lock: the pool's manager thread takes it in _done
+        for lane, rid, _ in picks:
+            try:
+                inflight[_submit(lane, rid)] = (rid, lane)
+            except Exception as e:
+                _lost(db, lane, rid, e)
+        for fut in [f for f in inflight if f.done()]:
+            rid, lane = inflight.pop(fut)
+            try:
+                # the worker's own events (final status included) arrive through the relay;
+                # publishing here could overtake ones still in the queue
+                fut.result()
+            except Exception as e:
+                _lost(db, lane, rid, e)
+
+
+def _lost(db: Session, lane: _Lane, run_id: int, e: Exception) -> None:
+    """The lane's worker died (e.g. OOM-killed); its pool is unusable after that."""
+    _fail(db, run_id, f"Worker failed: {e!r}")
+    with _cond:
+        lane.reset()
+        lane.busy = False
+        _cond.notify_all()
+
+
+# ---------- combined summary ----------
+
+def write_summary(db: Session, batch: AnalysisBatch) -> dict:
+    import pandas as pd
+
+    runs = (
+        db.query(AnalysisRun, Dataset.title)
+        .join(Dataset, Dataset.id == AnalysisRun.dataset_id)
+        .filter(AnalysisRun.batch_id == batch.id)
+        .order_by(AnalysisRun.id)
+        .all()
+    )
+    out = _outdir(batch.id)
+    run_dir = Path(settings.STORAGE_DIR) / "runs"
+
+    status = pd.DataFrame([{
+        "dataset_id": r.dataset_id,
+        "title": title,
+        "run_id": r.id,
+        "status": r.status.value,
+        "exec_mode": r.exec_mode,
+        "wall_s": (r.timings_json or {}).get("total_wall_s"),
+        "error": r.error_message,
+    } for r, title in runs])
+    status.to_csv(out / "runs.csv", index=False)
+    summary = {
+        "runs_csv": _u(f"/files/batches/{batch.id}/runs.csv"),
+        "n_succeeded": int((status["status"] == "succeeded").sum()) if len(status) else 0,
+        "n_failed": int((status["status"] == "failed").sum()) if len(status) else 0,
+    }
+
+    ok = [(r, title) for r, title in runs if r.status == RunStatus.succeeded]
+    frames = []
+    if batch.recipe_key == "pca":
+        # stacked explained-variance table: one row per dataset x PC
+        for r, title in ok:
+            f = run_dir / str(r.id) / "pca_explained.csv"
+            if f.exists():
+                t = pd.read_csv(f)
+                t.insert(0, "dataset_id", r.dataset_id)
+                t.insert(1, "title", title)
+                frames.append(t)
+        name = "pca_explained_stacked.csv"
+    elif batch.recipe_key == "de":
+        alpha = float((batch.params_json or {}).get("alpha", 0.05))
+        for r, title in ok:
+            f = run_dir / str(r.id) / "de.csv"
+            if f.exists():
+                t = pd.read_csv(f)
+                frames.append(pd.DataFrame([{
+                    "dataset_id": r.dataset_id,
+                    "title": title,
+                    "n_features": len(t),
+                    "n_p_below_alpha": int((t["pval"] < alpha).sum()),
+                    "n_fdr_below_alpha": int((t["fdr"] < alpha).sum()),
+                    "alpha": alpha,
+                }]))
+        name = "de_hits.csv"
+    else:
+        name = None
+
+    if frames:
+        table = pd.concat(frames, ignore_index=True)
+        table.to_csv(out / name, index=False)
+        summary["table_csv"] = _u(f"/files/batches/{batch.id}/{name}")
+        summary["table"] = table.head(500).astype(object).where(table.head(500).notna(), None).to_dict(orient="records")
+    return summary
@@ -0,0 +1,234 @@
+"""
+Hierarchical clustering of features (samples or genes) with cached orderings.
+
+Linkage runs on condensed correlation distances (1 - r), never on the rows
+of a correlation matrix. Above EXACT_MAX items an approximate two-level
+linkage is used instead: mini-batch k-means on correlation-normalised
+profiles, average linkage between the centroids, then exact linkage inside
+each cluster. A cluster still above EXACT_MAX is split again the same way,
+so no exact linkage ever sees more than EXACT_MAX items.
+
+Results are stored under storage/orderings/<key>.npz, keyed by dataset
+fingerprint, feature ids, distance and linkage method, so a later
+correlation, heatmap or export over the same features reuses the ordering
+instead of clustering again.
+"""
+from __future__ import annotations
+
+import json
+import math
+import os
+import uuid
+from hashlib import sha256
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+
+from app.config import settings
+from app.services.run_events import tick
+
+# condensed distances for n items take n*(n-1)/2 float64s (~100 MB at 5000)
+EXACT_MAX = 5000
+METHODS = ("average", "complete", "single", "ward")
+
+
+def _root() -> Path:
+    return Path(settings.STORAGE_DIR) / "orderings"
+
+
+def ordering_key(fp: str, ids: Sequence[str], distance: str, method: str) -> str:
+    h = sha256(f"{fp}:{distance}:{method}:".encode())
+    for i in ids:
+        h.update(str(i).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def ordering_path(key: str) -> Path:
+    return _root() / f"{key}.npz"
+
+
+def corr_to_condensed(corr: np.ndarray) -> np.ndarray:
+    """Condensed 1 - r distances from a square correlation matrix (NaN -> 1)."""
+    from scipy.spatial.distance import squareform
+
+    D = 1.0 - np.nan_to_num(np.asarray(corr, dtype=np.float64), nan=0.0)
+    np.clip(D, 0.0, 2.0, out=D)
+    np.fill_diagonal(D, 0.0)
+    D = (D + D.T) / 2
+    return squareform(D, checks=False)
+
+
+def _normalise(P: np.ndarray) -> np.ndarray:
+    """Centre and scale each profile to unit norm; Euclidean distance then tracks 1 - r."""
+    P = np.nan_to_num(np.asarray(P, dtype=np.float32))
+    P = P - P.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(P, axis=1, keepdims=True)
+    norm[norm == 0] = 1.0
+    return P / norm
+
+
+def _exact(condensed: np.ndarray, method: str):
+    from scipy.cluster.hierarchy import linkage, leaves_list
+
+    if method == "ward":
+        # ward needs Euclidean input; sqrt(2 * (1 - r)) is that for unit profiles
+        condensed = np.sqrt(2.0 * condensed)
+    Z = linkage(condensed, method=method)
+    return leaves_list(Z), Z
+
+
+def _corr_pdist(U: np.ndarray) -> np.ndarray:
+    from scipy.spatial.distance import pdist
+
+    # constant profiles have undefined correlation; treat them as uncorrelated
+    return np.nan_to_num(np.clip(pdist(U, "correlation"), 0.0, 2.0), nan=1.0)
+
+
+def _projection_order(U: np.ndarray) -> np.ndarray:
+    """Order rows along their leading principal direction (a few power iterations)."""
+    C = U - U.mean(axis=0)
+    v = np.random.default_rng(0).standard_normal(C.shape[1]).astype(C.dtype)
+    for _ in range(8):
+        v = C.T @ (C @ v)
+        norm = np.linalg.norm(v)
+        if norm == 0:
+            return np.arange(U.shape[0])  # all profiles identical
+        v /= norm
+    return np.argsort(C @ v, kind="stable")
+
+
+def _two_level(U: np.ndarray, method: str, progress: bool = False) -> np.ndarray:
+    """
+    k-means, linkage between the centroids, then each cluster in turn.
+    Clusters can be very unbalanced, so one above EXACT_MAX is split again
+    the same way instead of going to exact linkage.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    n = U.shape[0]
+    k = int(min(max(2, math.isqrt(n)), EXACT_MAX))
+    km = MiniBatchKMeans(n_clusters=k, random_state=0, batch_size=2048, n_init=3).fit(U)
+    labels = km.labels_
+    present = np.unique(labels)
+    if len(present) < 2:
+        # k-means could not separate the block (near-identical profiles)
+        return _projection_order(U)
+
+    corder, _ = _exact(_corr_pdist(km.cluster_centers_[present]), method)
+
+    order = []
+    for i, c in enumerate(present[corder]):
+        members = np.flatnonzero(labels == c)
+        if len(members) > EXACT_MAX:
+            members = members[_two_level(U[members], method)]
+        elif len(members) > 2:
+            sub, _ = _exact(_corr_pdist(U[members]), method)
+            members = members[sub]
+        order.append(members)
+        if progress:
+            tick(i + 1, len(present))
+    return np.concatenate(order)
+
+
+def _approx(P: np.ndarray, method: str) -> np.ndarray:
+    return _two_level(_normalise(P), method, progress=True)
+
+
+def _save(key: str, record: dict) -> None:
+    path = ordering_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with tmp.open("wb") as f:
+        np.savez(
+            f,
+            order=record["order"],
+            ids=np.asarray(record["ids"], dtype=str),
+            linkage=record["linkage"] if record["linkage"] is not None else np.empty((0, 4)),
+            meta=np.asarray(json.dumps({k: record[k] for k in ("dataset_id", "distance", "method", "approximate")})),
+        )
+    os.replace(tmp, path)
+
+
+def load_ordering(key: str) -> Optional[dict]:
+    path = ordering_path(key)
+    if not path.exists():
+        return None
+    try:
+        os.utime(path)  # recency for storage GC (storage_gc.sweep_orderings)
+    except OSError:
+        pass
+    with np.load(path) as z:
+        meta = json.loads(str(z["meta"]))
+        linkage = z["linkage"]
+        return {
+            "key": key,
+            "order": z["order"],
+            "ids": z["ids"].tolist(),
+            "linkage": linkage if linkage.size else None,
+            "cached": True,
+            **meta,
+        }
+
+
+def get_ordering(
+    *,
+    dataset_id: int,
+    fp: str,
+    ids: Sequence[str],
+    distance: str,
+    method: str = "average",
+    corr: Optional[np.ndarray] = None,
+    profiles: Optional[np.ndarray] = None,
+    approximate: Optional[bool] = None,
+) -> dict:
+    """
+    Leaf ordering for `ids`, from the cache when possible. `distance` names
+    what the correlation was computed on (e.g. "spearman", "pearson:rowz")
+    and is part of the key. Pass `corr` (square correlation between the
+    items) when it already exists; `profiles` (one row per item, any NaNs
+    treated as 0 after centring) is needed for the approximate path and
+    when corr is absent. approximate=None picks by size; an exact ordering
+    already in the cache is always preferred.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unsupported linkage method '{method}'")
+    ids = [str(i) for i in ids]
+    n = len(ids)
+    approx = (n > EXACT_MAX) if approximate is None else (bool(approximate) and n >= 3)
+    exact_key = ordering_key(fp, ids, distance, method)
+    key = ordering_key(fp, ids, distance, f"{method}:approx") if approx else exact_key
+    for k in dict.fromkeys((exact_key, key)):
+        hit = load_ordering(k)
+        if hit is not None:
+            return hit
+
+    Z = None
+    if n < 3:
+        order = np.arange(n)
+    elif not approx:
+        if corr is None:
+            if profiles is None:
+                raise ValueError("Either corr or profiles is required")
+            U = _normalise(profiles)
+            corr = U @ U.T
+        order, Z = _exact(corr_to_condensed(corr), method)
+    else:
+        if profiles is None:
+            raise ValueError("profiles are required for approximate linkage")
+        order = _approx(profiles, method)
+
+    record = {
+        "key": key,
+        "order": np.asarray(order, dtype=np.int64),
+        "ids": ids,
+        "linkage": Z,
+        "dataset_id": dataset_id,
+        "distance": distance,
+        "method": method,
+        "approximate": approx,
+        "cached": False,
+    }
+    _save(key, record)
+    return record
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import gzip
+import logging
 import os
 import re
 import uuid
@@ -12,7 +14,15 @@ from fastapi import UploadFile
 from sqlalchemy.orm import Session
 
 from app.config import settings
-from app.models import Dataset, User
+from app.models import AnalysisRun, Dataset, User
+from app.services.matrix_store import GENE_INDEX_NAME, sort_by_gene, write_gene_major, write_gene_index, write_sample_major
+from app.services import gene_search
+from app.services.gene_stats import build_gene_stats
+from app.services.sample_meta import MatrixStream, align_to_matrix, parse_sample_lines, write_sample_meta
+from app.utils.catindex import build_index
+from app.utils.colprofile import build_profile
+
+logger = logging.getLogger(__name__)
 
 UPLOAD_ROOT: Path = Path(settings.UPLOAD_DIR).resolve()
 
@@ -53,11 +63,13 @@ def save_upload(owner_id: int, file: UploadFile) -> Tuple[Path, int]:
 
 # ---------- Canonicalization (long -> wide; numeric) ----------
 
-def _read_any(path: Path) -> pd.DataFrame:
+def _read_any(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame | None]:
     """
-    Robust reader:
+    Robust reader, returning (table, sample annotations or None):
       - Handles .txt/.tsv/.csv and their .gz variants.
-      - GEO Series Matrix: tab-separated; metadata lines start with '!' -> skip via comment='!'.
+      - GEO Series Matrix: tab-separated; metadata lines start with '!'. The
+        table lines are parsed while the !Sample_ lines are collected in the
+        same pass (app.services.sample_meta).
     """
     name = path.name.lower()
 
@@ -74,26 +86,24 @@ def _read_any(path: Path) -> pd.DataFrame:
 
     if ext in (".txt", ".tsv"):
         try:
-            return pd.read_csv(
-                path,
-                sep="\t",
-                comment="!",
-                compression=compression,
-                engine="python",  
-            )
+            opener = gzip.open if compression else open
+            with opener(path, "rt", newline="") as fh:
+                stream = MatrixStream(fh)
+                df = pd.read_csv(stream, sep="\t")
+            return df, parse_sample_lines(stream.sample_lines)
         except Exception:
-            return pd.read_csv(path, compression=compression, engine="python")
+            return pd.read_csv(path, compression=compression, engine="python"), None
 
     if ext == ".csv":
-        return pd.read_csv(path, compression=compression)
+        return pd.read_csv(path, compression=compression), None
 
     if ext in (".parquet", ".pq"):
-        return pd.read_parquet(path)
+        return pd.read_parquet(path), None
 
     if ext in (".xlsx", ".xls"):
-        return pd.read_excel(path)
+        return pd.read_excel(path), None
 
-    return pd.read_csv(path, compression=compression, engine="python")
+    return pd.read_csv(path, compression=compression, engine="python"), None
 def _is_long(df: pd.DataFrame) -> bool:
     cols = {c.lower() for c in df.columns}
     return (
@@ -134,43 +144,93 @@ def _coerce_numeric(wide: pd.DataFrame) -> pd.DataFrame:
     return out
 
 
+def canonicalize(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame | None]:
+    """(gene-sorted canonical wide numeric matrix, sample annotations or None) of an upload."""
+    df, samples = _read_any(path)
+    if _is_long(df):
+        df = _to_canonical_wide(df)
+    df = _coerce_numeric(df)
+    return sort_by_gene(df), samples
+
+
 def _write_canonical(df: pd.DataFrame, base_dir: Path) -> Path:
     """
     Write canonical matrix under base_dir as matrix.parquet (preferred) or matrix.csv fallback.
+    The parquet is gene-sorted with tuned row groups and gets a gene index sidecar.
     Returns the written file path.
     """
     base_dir.mkdir(parents=True, exist_ok=True)
+    path = base_dir / "matrix.parquet"
     try:
-        path = base_dir / "matrix.parquet"
-        df.to_parquet(path, index=False)
-        return path
+        write_gene_major(df, path)
     except Exception:
+        # a half-written parquet next to the csv would be picked up by readers
+        logger.exception("parquet write failed in %s, falling back to csv", base_dir)
+        path.unlink(missing_ok=True)
         path = base_dir / "matrix.csv"
         df.to_csv(path, index=False)
         return path
+    # the index is only a sidecar: without it readers scan the row groups
+    try:
+        write_gene_index(df, base_dir)
+    except Exception:
+        logger.exception("gene index write failed in %s", base_dir)
+        (base_dir / GENE_INDEX_NAME).unlink(missing_ok=True)
+    return path
 
 
-def persist_canonical(owner_id: int, dataset_id: int, tmp_path: Path) -> Tuple[Path, int, int]:
+def persist_canonical(
+    owner_id: int, dataset_id: int, tmp_path: Path, sample_major: bool | None = None
+) -> Tuple[Path, int, int]:
     """
     Read uploaded file, convert to canonical wide numeric matrix, save under:
       uploads/<owner_id>/<dataset_id>/matrix.parquet (or .csv fallback)
+    With sample_major (default: settings.WRITE_SAMPLE_MAJOR) a transposed
+    matrix.samples.parquet is written next to it.
     Also move the raw file to that dataset folder for provenance.
+    Sidecars are best effort: a failed one is logged and the upload still succeeds.
 
     Returns (canonical_path, n_rows, n_cols)
     """
-    df = _read_any(tmp_path)
-    if _is_long(df):
-        df = _to_canonical_wide(df)
-    df = _coerce_numeric(df)
+    df, samples = canonicalize(tmp_path)
 
     dataset_dir = UPLOAD_ROOT / str(owner_id) / str(dataset_id)
     canon_path = _write_canonical(df, dataset_dir)
+    try:
+        build_index(canon_path, df)
+    except Exception:
+        logger.exception("category index failed for dataset %s", dataset_id)
+    try:
+        build_profile(canon_path, df)
+    except Exception:
+        logger.exception("column profile failed for dataset %s", dataset_id)
+    if canon_path.suffix == ".parquet":
+        try:
+            build_gene_stats(canon_path, df)
+        except Exception:
+            logger.exception("gene stats failed for dataset %s", dataset_id)
+    try:
+        gene_search.add_dataset(owner_id, dataset_id, canon_path)
+    except Exception:
+        logger.exception("gene search indexing failed for dataset %s", dataset_id)
+    if samples is not None:
+        try:
+            write_sample_meta(align_to_matrix(samples, list(df.columns[1:])), dataset_dir)
+        except Exception:
+            logger.exception("sample metadata failed for dataset %s", dataset_id)
+    if sample_major is None:
+        sample_major = settings.WRITE_SAMPLE_MAJOR
+    if sample_major and canon_path.suffix == ".parquet":
+        try:
+            write_sample_major(df, dataset_dir)
+        except Exception:
+            logger.exception("sample-major layout failed for dataset %s", dataset_id)
 
     try:
         raw_name = f"raw-{_safe_name(tmp_path.name)}"
         shutil.move(str(tmp_path), str(dataset_dir / raw_name))
     except Exception:
-        pass
+        logger.exception("keeping the raw upload failed for dataset %s", dataset_id)
     n_rows = int(max(0, df.shape[0]))
     n_cols = int(max(0, df.shape[1] - 1))
     return canon_path, n_rows, n_cols
@@ -181,11 +241,13 @@ def create_dataset(
     title: str,
     description: str | None,
     upload: UploadFile,
+    sample_major: bool | None = None,
 ) -> Dataset:
     """
     1) Save the raw upload.
     2) Create a Dataset row (to get an id).
-    3) Build & store the canonical matrix under uploads/<owner>/<dataset_id>/matrix.*.
+    3) Build & store the canonical matrix under uploads/<owner>/<dataset_id>/matrix.*
+       (plus the sample-major layout when requested).
     4) Update Dataset.storage_path, n_rows, n_cols.
     """
     tmp_path, size = save_upload(owner.id, upload)
@@ -204,7 +266,7 @@ def create_dataset(
     db.commit()
     db.refresh(ds) 
 
-    canon_path, n_rows, n_cols = persist_canonical(owner.id, ds.id, tmp_path)
+    canon_path, n_rows, n_cols = persist_canonical(owner.id, ds.id, tmp_path, sample_major=sample_major)
     ds.storage_path = str(canon_path)
     ds.n_rows = n_rows
     ds.n_cols = n_cols
@@ -230,6 +292,11 @@ def delete_dataset(db: Session, owner: User, dataset_id: int) -> bool:
     )
     if not ds:
         return False
+    # run rows go with the dataset (ON DELETE CASCADE); their artifact dirs are removed here
+    run_dirs = [
+        Path(settings.STORAGE_DIR) / "runs" / str(rid)
+        for (rid,) in db.query(AnalysisRun.id).filter(AnalysisRun.dataset_id == ds.id)
+    ]
 
     try:
         p = Path(ds.storage_path)
@@ -241,7 +308,13 @@ def delete_dataset(db: Session, owner: User, dataset_id: int) -> bool:
                 p.unlink(missing_ok=True)
     except Exception:
         pass
+    try:
+        gene_search.remove_dataset(owner.id, dataset_id)
+    except Exception:
+        pass
 
     db.delete(ds)
     db.commit()
+    for d in run_dirs:
+        shutil.rmtree(d, ignore_errors=True)
     return True
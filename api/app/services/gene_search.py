@@ -0,0 +1,237 @@
+"""
+Per-user gene identifier search across datasets.
+
+One index per user at uploads/<owner_id>/genes.search.npz: every gene id of
+every dataset as (key, id, dataset_id, row), sorted by key, where key is the
+lower-cased id and row the id's position in the dataset's canonical file.
+A prefix is the key range [q, q + U+10FFFF), found with two binary searches;
+an exact match is the same with the whole id.
+
+Datasets are added at ingest and dropped on delete. The index also records
+each dataset's file signature; readers pass the user's current datasets to
+load_user_index, which re-reads the ids of datasets that are missing or have
+changed (e.g. ingested before this index existed) and drops deleted ones.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.config import settings
+
+INDEX_NAME = "genes.search.npz"
+_PREFIX_END = "\U0010ffff"
+
+_locks: Dict[int, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock(owner_id: int) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(owner_id, threading.Lock())
+
+
+def index_path(owner_id: int) -> Path:
+    return Path(settings.UPLOAD_DIR).resolve() / str(owner_id) / INDEX_NAME
+
+
+def _signature(path: str | Path) -> str:
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def _read_ids(canon_path: Path) -> np.ndarray:
+    """gene_id column (the first column) of a canonical file, as strings."""
+    if canon_path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        first = pq.ParquetFile(canon_path).schema_arrow.names[0]
+        col = pq.read_table(canon_path, columns=[first]).column(0).to_pandas()
+    else:
+        from app.utils.dataread import read_table_any
+
+        df = read_table_any(str(canon_path))
+        col = df.iloc[:, 0]
+    return col.astype(str).to_numpy().astype(str)
+
+
+class GeneSearchIndex:
+    def __init__(self, keys: np.ndarray, ids: np.ndarray, dataset: np.ndarray, row: np.ndarray, datasets: Dict[int, str]):
+        self.keys, self.ids, self.dataset, self.row = keys, ids, dataset, row
+        self.datasets = datasets
+
+    @classmethod
+    def empty(cls) -> "GeneSearchIndex":
+        return cls(np.array([], dtype=str), np.array([], dtype=str),
+                   np.array([], dtype=np.int32), np.array([], dtype=np.int64), {})
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _range(self, lo_key: str, hi_key: str) -> slice:
+        lo = int(np.searchsorted(self.keys, lo_key, side="left"))
+        hi = int(np.searchsorted(self.keys, hi_key, side="right"))
+        return slice(lo, hi)
+
+    def prefix(self, q: str, limit: int = 20) -> List[dict]:
+        """Up to `limit` distinct ids starting with `q` (case-insensitive), with the datasets holding each."""
+        q = q.lower()
+        sl = self._range(q, q + _PREFIX_END)
+        out: List[dict] = []
+        by_id: Dict[str, dict] = {}
+        for gid, ds in zip(self.ids[sl], self.dataset[sl]):
+            hit = by_id.get(gid)
+            if hit is None:
+                if len(out) == limit:
+                    break
+                hit = by_id[gid] = {"gene_id": str(gid), "datasets": []}
+                out.append(hit)
+            if int(ds) not in hit["datasets"]:
+                hit["datasets"].append(int(ds))
+        return out
+
+    def exact(self, gene_id: str) -> Dict[int, List[int]]:
+        """{dataset_id: rows} holding `gene_id` (case-insensitive)."""
+        key = gene_id.lower()
+        sl = self._range(key, key)
+        hits: Dict[int, List[int]] = {}
+        for ds, r in zip(self.dataset[sl], self.row[sl]):
+            hits.setdefault(int(ds), []).append(int(r))
+        return hits
+
+
+def _sorted(keys, ids, dataset, row) -> Tuple[np.ndarray, ...]:
+    order = np.lexsort((row, dataset, ids, keys))
+    return keys[order], ids[order], dataset[order], row[order]
+
+
+def _save(owner_id: int, index: GeneSearchIndex) -> None:
+    out = index_path(owner_id)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    meta = {"datasets": {str(k): v for k, v in index.datasets.items()}}
+    tmp = out.with_name(f"{out.name}.{uuid.uuid4().hex}.tmp")
+    with tmp.open("wb") as f:
+        np.savez(f, meta=np.asarray(json.dumps(meta)), keys=index.keys, ids=index.ids,
+                 dataset=index.dataset, row=index.row)
+    os.replace(tmp, out)
+
+
+@lru_cache(maxsize=32)
+def _open(path: str, mtime_ns: int) -> GeneSearchIndex:
+    with np.load(path) as z:
+        meta = json.loads(str(z["meta"]))
+        index = GeneSearchIndex(z["keys"], z["ids"], z["dataset"], z["row"],
+                                {int(k): v for k, v in meta["datasets"].items()})
+    return index
+
+
+def _load(owner_id: int) -> GeneSearchIndex:
+    p = index_path(owner_id)
+    try:
+        return _open(str(p), p.stat().st_mtime_ns)
+    except (OSError, KeyError, ValueError):
+        return GeneSearchIndex.empty()
+
+
+def _rewrite(owner_id: int, index: GeneSearchIndex, drop: List[int], add: Dict[int, Path]) -> GeneSearchIndex:
+    """Index with the `drop` datasets removed and the `add` datasets (re)read; saved."""
+    gone = set(drop) | set(add)
+    keep = ~np.isin(index.dataset, list(gone)) if gone else np.ones(len(index), dtype=bool)
+    keys, ids, dataset, row = [index.keys[keep]], [index.ids[keep]], [index.dataset[keep]], [index.row[keep]]
+    datasets = {k: v for k, v in index.datasets.items() if k not in gone}
+    for dataset_id, path in add.items():
+        try:
+            sig = _signature(path)
+        except OSError:
+            continue
+        # an unreadable file is recorded with no ids so it isn't re-read until it changes
+        datasets[dataset_id] = sig
+        try:
+            gids = _read_ids(path)
+        except Exception:
+            continue
+        keys.append(np.char.lower(gids))
+        ids.append(gids)
+        dataset.append(np.full(len(gids), dataset_id, dtype=np.int32))
+        row.append(np.arange(len(gids), dtype=np.int64))
+    parts = [np.concatenate(a) for a in (keys, ids, dataset, row)]
+    new = GeneSearchIndex(*_sorted(*parts), datasets)
+    _save(owner_id, new)
+    return new
+
+
+def add_dataset(owner_id: int, dataset_id: int, canon_path: Path) -> None:
+    """(Re)index one dataset's gene ids; called at ingest."""
+    with _lock(owner_id):
+        _rewrite(owner_id, _load(owner_id), [], {dataset_id: Path(canon_path)})
+
+
+def remove_dataset(owner_id: int, dataset_id: int) -> None:
+    with _lock(owner_id):
+        index = _load(owner_id)
+        if dataset_id in index.datasets:
+            _rewrite(owner_id, index, [dataset_id], {})
+
+
+def load_user_index(owner_id: int, datasets: Dict[int, str]) -> GeneSearchIndex:
+    """
+    The user's index, brought up to date with `datasets` ({id: storage path},
+    all of the user's datasets): stale or missing datasets are re-read and
+    deleted ones dropped before it is returned.
+    """
+    def stale(index: GeneSearchIndex):
+        add: Dict[int, Path] = {}
+        for dataset_id, path in datasets.items():
+            try:
+                sig = _signature(path)
+            except OSError:
+                continue
+            if index.datasets.get(dataset_id) != sig:
+                add[dataset_id] = Path(path)
+        return [d for d in index.datasets if d not in datasets], add
+
+    index = _load(owner_id)
+    drop, add = stale(index)
+    if not drop and not add:
+        return index
+    with _lock(owner_id):
+        index = _load(owner_id)
+        drop, add = stale(index)
+        if drop or add:
+            index = _rewrite(owner_id, index, drop, add)
+    return index
+
+
+def expression(index: GeneSearchIndex, datasets: Dict[int, str], gene_id: str) -> List[dict]:
+    """
+    The rows of `gene_id` in every dataset holding it, read in parallel
+    (GENE_SEARCH_WORKERS threads) straight from the rows' row groups.
+    """
+    import pandas as pd
+    from app.services.matrix_store import read_rows
+
+    hits = {d: rows for d, rows in index.exact(gene_id).items() if d in datasets}
+
+    def one(item):
+        dataset_id, rows = item
+        df = read_rows(Path(datasets[dataset_id]), rows)
+        return {
+            "dataset_id": dataset_id,
+            "columns": df.columns.tolist(),
+            "rows": df.astype(object).where(pd.notnull(df), None).values.tolist(),
+        }
+
+    if not hits:
+        return []
+    workers = max(1, min(settings.GENE_SEARCH_WORKERS, len(hits)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(one, sorted(hits.items())))
+
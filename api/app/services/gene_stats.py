@@ -0,0 +1,120 @@
+"""
+Per-gene summary statistics of the canonical matrix, kept as a sidecar.
+
+matrix.genestats.parquet holds one row per matrix row, in file order:
+
+  gene_id, n (non-null samples), mean, m2 (sum of squared deviations), min, max
+
+with the matrix signature it describes in the schema metadata. The columns
+are Welford/Chan moments, so the stats of new samples or new genes are
+merged in without rereading the matrix (see app.services.versions);
+variance() is m2 / (n - 1), the same as pandas' var(skipna=True).
+"""
+from __future__ import annotations
+
+import os
+import uuid
+import warnings
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+GENE_STATS_NAME = "matrix.genestats.parquet"
+MOMENTS = ("n", "mean", "m2", "min", "max")
+
+
+def _signature(path: str | Path) -> str:
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def gene_stats_path(canon_path: Path) -> Path:
+    return Path(canon_path).parent / GENE_STATS_NAME
+
+
+def block_stats(values: np.ndarray) -> Dict[str, np.ndarray]:
+    """Row-wise moments of a genes x samples block (NaN = missing)."""
+    a = np.asarray(values, dtype=np.float64)
+    n = np.sum(~np.isnan(a), axis=1).astype(np.int64)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(a, axis=1) if a.shape[1] else np.full(len(a), np.nan)
+        m2 = np.nansum((a - mean[:, None]) ** 2, axis=1)
+        lo = np.nanmin(a, axis=1) if a.shape[1] else np.full(len(a), np.nan)
+        hi = np.nanmax(a, axis=1) if a.shape[1] else np.full(len(a), np.nan)
+    return {"n": n, "mean": mean, "m2": m2, "min": lo, "max": hi}
+
+
+def merge(a: Dict[str, np.ndarray], b: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Moments of the union of two sample sets over the same genes (Chan et al.)."""
+    na, nb = a["n"].astype(np.float64), b["n"].astype(np.float64)
+    n = na + nb
+    with np.errstate(invalid="ignore", divide="ignore"):
+        delta = np.nan_to_num(b["mean"]) - np.nan_to_num(a["mean"])
+        frac = np.where(n > 0, nb / n, 0.0)
+        mean = np.where(n > 0, np.nan_to_num(a["mean"]) + delta * frac, np.nan)
+        m2 = np.nan_to_num(a["m2"]) + np.nan_to_num(b["m2"]) + delta ** 2 * na * frac
+    return {
+        "n": (a["n"] + b["n"]).astype(np.int64),
+        "mean": mean,
+        "m2": np.where(n > 0, m2, 0.0),
+        "min": np.fmin(a["min"], b["min"]),
+        "max": np.fmax(a["max"], b["max"]),
+    }
+
+
+def variance(stats: pd.DataFrame) -> np.ndarray:
+    n = stats["n"].to_numpy(dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 1, stats["m2"].to_numpy() / (n - 1), np.nan)
+
+
+def frame(gene_ids, moments: Dict[str, np.ndarray]) -> pd.DataFrame:
+    return pd.DataFrame({"gene_id": np.asarray(gene_ids).astype(str), **{k: moments[k] for k in MOMENTS}})
+
+
+def moments_of(stats: pd.DataFrame) -> Dict[str, np.ndarray]:
+    return {k: stats[k].to_numpy() for k in MOMENTS}
+
+
+def write_gene_stats(canon_path: Path, stats: pd.DataFrame) -> Path:
+    """Store `stats` (rows in matrix order) stamped with the matrix's current signature."""
+    out = gene_stats_path(canon_path)
+    table = pa.Table.from_pandas(stats, preserve_index=False)
+    table = table.replace_schema_metadata({"signature": _signature(canon_path)})
+    tmp = out.with_name(f"{out.name}.{uuid.uuid4().hex}.tmp")
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, out)
+    return out
+
+
+def build_gene_stats(canon_path: Path, df: Optional[pd.DataFrame] = None) -> Path:
+    """Compute the sidecar from `df` (the matrix just written) or by streaming the row groups."""
+    if df is not None:
+        num = df.iloc[:, 1:].select_dtypes(include=np.number)
+        return write_gene_stats(canon_path, frame(df["gene_id"], block_stats(num.to_numpy(dtype=np.float64, na_value=np.nan))))
+    parts = []
+    pf = pq.ParquetFile(canon_path)
+    for i in range(pf.metadata.num_row_groups):
+        part = pf.read_row_group(i).to_pandas()
+        num = part.iloc[:, 1:].select_dtypes(include=np.number)
+        parts.append(frame(part["gene_id"], block_stats(num.to_numpy(dtype=np.float64, na_value=np.nan))))
+    stats = pd.concat(parts, ignore_index=True) if parts else frame([], block_stats(np.empty((0, 0))))
+    return write_gene_stats(canon_path, stats)
+
+
+def load_gene_stats(canon_path: Path) -> Optional[pd.DataFrame]:
+    """The stored stats when they describe the matrix as it is now, else None."""
+    p = gene_stats_path(canon_path)
+    try:
+        sig = _signature(canon_path)
+        meta = pq.read_schema(p).metadata or {}
+    except OSError:
+        return None
+    if meta.get(b"signature", b"").decode() != sig:
+        return None
+    return pd.read_parquet(p)
@@ -0,0 +1,129 @@
+"""
+Multi-resolution tile pyramid for clustered expression heatmaps.
+
+Level `max_z` is the ordered matrix at full resolution; each level below it
+halves both axes by aggregating 2x2 cells (NaN-aware mean and max), down to
+level 0 which fits in a single TILE x TILE tile. Levels are stored as
+float32 .npy files under runs/<id>/tiles/ and memory-mapped when serving, so
+a tile request reads at most TILE x TILE cells whatever the matrix size.
+(float16 would halve the files but overflows above 65504 and keeps ~3
+significant digits, which breaks unscaled count matrices.)
+"""
+from __future__ import annotations
+
+import json
+import math
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+from app.config import settings
+from app.services.run_events import tick
+
+TILE = 256
+AGGS = ("mean", "max")
+F16_MAX = float(np.finfo(np.float16).max)
+
+
+def tiles_dir(run_id: int) -> Path:
+    return Path(settings.STORAGE_DIR) / "runs" / str(run_id) / "tiles"
+
+
+def _level_path(root: Path, z: int, agg: str) -> Path:
+    return root / f"z{z}.{agg}.npy"
+
+
+def _pool(sums: np.ndarray, counts: np.ndarray, maxes: np.ndarray):
+    """2x2 pooling of (sum, count, max) grids, padding odd edges."""
+    h, w = sums.shape
+    ph, pw = h + (h & 1), w + (w & 1)
+    if (ph, pw) != (h, w):
+        sums = np.pad(sums, ((0, ph - h), (0, pw - w)))
+        counts = np.pad(counts, ((0, ph - h), (0, pw - w)))
+        maxes = np.pad(maxes, ((0, ph - h), (0, pw - w)), constant_values=np.nan)
+    s = sums.reshape(ph // 2, 2, pw // 2, 2).sum(axis=(1, 3))
+    c = counts.reshape(ph // 2, 2, pw // 2, 2).sum(axis=(1, 3))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        m = np.nanmax(maxes.reshape(ph // 2, 2, pw // 2, 2), axis=(1, 3))
+    return s, c, m
+
+
+def build_pyramid(M: np.ndarray, root: Path) -> dict:
+    """
+    Write every level of the pyramid for the (already ordered) matrix M and
+    return its metadata, also saved as meta.json.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    n_rows, n_cols = M.shape
+    max_z = max(0, math.ceil(math.log2(max(n_rows, n_cols, 1) / TILE)))
+
+    base = np.asarray(M, dtype=np.float32)
+    finite = np.isfinite(base)
+    # the full-resolution level has one value per cell, so mean == max there
+    np.save(_level_path(root, max_z, "mean"), base)
+
+    sums = np.where(finite, base, 0.0).astype(np.float32)
+    counts = finite.astype(np.int32)
+    maxes = np.where(finite, base, np.nan)
+    levels = [{"z": max_z, "shape": [n_rows, n_cols], "step": 1}]
+    for z in range(max_z - 1, -1, -1):
+        sums, counts, maxes = _pool(sums, counts, maxes)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(counts > 0, sums / counts, np.nan)
+        np.save(_level_path(root, z, "mean"), mean.astype(np.float32))
+        np.save(_level_path(root, z, "max"), maxes.astype(np.float32))
+        levels.append({"z": z, "shape": list(mean.shape), "step": 2 ** (max_z - z)})
+        tick(max_z - z, max_z)  # progress, and a cancel stops between levels
+
+    vals = base[finite]
+    lo, hi = (np.percentile(vals, [1, 99]).tolist() if vals.size else [0.0, 0.0])
+    meta = {
+        "tile_size": TILE,
+        "min_zoom": 0,
+        "max_zoom": max_z,
+        "shape": [n_rows, n_cols],
+        "levels": sorted(levels, key=lambda l: l["z"]),
+        "aggs": list(AGGS),
+        "value_range": [round(lo, 6), round(hi, 6)],
+        # clients asking for float16 tiles need every value within its range
+        "fits_f16": bool(np.abs(vals).max() <= F16_MAX) if vals.size else True,
+    }
+    (root / "meta.json").write_text(json.dumps(meta))
+    return meta
+
+
+def load_meta(root: Path) -> dict:
+    try:
+        return json.loads((root / "meta.json").read_text())
+    except FileNotFoundError:
+        raise ValueError("Tile pyramid not found for this run")
+
+
+def read_tile(root: Path, z: int, x: int, y: int, agg: str = "mean") -> tuple[np.ndarray, dict]:
+    """
+    Tile (x = column index, y = row index) at zoom z as a float32 array of
+    at most TILE x TILE cells; edge tiles are smaller. Also returns the
+    position of the tile in full-resolution rows/columns.
+    """
+    if agg not in AGGS:
+        raise ValueError(f"agg must be one of {', '.join(AGGS)}")
+    meta = load_meta(root)
+    if not 0 <= z <= meta["max_zoom"]:
+        raise ValueError(f"z must be between 0 and {meta['max_zoom']}")
+    level = next(l for l in meta["levels"] if l["z"] == z)
+    h, w = level["shape"]
+    if x < 0 or y < 0 or x * TILE >= w or y * TILE >= h:
+        raise ValueError("Tile outside the pyramid")
+
+    # the full-resolution level only stores "mean"
+    arr = np.load(_level_path(root, z, "mean" if z == meta["max_zoom"] else agg), mmap_mode="r")
+    tile = np.array(arr[y * TILE:(y + 1) * TILE, x * TILE:(x + 1) * TILE])
+    step = level["step"]
+    pos = {
+        "z": z, "x": x, "y": y, "agg": agg, "step": step,
+        "row_start": y * TILE * step, "col_start": x * TILE * step,
+        "shape": list(tile.shape),
+    }
+    return tile, pos
@@ -0,0 +1,399 @@
+from __future__ import annotations
+
+import json
+import os
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.config import settings
+
+GENE_INDEX_NAME = "matrix.genes.parquet"
+SAMPLE_MAJOR_NAME = "matrix.samples.parquet"
+
+
+# ---------- Writing (gene-major canonical layout) ----------
+
+def sort_by_gene(df: pd.DataFrame) -> pd.DataFrame:
+    """Stable sort of the canonical matrix by gene_id (compared as strings)."""
+    order = np.argsort(df["gene_id"].astype(str).to_numpy(), kind="stable")
+    return df.iloc[order].reset_index(drop=True)
+
+
+def write_gene_major(df: pd.DataFrame, path: Path) -> Path:
+    """
+    Write the (already gene-sorted) matrix with fixed-size row groups, column
+    statistics and page indexes so readers can jump straight to a gene range.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(
+        table,
+        path,
+        row_group_size=settings.CANONICAL_ROW_GROUP_ROWS,
+        compression="zstd",
+        write_statistics=True,
+        write_page_index=True,
+    )
+    return path
+
+
+def write_gene_index(df: pd.DataFrame, base_dir: Path) -> Path:
+    """
+    gene_id -> (row_group, offset) for the matrix written by write_gene_major.
+    Stored next to the matrix as matrix.genes.parquet.
+    """
+    rg = settings.CANONICAL_ROW_GROUP_ROWS
+    pos = np.arange(len(df), dtype=np.int64)
+    idx = pd.DataFrame({
+        "gene_id": df["gene_id"].astype(str).to_numpy(),
+        "row_group": (pos // rg).astype(np.int32),
+        "offset": (pos % rg).astype(np.int32),
+    })
+    path = base_dir / GENE_INDEX_NAME
+    idx.to_parquet(path, index=False)
+    return path
+
+
+def write_sample_major(df: pd.DataFrame, base_dir: Path) -> Path | None:
+    """
+    Optional second layout: one row per sample, one column per gene
+    (first column sample_id). Written alongside matrix.parquet so that
+    sample-wise operations never transpose the gene-major matrix.
+    Skipped (returns None) when gene ids are not unique.
+    """
+    num = df.set_index(df["gene_id"].astype(str)).drop(columns=["gene_id"])
+    if not num.index.is_unique:
+        return None
+    num = num.select_dtypes(include=np.number)
+    t = num.T
+    t.index.name = "sample_id"
+    t.columns = t.columns.astype(str)
+    t = t.reset_index()
+    path = base_dir / SAMPLE_MAJOR_NAME
+    pq.write_table(
+        pa.Table.from_pandas(t, preserve_index=False),
+        path,
+        row_group_size=settings.SAMPLE_MAJOR_ROW_GROUP_ROWS,
+        compression="zstd",
+    )
+    return path
+
+
+# ---------- Appending (app.services.versions) ----------
+# Both rewrites stream the existing matrix one row group at a time and keep
+# CANONICAL_ROW_GROUP_ROWS, so memory stays at one row group plus the fragment.
+
+def _writer(path: Path, schema: pa.Schema) -> pq.ParquetWriter:
+    return pq.ParquetWriter(path, schema, compression="zstd", write_statistics=True, write_page_index=True)
+
+
+def _unified_schema(old: pa.Schema, frag: pa.Schema) -> pa.Schema:
+    """
+    The matrix schema, widened where the fragment disagrees on a column type
+    (gene_id to string, sample columns to float64).
+    """
+    fields = []
+    for f in old:
+        i = frag.get_field_index(f.name)
+        if i >= 0 and frag.field(i).type != f.type:
+            f = pa.field(f.name, pa.string() if f.name == "gene_id" else pa.float64())
+        fields.append(f)
+    return pa.schema(fields)
+
+
+def _conform(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """`table` with `schema`'s columns in its order; absent columns are all-null."""
+    cols = []
+    for f in schema:
+        i = table.schema.get_field_index(f.name)
+        cols.append(table.column(i).cast(f.type) if i >= 0 else pa.nulls(table.num_rows, f.type))
+    return pa.Table.from_arrays(cols, schema=schema)
+
+
+def append_columns(canon_path: Path, frag: pd.DataFrame, out: Path) -> Path:
+    """
+    Write to `out` the matrix with the sample columns of `frag` added, rows
+    matched on gene_id (unique on both sides; genes absent from the fragment
+    get nulls). Row order and row groups are unchanged, so the gene index
+    stays valid.
+    """
+    pf = pq.ParquetFile(canon_path)
+    ids = pq.read_table(canon_path, columns=["gene_id"]).column(0).to_pandas().astype(str)
+    aligned = frag.set_index(frag["gene_id"].astype(str)).drop(columns=["gene_id"]).reindex(ids.to_numpy())
+    extra = pa.Table.from_pandas(aligned.reset_index(drop=True), preserve_index=False)
+    schema = pa.schema(list(pf.schema_arrow) + list(extra.schema))
+    start = 0
+    with _writer(out, schema) as w:
+        for i in range(pf.metadata.num_row_groups):
+            t = pf.read_row_group(i)
+            part = extra.slice(start, t.num_rows)
+            for name, col in zip(part.column_names, part.columns):
+                t = t.append_column(name, col)
+            w.write_table(t, row_group_size=settings.CANONICAL_ROW_GROUP_ROWS)
+            start += t.num_rows
+    return out
+
+
+def merge_order(old_ids: np.ndarray, new_ids: np.ndarray) -> np.ndarray:
+    """
+    Source of each output row when `new_ids` (gene-sorted) are merged into
+    the gene-sorted matrix: True for a matrix row, False for a fragment row.
+    Ties keep matrix rows first, as sort_by_gene would.
+    """
+    pos = np.searchsorted(old_ids.astype(str), new_ids.astype(str), side="right")
+    is_old = np.ones(len(old_ids) + len(new_ids), dtype=bool)
+    is_old[pos + np.arange(len(new_ids))] = False
+    return is_old
+
+
+def append_rows(canon_path: Path, frag: pd.DataFrame, out: Path) -> Tuple[Path, np.ndarray]:
+    """
+    Write to `out` the matrix with the (gene-sorted) rows of `frag` merged in
+    gene order; sample columns absent from the fragment get nulls. Returns
+    (out, merge_order mask).
+    """
+    pf = pq.ParquetFile(canon_path)
+    old_ids = pq.read_table(canon_path, columns=["gene_id"]).column(0).to_pandas().astype(str).to_numpy()
+    is_old = merge_order(old_ids, frag["gene_id"].astype(str).to_numpy())
+    new = pa.Table.from_pandas(frag, preserve_index=False)
+    schema = _unified_schema(pf.schema_arrow, new.schema)
+    new = _conform(new, schema)
+
+    rg = settings.CANONICAL_ROW_GROUP_ROWS
+    groups = (_conform(pf.read_row_group(i), schema) for i in range(pf.metadata.num_row_groups))
+    buf = pa.Table.from_batches([], schema=schema)
+    new_at = 0
+    with _writer(out, schema) as w:
+        for lo in range(0, len(is_old), rg):
+            src = is_old[lo:lo + rg]
+            n_old = int(src.sum())
+            while buf.num_rows < n_old:
+                buf = pa.concat_tables([buf, next(groups)])
+            old_part, buf = buf.slice(0, n_old), buf.slice(n_old)
+            n_new = len(src) - n_old
+            new_part = new.slice(new_at, n_new)
+            new_at += n_new
+            take = np.empty(len(src), dtype=np.int64)
+            take[src] = np.arange(n_old)
+            take[~src] = n_old + np.arange(n_new)
+            w.write_table(pa.concat_tables([old_part, new_part]).take(pa.array(take)), row_group_size=rg)
+    return out, is_old
+
+
+# ---------- Reading ----------
+
+def gene_index_path(canon_path: Path) -> Path:
+    return canon_path.parent / GENE_INDEX_NAME
+
+
+@lru_cache(maxsize=64)
+def _load_gene_index(path: str, mtime_ns: int) -> pd.DataFrame:
+    # mtime_ns is only part of the cache key, so a rewritten index is reloaded
+    return pd.read_parquet(path)
+
+
+def load_gene_index(canon_path: Path) -> pd.DataFrame | None:
+    p = gene_index_path(canon_path)
+    try:
+        mtime = p.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return _load_gene_index(str(p), mtime)
+
+
+def read_genes(canon_path: Path, ids: List[str]) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Return (rows for the requested genes, ids that were not found).
+    Uses the gene index to read only the row groups that hold the requested
+    genes; datasets ingested before the index existed fall back to a full read.
+    """
+    wanted = list(dict.fromkeys(str(i) for i in ids))
+    idx = load_gene_index(canon_path) if canon_path.suffix == ".parquet" else None
+
+    if idx is None:
+        if canon_path.suffix == ".parquet":
+            df = pd.read_parquet(canon_path)
+        else:
+            df = pd.read_csv(canon_path)
+        hit = df[df["gene_id"].astype(str).isin(wanted)]
+        found = set(hit["gene_id"].astype(str))
+        return hit.reset_index(drop=True), [g for g in wanted if g not in found]
+
+    hits = idx[idx["gene_id"].isin(wanted)]
+    found = set(hits["gene_id"])
+    missing = [g for g in wanted if g not in found]
+
+    pf = pq.ParquetFile(canon_path)
+    parts = []
+    for rg, grp in hits.groupby("row_group", sort=True):
+        t = pf.read_row_group(int(rg))
+        parts.append(t.take(pa.array(grp["offset"].to_numpy(), type=pa.int32())))
+
+    if not parts:
+        return pf.schema_arrow.empty_table().to_pandas(), missing
+    return pa.concat_tables(parts).to_pandas(), missing
+
+
+def read_rows(canon_path: Path, rows: List[int]) -> pd.DataFrame:
+    """
+    Rows at file positions `rows` (ascending), reading only the row groups
+    that hold them. Non-parquet files are scanned with the rows filtered out
+    in the scan, so the matrix is never materialized.
+    """
+    rows = np.asarray(sorted(set(int(r) for r in rows)), dtype=np.int64)
+    if canon_path.suffix != ".parquet":
+        import polars as pl
+        from app.utils.dataread import scan_any
+
+        ldf = scan_any(str(canon_path)).with_row_index("__row")
+        return ldf.filter(pl.col("__row").is_in(rows.tolist())).drop("__row").collect().to_pandas()
+
+    pf = pq.ParquetFile(canon_path)
+    sizes = [pf.metadata.row_group(i).num_rows for i in range(pf.metadata.num_row_groups)]
+    starts = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    rows = rows[(rows >= 0) & (rows < starts[-1])]
+    rg = np.searchsorted(starts, rows, side="right") - 1
+    parts = []
+    for g in np.unique(rg):
+        t = pf.read_row_group(int(g))
+        parts.append(t.take(pa.array(rows[rg == g] - starts[g])))
+    if not parts:
+        return pf.schema_arrow.empty_table().to_pandas()
+    return pa.concat_tables(parts).to_pandas()
+
+
+# ---------- Orientation planner ----------
+
+def sample_major_path(canon_path: Path) -> Path:
+    return canon_path.parent / SAMPLE_MAJOR_NAME
+
+
+def is_canonical(canon_path: Path) -> bool:
+    return canon_path.name == "matrix.parquet"
+
+
+def has_sample_major(canon_path: Path) -> bool:
+    p = sample_major_path(canon_path)
+    return p.exists() and p.stat().st_mtime_ns >= canon_path.stat().st_mtime_ns
+
+
+def plan_orientation(canon_path: Path, want: str) -> str:
+    """
+    Pick the stored layout to read for an operation that wants `want`
+    ("genes": genes as rows, "samples": samples as rows). Returns the layout
+    that serves it without a full transpose when one exists.
+    """
+    if want == "samples" and has_sample_major(canon_path):
+        return "samples"
+    return "genes"
+
+
+def _read_parquet_layout(canon_path: Path, src: str, columns: List[str] | None) -> pd.DataFrame:
+    if src == "samples":
+        cols = ["sample_id"] + list(columns) if columns else None
+        df = pd.read_parquet(sample_major_path(canon_path), columns=cols)
+        out = df.set_index("sample_id")
+    else:
+        cols = ["gene_id"] + list(columns) if columns else None
+        df = pd.read_parquet(canon_path, columns=cols)
+        out = df.set_index(df["gene_id"].astype(str)).drop(columns=["gene_id"])
+        out.index.name = "gene_id"
+    return out.select_dtypes(include=np.number)
+
+
+def read_oriented(canon_path: Path, want: str, columns: List[str] | None = None) -> pd.DataFrame:
+    """
+    Numeric matrix of a canonical dataset with ids as index:
+      want="genes"   -> gene_id index, sample columns
+      want="samples" -> sample_id index, gene columns
+    Reads from the layout chosen by plan_orientation; only when the wanted
+    layout is not on disk is the other one transposed.
+    With MATRIX_MMAP_CACHE the values come zero-copy from the float32 cache
+    (and the transpose is a view); otherwise the parquet is decoded.
+    `columns` optionally projects the columns of the result.
+    """
+    src = plan_orientation(canon_path, want)
+    out = None
+    if settings.MATRIX_MMAP_CACHE:
+        try:
+            out = read_mmap_frame(canon_path, src)
+        except OSError:
+            out = None
+    if out is None:
+        pushdown = columns if src == want else None
+        out = _read_parquet_layout(canon_path, src, pushdown)
+
+    if src != want:
+        out = out.T
+    if columns:
+        out = out[[c for c in columns if c in out.columns]]
+    return out
+
+
+# ---------- float32 memory-mapped cache ----------
+# Derived from a stored layout: <layout>.f32.npy holds the numeric block as a
+# C-contiguous float32 array, <layout>.f32.json its row ids and columns. Loads
+# are np.load(mmap_mode="r"), so every worker shares the OS page cache.
+
+def _mmap_paths(src: Path) -> Tuple[Path, Path]:
+    stem = src.name[: -len(src.suffix)]
+    return src.with_name(f"{stem}.f32.npy"), src.with_name(f"{stem}.f32.json")
+
+
+def build_mmap(src: Path, id_col: str) -> Path:
+    df = pd.read_parquet(src)
+    ids = df[id_col].astype(str).tolist()
+    num = df.drop(columns=[id_col]).select_dtypes(include=np.number)
+    arr = np.ascontiguousarray(num.to_numpy(dtype=np.float32, na_value=np.nan))
+
+    npy, meta = _mmap_paths(src)
+    tag = uuid.uuid4().hex
+    tmp_npy = npy.with_name(f"{npy.name}.{tag}.tmp")
+    tmp_meta = meta.with_name(f"{meta.name}.{tag}.tmp")
+    with tmp_npy.open("wb") as f:
+        np.save(f, arr)
+    tmp_meta.write_text(json.dumps({
+        "source_mtime_ns": src.stat().st_mtime_ns,
+        "index_name": id_col,
+        "index": ids,
+        "columns": [str(c) for c in num.columns],
+    }))
+    os.replace(tmp_npy, npy)
+    os.replace(tmp_meta, meta)
+    return npy
+
+
+@lru_cache(maxsize=32)
+def _open_mmap(npy: str, meta: str, meta_mtime_ns: int):
+    info = json.loads(Path(meta).read_text())
+    arr = np.load(npy, mmap_mode="r")
+    return arr, info
+
+
+def load_mmap(src: Path, id_col: str):
+    """(memmap array, sidecar info) for a stored layout, (re)building when stale."""
+    npy, meta = _mmap_paths(src)
+    src_mtime = src.stat().st_mtime_ns
+    for _ in range(2):
+        if npy.exists() and meta.exists():
+            arr, info = _open_mmap(str(npy), str(meta), meta.stat().st_mtime_ns)
+            if info.get("source_mtime_ns") == src_mtime:
+                return arr, info
+        build_mmap(src, id_col)
+    raise OSError(f"Could not build matrix cache for {src}")
+
+
+def read_mmap_frame(canon_path: Path, src: str) -> pd.DataFrame:
+    """DataFrame view over the float32 cache of one stored layout (no copy)."""
+    if src == "samples":
+        arr, info = load_mmap(sample_major_path(canon_path), "sample_id")
+    else:
+        arr, info = load_mmap(canon_path, "gene_id")
+    index = pd.Index(info["index"], name=info["index_name"])
+    return pd.DataFrame(arr, index=index, columns=info["columns"], copy=False)
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+from app.config import settings
+from app.services.clustering import EXACT_MAX
+
+F64 = 8
+F32 = 4
+
+# row/column block sizes used by the chunked recipe paths
+CORR_BLOCK = 512
+VAR_CHUNK = 4096
+PCA_BATCH = 256
+GRID = 512
+
+
+class MemoryBudgetExceeded(ValueError):
+    def __init__(self, message: str, estimate: int | None = None):
+        super().__init__(message)
+        self.estimate = estimate
+
+
+def budget_bytes() -> int:
+    return int(settings.ANALYTICS_MEM_BUDGET_MB) * 1024 * 1024
+
+
+def estimate_peak(recipe_key: str, params: dict, n_rows: int, n_cols: int) -> Tuple[int, Optional[int]]:
+    """
+    Rough peak-memory estimate in bytes for a recipe on an n_rows (genes) x
+    n_cols (samples) matrix. Returns (in_memory, chunked); chunked is None
+    when the recipe has no out-of-core path.
+    """
+    params = params or {}
+    cells = n_rows * n_cols
+
+    if recipe_key == "correlation":
+        max_n = int(params.get("max_n", 300))
+        if params.get("axis", "samples") == "samples":
+            obs, k = n_rows, min(max_n, n_cols)
+        else:
+            obs, k = n_cols, min(max_n, n_rows)
+        # load + numeric copy, ranked/centred copies, corr + clustered copy + linkage input
+        in_memory = cells * F64 * 2 + obs * k * F64 * 3 + k * k * F64 * 3
+        # chunked clustering is approximate: normalised profiles, no k x k
+        chunked = cells * F32 + obs * k * F32 * 4 + CORR_BLOCK * k * F64 * 2 + GRID * GRID * F64 * 2
+        return in_memory, chunked
+
+    if recipe_key == "pca":
+        k = min(int(params.get("top_genes", 1000)), n_rows)
+        # log1p + variance temporaries over the full matrix, then X / Xz / SVD work
+        in_memory = cells * F64 * 3 + n_cols * k * F64 * 4
+        chunked = VAR_CHUNK * n_cols * F64 * 2 + n_cols * k * F32 * 2 + PCA_BATCH * k * F64 * 3
+        return in_memory, chunked
+
+    if recipe_key == "heatmap":
+        rows = min(int(params.get("top_genes") or n_rows), n_rows)
+        sub = rows * n_cols
+        linked = min(rows, EXACT_MAX)
+        # load + float32 matrix, filled copy, reordered copy, pyramid sums/maxes,
+        # row similarity + condensed distances
+        in_memory = cells * F64 + sub * F32 * 5 + linked * linked * (F32 + F64)
+        return in_memory, None
+
+    if recipe_key == "de":
+        return cells * F64 * 3, None
+
+    return cells * F64 * 2, None
+
+
+def choose_mode(recipe_key: str, params: dict, n_rows: int | None, n_cols: int | None) -> Tuple[str, int | None]:
+    """
+    ("memory" | "chunked", estimate) for the run, against the per-worker
+    budget. Raises MemoryBudgetExceeded when neither path fits. Datasets
+    without a recorded shape always run in memory. Runs that fit but not
+    next to the runs already executing wait in app.services.run_queue.
+    """
+    if not n_rows or not n_cols:
+        return "memory", None
+
+    in_memory, chunked = estimate_peak(recipe_key, params, int(n_rows), int(n_cols))
+    budget = budget_bytes()
+    forced = (params or {}).get("exec_mode")
+
+    if forced == "chunked" and chunked is not None:
+        return "chunked", chunked
+    if in_memory <= budget and forced != "chunked":
+        return "memory", in_memory
+    if chunked is not None and chunked <= budget:
+        return "chunked", chunked
+
+    need = min(in_memory, chunked) if chunked is not None else in_memory
+    raise MemoryBudgetExceeded(
+        f"Estimated peak memory {need / 2**20:.0f} MiB exceeds the worker budget "
+        f"of {budget / 2**20:.0f} MiB; reduce max_n/top_genes",
+        estimate=need,
+    )
@@ -0,0 +1,147 @@
+"""
+Hot dataset residency for analytics processes.
+
+Loaded dataset frames (the parsed file, or its numeric block in one
+orientation) stay in a per-process LRU bounded by RESIDENT_CACHE_MB of frame
+bytes. Entries are keyed by (path, kind) and carry the file signature they
+were loaded from; a changed file is reloaded (an "invalidation") instead of
+served. Frames over the whole budget are returned without being kept.
+
+Callers share the cached object: treat it as read-only (derive new frames,
+never modify in place).
+
+stats() is reported to app.metrics in the API process and returned by every
+batch pool worker with its run result, which is how the batch scheduler
+knows which worker holds which dataset.
+"""
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+
+from app.config import settings
+from app.metrics import RESIDENT_CACHE, RESIDENT_EVICTIONS
+
+
+def _signature(path: str | Path) -> str:
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def _size(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=False).sum())
+
+
+class _Residency:
+    def __init__(self):
+        self._items: "OrderedDict[Tuple[str, str], Tuple[str, pd.DataFrame, int]]" = OrderedDict()
+        self._used: Dict[Tuple[str, str], int] = {}
+        self._tick = 0
+        self._bytes = 0
+        self._lock = Lock()
+        self.counts = {"hit": 0, "miss": 0, "invalidated": 0, "evicted": 0}
+
+    def _count(self, result: str) -> None:
+        self.counts[result] += 1
+        if result == "evicted":
+            RESIDENT_EVICTIONS.inc()
+        else:
+            RESIDENT_CACHE.inc(result=result)
+
+    def _drop(self, key) -> None:
+        _, _, size = self._items.pop(key)
+        self._used.pop(key, None)
+        self._bytes -= size
+
+    def _touch(self, key) -> None:
+        self._tick += 1
+        self._used[key] = self._tick
+
+    def get(self, path: str | Path, kind: str, load: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        key = (str(Path(path).resolve()), kind)
+        sig = _signature(path)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] == sig:
+                self._items.move_to_end(key)
+                self._touch(key)
+                self._count("hit")
+                return item[1]
+            if item is not None:
+                self._drop(key)
+                self._count("invalidated")
+            else:
+                self._count("miss")
+
+        # loaded outside the lock; two concurrent misses both load, the last one is kept
+        df = load()
+        size = _size(df)
+        limit = settings.RESIDENT_CACHE_MB * 1024 * 1024
+        if size > limit:
+            return df
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = (sig, df, size)
+            self._touch(key)
+            self._bytes += size
+            while self._bytes > limit and self._items:
+                self._drop(next(iter(self._items)))
+                self._count("evicted")
+        return df
+
+    def mark(self) -> int:
+        with self._lock:
+            return self._tick
+
+    def used_since(self, tick: int) -> List[str]:
+        """Resident paths read (or loaded) after mark() returned `tick`."""
+        with self._lock:
+            return list(dict.fromkeys(k[0] for k, t in self._used.items() if t > tick))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self.counts,
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "limit_bytes": settings.RESIDENT_CACHE_MB * 1024 * 1024,
+                "datasets": list(dict.fromkeys(p for p, _ in self._items)),
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._used.clear()
+            self._bytes = 0
+
+
+_resident = _Residency()
+
+
+def resident(path: str | Path, kind: str, load: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    """The frame `load()` returns for `path`, served from memory while the file is unchanged."""
+    if settings.RESIDENT_CACHE_MB <= 0:
+        return load()
+    return _resident.get(path, kind, load)
+
+
+def stats() -> Dict:
+    return _resident.stats()
+
+
+def mark() -> int:
+    return _resident.mark()
+
+
+def used_since(tick: int) -> List[str]:
+    return _resident.used_since(tick)
+
+
+def clear() -> None:
+    _resident.clear()
@@ -0,0 +1,166 @@
+"""
+Live run status: an in-process pub/sub plus cooperative cancellation.
+
+The executor publishes status, stage and chunk progress (percent, ETA) for
+each run; GET /analytics/runs/{id}/events streams them to clients as
+Server-Sent Events without touching the database. The latest event per
+run is kept (bounded) so late subscribers start from the current state.
+
+Batch runs execute in pool worker processes. There set_relay() forwards
+every event published in the worker to the API process (batch_exec drains
+a multiprocessing queue into publish()), so their stages, percent and ETA
+stream like those of runs executing in the API process.
+
+Cancellation is cooperative: request_cancel() flags the run and the
+executor raises RunCanceled at its next stage boundary or chunk. The flag
+is also written as storage/runs/<id>/.cancel so runs executing in batch
+pool worker processes see it.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+from app.config import settings
+
+TERMINAL = ("succeeded", "failed", "canceled")
+MAX_TRACKED = 2048
+TICK_EVERY_S = 0.25
+
+
+class RunCanceled(Exception):
+    pass
+
+
+_lock = Lock()
+_state: "OrderedDict[int, dict]" = OrderedDict()
+_subs: dict[int, list] = {}
+_canceled: set[int] = set()
+_relay = None
+
+
+def set_relay(fn) -> None:
+    """fn(run_id, event) receives every event published in this process (worker -> API)."""
+    global _relay
+    _relay = fn
+
+
+def _flag(run_id: int) -> Path:
+    return Path(settings.STORAGE_DIR) / "runs" / str(run_id) / ".cancel"
+
+
+def publish(run_id: int, **event) -> dict:
+    """Merge `event` into the run's state and push the new state to its subscribers."""
+    with _lock:
+        state = dict(_state.pop(run_id, {"run_id": run_id}))
+        state.update(event, ts=time.time())
+        _state[run_id] = state
+        while len(_state) > MAX_TRACKED:
+            _state.popitem(last=False)
+        subs = list(_subs.get(run_id, ()))
+    for loop, q in subs:
+        loop.call_soon_threadsafe(q.put_nowait, state)
+    if _relay is not None:
+        _relay(run_id, event)
+    return state
+
+
+def snapshot(run_id: int) -> Optional[dict]:
+    with _lock:
+        return _state.get(run_id)
+
+
+@contextmanager
+def subscribe(run_id: int):
+    """asyncio.Queue receiving every state published for the run (call from the event loop)."""
+    q: asyncio.Queue = asyncio.Queue()
+    entry = (asyncio.get_running_loop(), q)
+    with _lock:
+        _subs.setdefault(run_id, []).append(entry)
+    try:
+        yield q
+    finally:
+        with _lock:
+            subs = _subs.get(run_id, [])
+            if entry in subs:
+                subs.remove(entry)
+            if not subs:
+                _subs.pop(run_id, None)
+
+
+# ---------- cancellation ----------
+
+def request_cancel(run_id: int) -> None:
+    with _lock:
+        _canceled.add(run_id)
+    flag = _flag(run_id)
+    flag.parent.mkdir(parents=True, exist_ok=True)
+    flag.touch()
+
+
+def is_canceled(run_id: int) -> bool:
+    with _lock:
+        if run_id in _canceled:
+            return True
+    return _flag(run_id).exists()
+
+
+def clear_cancel(run_id: int) -> None:
+    with _lock:
+        _canceled.discard(run_id)
+    _flag(run_id).unlink(missing_ok=True)
+
+
+# ---------- progress of the run executing in this context ----------
+
+class _Tracker:
+    def __init__(self, run_id: int):
+        self.run_id = run_id
+        self.stage = None
+        self._t0 = None
+        self._last = 0.0
+
+    def on_stage(self, stage: str) -> None:
+        if is_canceled(self.run_id):
+            raise RunCanceled()
+        self.stage, self._t0, self._last = stage, time.perf_counter(), 0.0
+        publish(self.run_id, stage=stage, percent=None, eta_s=None)
+
+    def tick(self, done: int, total: int) -> None:
+        if is_canceled(self.run_id):
+            raise RunCanceled()
+        now = time.perf_counter()
+        if now - self._last < TICK_EVERY_S and done < total:
+            return
+        self._last = now
+        elapsed = now - (self._t0 or now)
+        eta = elapsed * (total - done) / done if done else None
+        publish(self.run_id, percent=round(100.0 * done / max(total, 1), 1),
+                eta_s=None if eta is None else round(eta, 1))
+
+
+_current: ContextVar[Optional[_Tracker]] = ContextVar("run_tracker", default=None)
+
+
+@contextmanager
+def track(run_id: int):
+    """Make `run_id` the run that on_stage()/tick() report for; yields its tracker."""
+    tracker = _Tracker(run_id)
+    token = _current.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current.reset(token)
+
+
+def tick(done: int, total: int) -> None:
+    """Report chunk progress of the current stage and honour cancellation; no-op outside a run."""
+    tracker = _current.get()
+    if tracker is not None:
+        tracker.tick(done, total)
@@ -0,0 +1,150 @@
+"""
+Single (non-batch) analytics runs, executed off the request.
+
+POST /datasets/{id}/analytics/run, .../sweep and /analytics/runs/{id}/rebuild
+create the run as queued, submit() its id and return straight away. The run
+then executes on one of ANALYTICS_WORKERS threads of this API process, so
+GET /analytics/runs/{id}/events streams it live and POST .../cancel stops
+it at its next stage or chunk, which frees the slot for the next run.
+
+Runs also wait for memory: each reserves its estimated peak
+(memory_budget.choose_mode) out of ANALYTICS_MEM_BUDGET_MB, and the run at
+the head of the queue starts only once its reservation fits next to those
+already executing (or nothing else is executing). Runs too large for the
+budget even on their own are not held back; they start and are rejected.
+The queue is FIFO, so a large run is not starved by smaller ones behind it.
+
+A run is claimed with a conditional UPDATE (queued -> running), so a run
+canceled while it waited is skipped and, with several API processes, every
+run executes once. Runs still queued when a process stopped are picked up
+again by recover() at the next start.
+"""
+from __future__ import annotations
+
+import threading
+from collections import deque
+from datetime import datetime
+from typing import List
+
+from app.config import settings
+from app.models import AnalysisRun, Dataset, RunStatus
+from app.services.memory_budget import MemoryBudgetExceeded, budget_bytes, choose_mode
+from app.services.run_events import is_canceled, publish
+
+_cond = threading.Condition()
+_queue: deque = deque()  # (run_id, reserved bytes)
+_threads: List[threading.Thread] = []
+_running = 0
+_reserved = 0
+
+
+def _log(msg, *args):
+    print("[run_queue]", msg.format(*args))
+
+
+def _ensure_workers() -> None:
+    # called with _cond held
+    _threads[:] = [t for t in _threads if t.is_alive()]
+    while len(_threads) < max(1, settings.ANALYTICS_WORKERS):
+        t = threading.Thread(target=_worker, name=f"analytics-{len(_threads)}", daemon=True)
+        t.start()
+        _threads.append(t)
+
+
+def reservation(run: AnalysisRun, ds: Dataset) -> int:
+    """Bytes the run holds while it executes: its estimated peak, 0 when unknown or rejected."""
+    from app.services.sweep import envelope
+
+    params = run.params_json or {}
+    if "grid" in params:
+        params = envelope(run.recipe_key, params)
+    try:
+        _, estimate = choose_mode(run.recipe_key, params, ds.n_rows, ds.n_cols)
+    except (MemoryBudgetExceeded, ValueError):
+        return 0  # started straight away and rejected or failed by the executor
+    return int(estimate or 0)
+
+
+def submit(run_id: int, need: int = 0) -> None:
+    """Queue a run (already stored as queued) that reserves `need` bytes while executing."""
+    with _cond:
+        _queue.append((run_id, need))
+        _ensure_workers()
+        _cond.notify_all()
+
+
+def _fits(run_id: int, need: int) -> bool:
+    # called with _cond held; a canceled run only has to be popped and skipped
+    return _running == 0 or _reserved + need <= budget_bytes() or is_canceled(run_id)
+
+
+def _worker() -> None:
+    global _running, _reserved
+    while True:
+        with _cond:
+            while not _queue or not _fits(*_queue[0]):
+                _cond.wait()
+            run_id, need = _queue.popleft()
+            _running += 1
+            _reserved += need
+        try:
+            _execute(run_id)
+        except Exception as e:
+            _log("run {} crashed the worker: {!r}", run_id, e)
+        finally:
+            with _cond:
+                _running -= 1
+                _reserved -= need
+                _cond.notify_all()
+
+
+def _execute(run_id: int) -> None:
+    from app.db import SessionLocal
+    from app.services.analytics_exec import execute_inline
+
+    db = SessionLocal()
+    try:
+        claimed = (
+            db.query(AnalysisRun)
+            .filter(AnalysisRun.id == run_id, AnalysisRun.status == RunStatus.queued)
+            .update({AnalysisRun.status: RunStatus.running, AnalysisRun.started_at: datetime.utcnow()},
+                    synchronize_session=False)
+        )
+        db.commit()
+        if not claimed:
+            return  # canceled while queued, or another process took it
+        run = db.get(AnalysisRun, run_id)
+        ds = db.get(Dataset, run.dataset_id)
+        try:
+            if ds is None:
+                raise ValueError("Dataset not found")
+            execute_inline(db, run, ds)
+        except Exception as e:
+            db.rollback()
+            run.status = RunStatus.failed
+            run.error_message = str(e)
+            run.finished_at = datetime.utcnow()
+            db.commit()
+            publish(run_id, status="failed", error=str(e))
+    finally:
+        db.close()
+
+
+def recover() -> int:
+    """Queue the single runs left queued by a previous process; returns how many."""
+    from app.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(AnalysisRun, Dataset)
+            .join(Dataset, Dataset.id == AnalysisRun.dataset_id)
+            .filter(AnalysisRun.status == RunStatus.queued, AnalysisRun.batch_id.is_(None))
+            .order_by(AnalysisRun.id)
+            .all()
+        )
+        for run, ds in rows:
+            submit(run.id, reservation(run, ds))
+    finally:
+        db.close()
+    return len(rows)
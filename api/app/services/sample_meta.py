@@ -0,0 +1,204 @@
+"""
+Sample metadata (phenotypes, groups) kept next to the expression matrix.
+
+GEO series matrix files carry one `!Sample_<field>` line per annotation with
+one tab-separated value per sample. Ingest reads them in the same pass as the
+table (MatrixStream hands pandas the data lines and keeps the `!Sample_`
+lines) and stores one row per sample as samples.meta.parquet:
+
+  sample_id         the matrix column the sample is (its GSM accession when
+                    the table header uses accessions, else the header as is)
+  title, geo_accession, source_name_ch1, ...
+                    single-valued fields, `Sample_` prefix dropped
+  <key>             each "key: value" of the characteristics_ch* lines
+
+DE, chart grouping and sample filters join this small table against the
+matrix columns instead of reshaping or scanning the matrix. Its label
+columns (group, tissue, ...) get a categorical index (app.utils.catindex,
+samples.meta.catidx.npz), so equality/membership sample filters are bitmap
+lookups; the canonical matrix itself is all numeric and has none.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+SAMPLE_META_NAME = "samples.meta.parquet"
+_CHARACTERISTICS = re.compile(r"^characteristics_ch\d+$")
+
+
+class MatrixStream(io.TextIOBase):
+    """
+    Text stream over a series-matrix handle that yields only table lines;
+    `!Sample_` lines are kept in .sample_lines, other `!` lines dropped.
+    """
+
+    def __init__(self, handle):
+        self._handle = handle
+        self._buf = ""
+        self.sample_lines: List[str] = []
+
+    def readable(self) -> bool:
+        return True
+
+    def _next(self) -> str:
+        for line in self._handle:
+            if line.startswith("!"):
+                if line.startswith("!Sample_"):
+                    self.sample_lines.append(line.rstrip("\r\n"))
+                continue
+            return line
+        return ""
+
+    def readline(self, size: int = -1) -> str:
+        if self._buf:
+            line, self._buf = self._buf, ""
+            return line
+        return self._next()
+
+    def read(self, size: int = -1) -> str:
+        parts, n = [self._buf], len(self._buf)
+        self._buf = ""
+        while size < 0 or n < size:
+            line = self._next()
+            if not line:
+                break
+            parts.append(line)
+            n += len(line)
+        out = "".join(parts)
+        if size >= 0 and len(out) > size:
+            out, self._buf = out[:size], out[size:]
+        return out
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+
+def parse_sample_lines(lines: List[str]) -> Optional[pd.DataFrame]:
+    """One row per sample from `!Sample_<field>\\tv1\\tv2...` lines, or None."""
+    fields: "OrderedDict[str, List[str]]" = OrderedDict()
+    chars: List[List[str]] = []
+    n = 0
+    for row in csv.reader(lines, delimiter="\t"):
+        if not row:
+            continue
+        field, values = row[0][len("!Sample_"):], [v.strip() for v in row[1:]]
+        n = max(n, len(values))
+        if _CHARACTERISTICS.match(field):
+            chars.append(values)
+        elif field in fields:
+            # repeated single-valued fields (e.g. several description lines)
+            fields[field] = [f"{a}; {b}" if a and b else a or b for a, b in zip(fields[field], values)]
+        else:
+            fields[field] = values
+    if n == 0:
+        return None
+
+    cols: Dict[str, List[Any]] = {k: (v + [None] * n)[:n] for k, v in fields.items()}
+    for values in chars:
+        for i, cell in enumerate(values):
+            key, sep, val = cell.partition(":")
+            if not sep:
+                key, val = "characteristics", cell
+            key = key.strip().lower().replace(" ", "_") or "characteristics"
+            col = cols.setdefault(key, [None] * n)
+            col[i] = val.strip() if col[i] is None else f"{col[i]}; {val.strip()}"
+    return pd.DataFrame(cols)
+
+
+def align_to_matrix(meta: pd.DataFrame, sample_columns: List[str]) -> pd.DataFrame:
+    """
+    Add sample_id (the matrix column of each row) and keep the samples that
+    made it into the matrix, in matrix column order.
+    """
+    cols = [str(c) for c in sample_columns]
+    meta = meta.copy()
+    for key in ("geo_accession", "title"):
+        if key in meta.columns and set(meta[key].astype(str)) & set(cols):
+            meta.insert(0, "sample_id", meta[key].astype(str))
+            break
+    else:
+        # no shared ids: series matrix columns are in annotation order
+        meta.insert(0, "sample_id", (cols + [None] * len(meta))[: len(meta)])
+    meta = meta.dropna(subset=["sample_id"]).drop_duplicates("sample_id")
+    have = set(meta["sample_id"])
+    return meta.set_index("sample_id").reindex([c for c in cols if c in have]).reset_index()
+
+
+def write_sample_meta(meta: pd.DataFrame, base_dir: Path) -> Path:
+    from app.utils.catindex import build_index
+
+    path = base_dir / SAMPLE_META_NAME
+    meta = meta.astype({c: "string" for c in meta.columns})
+    meta.to_parquet(path, index=False)
+    try:
+        build_index(path, meta)
+    except Exception:
+        pass  # load_index builds it on first use
+    return path
+
+
+def sample_meta_path(canon_path: Path) -> Path:
+    return Path(canon_path).parent / SAMPLE_META_NAME
+
+
+@lru_cache(maxsize=64)
+def _load(path: str, mtime_ns: int) -> pd.DataFrame:
+    return pd.read_parquet(path)
+
+
+def load_sample_meta(canon_path: Path) -> Optional[pd.DataFrame]:
+    """The dataset's sample table (sample_id first), or None when it has none."""
+    p = sample_meta_path(canon_path)
+    try:
+        mtime = p.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return _load(str(p), mtime)
+
+
+def sample_groups(canon_path: Path, column: str) -> pd.Series:
+    """sample_id -> value of metadata `column` (samples without a value dropped)."""
+    meta = load_sample_meta(canon_path)
+    if meta is None:
+        raise ValueError("Dataset has no sample metadata")
+    if column not in meta.columns or column == "sample_id":
+        raise ValueError(f"Unknown sample metadata column '{column}'")
+    return meta.set_index("sample_id")[column].dropna().astype(str)
+
+
+def select_samples(canon_path: Path, filters: List[Dict[str, Any]] | None) -> Optional[List[str]]:
+    """sample_ids whose metadata passes `filters` (None when there are no filters)."""
+    if not filters:
+        return None
+    from app.utils.catindex import load_index, split_filters
+
+    meta = load_sample_meta(canon_path)
+    if meta is None:
+        raise ValueError("Dataset has no sample metadata")
+    unknown = [f.get("column") for f in filters if f.get("column") not in meta.columns]
+    if unknown:
+        raise ValueError(f"Unknown sample metadata column(s): {', '.join(map(str, unknown))}")
+    mask, rest = split_filters(load_index(sample_meta_path(canon_path)), filters)
+    if mask is not None:
+        meta = meta[mask]
+    if not rest:
+        return meta["sample_id"].tolist()
+
+    import polars as pl
+    from app.utils.filters import apply_filters
+
+    return apply_filters(pl.from_pandas(meta), rest)["sample_id"].to_list()
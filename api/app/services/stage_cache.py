@@ -0,0 +1,185 @@
+"""
+Memoized recipe stages.
+
+Recipes declare their preprocessing as a small DAG of named stages. A
+stage's key hashes its name, the dataset fingerprint, the params it reads
+and the keys of its upstream stages, so changing a downstream-only param
+(e.g. PCA n_components) reuses everything above it.
+
+Results are DataFrames kept in an in-process LRU (STAGE_CACHE_MEM_MB) and
+on disk under storage/stages/ as <key>.npy + <key>.json (values are
+memory-mapped on load), evicted least-recently-used beyond
+STAGE_CACHE_DISK_MB. The disk layer is shared by every worker process.
+"""
+from __future__ import annotations
+
+import json
+import os
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.config import settings
+from app.utils.profiling import span
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    fn: Callable[..., pd.DataFrame]  # fn(ctx, params, *upstream frames)
+    deps: Tuple[str, ...] = ()
+    params: Dict[str, Any] = field(default_factory=dict)  # param name -> default
+    cache: bool = True
+
+
+def _root() -> Path:
+    return Path(settings.STORAGE_DIR) / "stages"
+
+
+class _MemoryLRU:
+    def __init__(self):
+        self._items: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def _size(df: pd.DataFrame) -> int:
+        return int(df.memory_usage(index=False, deep=False).sum())
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            df = self._items.get(key)
+            if df is not None:
+                self._items.move_to_end(key)
+            return df
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        limit = settings.STAGE_CACHE_MEM_MB * 1024 * 1024
+        size = self._size(df)
+        if size > limit:
+            return
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._size(self._items.pop(key))
+            self._items[key] = df
+            self._bytes += size
+            while self._bytes > limit and self._items:
+                _, old = self._items.popitem(last=False)
+                self._bytes -= self._size(old)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+
+_memory = _MemoryLRU()
+
+
+def _disk_paths(key: str) -> Tuple[Path, Path]:
+    root = _root()
+    return root / f"{key}.npy", root / f"{key}.json"
+
+
+def _disk_get(key: str) -> Optional[pd.DataFrame]:
+    npy, meta = _disk_paths(key)
+    try:
+        info = json.loads(meta.read_text())
+        values = np.load(npy, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    os.utime(meta)  # recency for LRU eviction
+    return pd.DataFrame(values, index=pd.Index(info["index"], name=info.get("index_name")),
+                        columns=info["columns"], copy=False)
+
+
+def _disk_put(key: str, df: pd.DataFrame) -> None:
+    npy, meta = _disk_paths(key)
+    npy.parent.mkdir(parents=True, exist_ok=True)
+    tag = uuid.uuid4().hex
+    tmp_npy, tmp_meta = npy.with_name(f"{npy.name}.{tag}.tmp"), meta.with_name(f"{meta.name}.{tag}.tmp")
+    with tmp_npy.open("wb") as f:
+        np.save(f, np.ascontiguousarray(df.to_numpy()))
+    tmp_meta.write_text(json.dumps({
+        "index": [str(i) for i in df.index],
+        "index_name": df.index.name,
+        "columns": [str(c) for c in df.columns],
+    }))
+    os.replace(tmp_npy, npy)
+    os.replace(tmp_meta, meta)
+    _evict_disk()
+
+
+def _evict_disk() -> None:
+    limit = settings.STAGE_CACHE_DISK_MB * 1024 * 1024
+    entries = []
+    for meta in _root().glob("*.json"):
+        npy = meta.with_suffix(".npy")
+        try:
+            entries.append((meta.stat().st_mtime, meta, npy, npy.stat().st_size + meta.stat().st_size))
+        except OSError:
+            continue
+    total = sum(e[3] for e in entries)
+    for _, meta, npy, size in sorted(entries, key=lambda e: e[0]):
+        if total <= limit:
+            break
+        meta.unlink(missing_ok=True)
+        npy.unlink(missing_ok=True)
+        total -= size
+
+
+class StageGraph:
+    def __init__(self, *stages: Stage):
+        self.stages = {s.name: s for s in stages}
+
+    def _params(self, stage: Stage, params: dict) -> dict:
+        return {k: params.get(k, default) for k, default in stage.params.items()}
+
+    def key(self, name: str, ctx: dict, params: dict) -> str:
+        stage = self.stages[name]
+        raw = json.dumps({
+            "stage": name,
+            "fp": ctx["fp"],
+            "params": self._params(stage, params),
+            "deps": [self.key(d, ctx, params) for d in stage.deps],
+        }, sort_keys=True, default=str)
+        return sha256(raw.encode()).hexdigest()
+
+    def run(self, name: str, ctx: dict, params: dict) -> pd.DataFrame:
+        """Value of stage `name`, computing only the upstream stages that are not cached."""
+        stage = self.stages[name]
+        key = self.key(name, ctx, params) if stage.cache else None
+        if key is not None:
+            df = _memory.get(key)
+            source = "memory"
+            if df is None:
+                df = _disk_get(key)
+                source = "disk"
+                if df is not None:
+                    _memory.put(key, df)
+            if df is not None:
+                with span(f"stage:{name}") as rec:
+                    if rec is not None:
+                        rec["cache"] = source
+                return df
+
+        upstream = [self.run(d, ctx, params) for d in stage.deps]
+        with span(f"stage:{name}") as rec:
+            if rec is not None:
+                rec["cache"] = "miss" if stage.cache else "off"
+            df = stage.fn(ctx, self._params(stage, params), *upstream)
+        if key is not None:
+            _disk_put(key, df)
+            _memory.put(key, df)
+        return df
+
+
+def clear_memory() -> None:
+    _memory.clear()
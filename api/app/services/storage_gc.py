@@ -0,0 +1,363 @@
+"""
+Storage garbage collection for uploads/ and storage/.
+
+A pass (collect) applies these policies in order and reports what each
+reclaimed:
+
+  incoming   uploads/<owner>/_incoming/ files older than GC_INCOMING_TTL_H
+             (left behind by failed or abandoned ingests)
+  orphans    storage/runs/<id>, storage/batches/<id> and uploads/<owner>/<id>
+             directories whose run, batch or dataset row is gone, whole
+             uploads/<owner> trees of deleted users, and *.tmp files from
+             interrupted atomic writes (under uploads/ and storage/runs,
+             stages and orderings); nothing younger than GC_ORPHAN_GRACE_H
+             is touched
+  orderings  cached clusterings in storage/orderings/ (keyed by dataset
+             fingerprint, so nothing else ever deletes them) unused for
+             GC_ORDERINGS_TTL_H, then the least recently used ones until the
+             directory is under GC_ORDERINGS_MAX_MB (0 = no cap); a hit
+             touches the file, and a removed ordering is recomputed on use
+  quota      users over GC_USER_QUOTA_MB lose the artifacts of their least
+             recently used succeeded runs until they fit. Those artifacts
+             can be recomputed: the run keeps its recipe and params,
+             artifacts_json becomes {"evicted": {...}} and
+             POST /analytics/runs/{id}/rebuild runs it again. Uploads and
+             batch summaries are never evicted, so a user can stay over quota
+             (reported in "over_quota"; new uploads are refused).
+
+"Recently used" is the mtime of runs/<id>/.accessed, touched (at most every
+GC_ACCESS_RESOLUTION_S) whenever an artifact is served, else the run's
+finish time. Passes run every GC_INTERVAL_S in a background thread of each
+API process and on POST /storage/gc; a lock file lets only one pass run at
+a time.
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.metrics import GC_RECLAIMED
+from app.models import AnalysisBatch, AnalysisRun, Dataset, RunStatus, User
+
+ACCESS_MARKER = ".accessed"
+POLICIES = ("incoming", "orphans", "orderings", "quota")
+
+
+def _storage() -> Path:
+    return Path(settings.STORAGE_DIR).resolve()
+
+
+def _uploads() -> Path:
+    return Path(settings.UPLOAD_DIR).resolve()
+
+
+def run_dir(run_id: int) -> Path:
+    return _storage() / "runs" / str(run_id)
+
+
+def du(path: Path) -> int:
+    """Bytes of the files under `path` (0 when it doesn't exist)."""
+    if path.is_file():
+        return path.stat().st_size
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def touch(run_id: int) -> None:
+    """Record a use of the run's artifacts (for LRU eviction)."""
+    marker = run_dir(run_id) / ACCESS_MARKER
+    now = time.time()
+    try:
+        if now - marker.stat().st_mtime < settings.GC_ACCESS_RESOLUTION_S:
+            return
+        os.utime(marker, (now, now))
+    except FileNotFoundError:
+        if marker.parent.is_dir():
+            marker.touch()
+    except OSError:
+        pass
+
+
+def _last_used(run: AnalysisRun) -> float:
+    try:
+        return (run_dir(run.id) / ACCESS_MARKER).stat().st_mtime
+    except OSError:
+        pass
+    stamp = run.finished_at or run.created_at
+    return stamp.replace(tzinfo=stamp.tzinfo or timezone.utc).timestamp() if stamp else 0.0
+
+
+# ---------- usage ----------
+
+def user_usage(db: Session, user_id: int) -> Dict[str, int]:
+    """Bytes a user holds: uploads (datasets, incoming), run artifacts and batch summaries."""
+    runs = [r for (r,) in db.query(AnalysisRun.id).filter(AnalysisRun.user_id == user_id)]
+    batches = [b for (b,) in db.query(AnalysisBatch.id).filter(AnalysisBatch.user_id == user_id)]
+    out = {
+        "uploads": du(_uploads() / str(user_id)),
+        "runs": sum(du(run_dir(r)) for r in runs),
+        "batches": sum(du(_storage() / "batches" / str(b)) for b in batches),
+    }
+    out["total"] = sum(out.values())
+    return out
+
+
+def quota_bytes() -> int:
+    return settings.GC_USER_QUOTA_MB * 1024 * 1024
+
+
+def check_upload_quota(db: Session, user_id: int) -> None:
+    """Raise ValueError when the user's non-evictable storage is already at the quota."""
+    quota = quota_bytes()
+    if quota <= 0:
+        return
+    used = user_usage(db, user_id)
+    if used["uploads"] + used["batches"] >= quota:
+        raise ValueError(f"Storage quota of {settings.GC_USER_QUOTA_MB} MB exceeded")
+
+
+# ---------- passes ----------
+
+@dataclass
+class Report:
+    dry_run: bool = False
+    started_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    duration_s: float = 0.0
+    policies: Dict[str, Dict[str, int]] = field(default_factory=lambda: {p: {"items": 0, "bytes": 0} for p in POLICIES})
+    evicted_runs: List[int] = field(default_factory=list)
+    over_quota: List[int] = field(default_factory=list)
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        return sum(p["bytes"] for p in self.policies.values())
+
+    def as_dict(self) -> dict:
+        return {
+            "dry_run": self.dry_run,
+            "started_at": self.started_at,
+            "duration_s": round(self.duration_s, 3),
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "policies": self.policies,
+            "evicted_runs": self.evicted_runs,
+            "over_quota": self.over_quota,
+        }
+
+
+def _remove(report: Report, policy: str, path: Path) -> int:
+    size = du(path)
+    if not report.dry_run:
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+        GC_RECLAIMED.inc(size, policy=policy)
+    report.policies[policy]["items"] += 1
+    report.policies[policy]["bytes"] += size
+    return size
+
+
+def _older_than(path: Path, seconds: float, now: float) -> bool:
+    try:
+        return now - path.stat().st_mtime > seconds
+    except OSError:
+        return False
+
+
+def _numeric_dirs(parent: Path) -> Iterable[Path]:
+    if not parent.is_dir():
+        return []
+    return [p for p in parent.iterdir() if p.is_dir() and p.name.isdigit()]
+
+
+def sweep_incoming(report: Report, now: float) -> None:
+    ttl = settings.GC_INCOMING_TTL_H * 3600
+    for owner in _numeric_dirs(_uploads()):
+        incoming = owner / "_incoming"
+        if not incoming.is_dir():
+            continue
+        for f in incoming.iterdir():
+            if _older_than(f, ttl, now):
+                _remove(report, "incoming", f)
+
+
+def sweep_orphans(db: Session, report: Report, now: float) -> None:
+    grace = settings.GC_ORPHAN_GRACE_H * 3600
+
+    def ids(model) -> set:
+        return {i for (i,) in db.query(model.id)}
+
+    for kind, model in (("runs", AnalysisRun), ("batches", AnalysisBatch)):
+        known = ids(model)
+        for d in _numeric_dirs(_storage() / kind):
+            if int(d.name) not in known and _older_than(d, grace, now):
+                _remove(report, "orphans", d)
+
+    users, datasets = ids(User), ids(Dataset)
+    for owner in _numeric_dirs(_uploads()):
+        if int(owner.name) not in users:
+            if _older_than(owner, grace, now):
+                _remove(report, "orphans", owner)
+            continue
+        for d in _numeric_dirs(owner):
+            if int(d.name) not in datasets and _older_than(d, grace, now):
+                _remove(report, "orphans", d)
+
+    for root in (_uploads(), *(_storage() / d for d in ("runs", "stages", "orderings"))):
+        if not root.is_dir():
+            continue
+        for tmp in root.rglob("*.tmp"):
+            if tmp.is_file() and _older_than(tmp, grace, now):
+                _remove(report, "orphans", tmp)
+
+
+def sweep_orderings(report: Report, now: float) -> None:
+    root = _storage() / "orderings"
+    if not root.is_dir():
+        return
+    ttl = settings.GC_ORDERINGS_TTL_H * 3600
+    entries = []
+    for f in root.glob("*.npz"):
+        try:
+            st = f.stat()
+        except OSError:
+            continue
+        if now - st.st_mtime > ttl:
+            _remove(report, "orderings", f)
+        else:
+            entries.append((st.st_mtime, f, st.st_size))
+    cap = settings.GC_ORDERINGS_MAX_MB * 1024 * 1024
+    if cap <= 0:
+        return
+    total = sum(e[2] for e in entries)
+    for _, f, size in sorted(entries, key=lambda e: e[0]):
+        if total <= cap:
+            break
+        _remove(report, "orderings", f)
+        total -= size
+
+
+def evict_run(db: Session, run: AnalysisRun, report: Optional[Report] = None) -> int:
+    """Drop a succeeded run's artifacts, keeping what is needed to rebuild it."""
+    report = report or Report()
+    size = _remove(report, "quota", run_dir(run.id))
+    if not report.dry_run:
+        run.artifacts_json = {"evicted": {"at": datetime.now(timezone.utc).isoformat(), "bytes": size}}
+        db.commit()
+    report.evicted_runs.append(run.id)
+    return size
+
+
+def is_evicted(run: AnalysisRun) -> bool:
+    return bool((run.artifacts_json or {}).get("evicted"))
+
+
+def enforce_quotas(db: Session, report: Report) -> None:
+    quota = quota_bytes()
+    if quota <= 0:
+        return
+    for (user_id,) in db.query(User.id):
+        used = user_usage(db, user_id)["total"]
+        if used <= quota:
+            continue
+        runs = (
+            db.query(AnalysisRun)
+            .filter(AnalysisRun.user_id == user_id, AnalysisRun.status == RunStatus.succeeded)
+            .all()
+        )
+        for run in sorted((r for r in runs if not is_evicted(r)), key=_last_used):
+            if used <= quota:
+                break
+            used -= evict_run(db, run, report)
+        if used > quota:
+            report.over_quota.append(user_id)
+
+
+def collect(db: Session, dry_run: bool = False) -> dict:
+    """One pass of every policy; returns (and stores as storage/gc/last.json) the report."""
+    report = Report(dry_run=dry_run)
+    t0, now = time.perf_counter(), time.time()
+    sweep_incoming(report, now)
+    sweep_orphans(db, report, now)
+    sweep_orderings(report, now)
+    enforce_quotas(db, report)
+    report.duration_s = time.perf_counter() - t0
+    out = report.as_dict()
+    if not dry_run:
+        path = _storage() / "gc" / "last.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_text(json.dumps(out, indent=2))
+        os.replace(tmp, path)
+    return out
+
+
+def last_report() -> Optional[dict]:
+    try:
+        return json.loads((_storage() / "gc" / "last.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+
+# ---------- background ----------
+
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def locked_pass(dry_run: bool = False) -> Optional[dict]:
+    """collect() under the GC lock file; None when another pass holds it."""
+    import fcntl
+    from app.db import SessionLocal
+
+    lock = _storage() / "gc" / ".lock"
+    lock.parent.mkdir(parents=True, exist_ok=True)
+    with lock.open("w") as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return None  # another process is collecting
+        db = SessionLocal()
+        try:
+            return collect(db, dry_run=dry_run)
+        finally:
+            db.close()
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _loop() -> None:
+    while not _stop.wait(settings.GC_INTERVAL_S):
+        try:
+            locked_pass()
+        except Exception as e:
+            print(f"[storage_gc] pass failed: {e}")
+
+
+def start() -> None:
+    """Run collect() every GC_INTERVAL_S in a daemon thread (no-op when the interval is 0)."""
+    global _thread
+    if settings.GC_INTERVAL_S <= 0 or (_thread is not None and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="storage-gc", daemon=True)
+    _thread.start()
+
+
+def stop() -> None:
+    _stop.set()
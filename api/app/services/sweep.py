@@ -0,0 +1,175 @@
+"""
+Parameter sweeps: one run over a grid of recipe parameters.
+
+Every combination is derived from the largest decomposition of its
+feature set instead of being run on its own:
+
+- pca: the variance ranking and standardized matrix are computed once per
+  log1p setting at the largest top_genes (a top-k selection is a prefix of
+  it), PCA is fitted once per top_genes at the largest n_components, and
+  smaller n_components are column slices of that fit.
+- correlation: the matrix is computed once per (axis, method) at the
+  largest max_n; smaller max_n are leading sub-matrices.
+
+Results land under storage/runs/<id>/sweep/ and in the run's artifacts as
+sub-results keyed by the combination ("n_components=2,top_genes=500").
+"""
+from __future__ import annotations
+
+from itertools import product
+from pathlib import Path
+from typing import Any, Dict, List
+
+from app.config import settings
+
+SWEEP_KEYS = {
+    "pca": ("n_components", "top_genes", "log1p"),
+    "correlation": ("max_n", "method", "axis"),
+}
+_NUMERIC = ("n_components", "top_genes", "max_n")
+
+
+def expand(recipe_key: str, params: dict) -> List[Dict[str, Any]]:
+    """Every combination of params["grid"] merged over the base params."""
+    grid = params.get("grid") or {}
+    if recipe_key not in SWEEP_KEYS:
+        raise ValueError(f"Sweeps are not supported for recipe '{recipe_key}'")
+    if not isinstance(grid, dict) or not grid:
+        raise ValueError("grid must map parameter names to lists of values")
+    allowed = SWEEP_KEYS[recipe_key]
+    for k, vals in grid.items():
+        if k not in allowed:
+            raise ValueError(f"Cannot sweep '{k}' for {recipe_key}; allowed: {', '.join(allowed)}")
+        if not isinstance(vals, list) or not vals:
+            raise ValueError(f"grid['{k}'] must be a non-empty list")
+        if k in _NUMERIC and not all(isinstance(v, int) and not isinstance(v, bool) and v > 0 for v in vals):
+            raise ValueError(f"grid['{k}'] must contain positive integers")
+
+    names = sorted(grid)
+    values = [list(dict.fromkeys(grid[k])) for k in names]
+    n = 1
+    for v in values:
+        n *= len(v)
+    if n > settings.SWEEP_MAX_COMBOS:
+        raise ValueError(f"Grid has {n} combinations; at most {settings.SWEEP_MAX_COMBOS} are allowed")
+
+    base = {k: v for k, v in params.items() if k != "grid"}
+    return [{**base, **dict(zip(names, combo))} for combo in product(*values)]
+
+
+def combo_key(params: dict, grid: dict) -> str:
+    return ",".join(f"{k}={params[k]}" for k in sorted(grid))
+
+
+def envelope(recipe_key: str, params: dict) -> dict:
+    """Base params with every numeric grid key at its largest value (for memory planning)."""
+    out = {k: v for k, v in params.items() if k != "grid"}
+    for k, vals in (params.get("grid") or {}).items():
+        if k in _NUMERIC and isinstance(vals, list) and vals:
+            out[k] = max(vals)
+    return out
+
+
+def run_sweep(run, ctx: dict, outdir: Path) -> dict:
+    params = run.params_json or {}
+    combos = expand(run.recipe_key, params)
+    sweep_dir = outdir / "sweep"
+    sweep_dir.mkdir(parents=True, exist_ok=True)
+    if run.recipe_key == "pca":
+        results = _pca(run, ctx, combos, params["grid"], sweep_dir)
+    else:
+        results = _correlation(run, ctx, combos, params["grid"], sweep_dir)
+    return _finish(run, params["grid"], results, sweep_dir)
+
+
+def _pca(run, ctx, combos, grid, sweep_dir: Path) -> dict:
+    import numpy as np
+    import pandas as pd
+    from sklearn.decomposition import PCA
+    from app.services.analytics_exec import STAGES, _u
+    from app.utils.profiling import span
+
+    results = {}
+    for log1p in dict.fromkeys(bool(c.get("log1p", False)) for c in combos):
+        group = [c for c in combos if bool(c.get("log1p", False)) == log1p]
+        top_max = max(int(c.get("top_genes", 1000)) for c in group)
+        shared = {"top_genes": top_max, "log1p": log1p}
+        # columns come out ordered by variance, so top-k is always the first k
+        X_df = STAGES.run("top_variance", ctx, shared)
+        Z = STAGES.run("standardized", ctx, shared).to_numpy()
+        sample_ids = [str(s) for s in X_df.index]
+
+        for k in dict.fromkeys(min(int(c.get("top_genes", 1000)), X_df.shape[1]) for c in group):
+            subset = [c for c in group if min(int(c.get("top_genes", 1000)), X_df.shape[1]) == k]
+            n_max = max(2, min(max(int(c.get("n_components", 10)) for c in subset), Z.shape[0], k))
+            with span("compute"):
+                pca = PCA(n_components=n_max, svd_solver="full")
+                scores = pca.fit_transform(np.array(Z[:, :k]))
+                evr = pca.explained_variance_ratio_
+            name = f"pca_scores_log1p{int(log1p)}_top{k}.csv"
+            cols = [f"PC{i+1}" for i in range(n_max)]
+            with span("write_artifacts"):
+                pd.DataFrame(scores, index=pd.Index(sample_ids, name="sample_id"), columns=cols).to_csv(sweep_dir / name)
+            for c in subset:
+                n = max(2, min(int(c.get("n_components", 10)), n_max))
+                results[combo_key(c, grid)] = {
+                    "params": {g: c[g] for g in sorted(grid)},
+                    "top_genes": int(k),
+                    "n_components": int(n),
+                    "explained_variance_ratio": [float(v) for v in evr[:n]],
+                    "cumulative_explained": float(evr[:n].sum()),
+                    # first n_components columns of the shared fit
+                    "scores_csv": _u(f"/files/runs/{run.id}/sweep/{name}"),
+                    "columns": cols[:n],
+                }
+    return results
+
+
+def _correlation(run, ctx, combos, grid, sweep_dir: Path) -> dict:
+    import numpy as np
+    from app.services.analytics_exec import STAGES, _u
+    from app.utils.profiling import span
+
+    results = {}
+    for axis, method in dict.fromkeys((c.get("axis", "samples"), c.get("method", "spearman")) for c in combos):
+        group = [c for c in combos if (c.get("axis", "samples"), c.get("method", "spearman")) == (axis, method)]
+        max_n = max(int(c.get("max_n", 300)) for c in group)
+        # leading columns (samples) or top-variance genes: smaller max_n is a prefix
+        corr = STAGES.run("corr", ctx, {"axis": axis, "method": method, "max_n": max_n})
+        name = f"corr_{axis}_{method}.csv"
+        with span("write_artifacts"):
+            corr.to_csv(sweep_dir / name)
+        C = corr.to_numpy()
+        for c in group:
+            n = min(int(c.get("max_n", 300)), C.shape[0])
+            sub = C[:n, :n]
+            off = sub[~np.eye(n, dtype=bool)]
+            results[combo_key(c, grid)] = {
+                "params": {g: c[g] for g in sorted(grid)},
+                "n": int(n),
+                "mean_abs_corr": float(np.nanmean(np.abs(off))) if off.size else None,
+                # leading n x n block of the shared matrix
+                "csv_url": _u(f"/files/runs/{run.id}/sweep/{name}"),
+                "ids": [str(i) for i in corr.columns[:n]],
+            }
+    return results
+
+
+def _finish(run, grid: dict, results: dict, sweep_dir: Path) -> dict:
+    import pandas as pd
+    from app.services.analytics_exec import _u
+
+    rows = []
+    for key, r in results.items():
+        row = {"combination": key, **r["params"]}
+        row.update({k: v for k, v in r.items() if k not in ("params", "explained_variance_ratio", "columns", "ids")})
+        rows.append(row)
+    pd.DataFrame(rows).to_csv(sweep_dir / "sweep.csv", index=False)
+    return {
+        "sweep": {
+            "grid": grid,
+            "n_combinations": len(results),
+            "summary_csv": _u(f"/files/runs/{run.id}/sweep/sweep.csv"),
+            "results": results,
+        }
+    }
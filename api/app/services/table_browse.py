@@ -0,0 +1,292 @@
+"""
+Paged, sorted browsing of a dataset table.
+
+Pages of the canonical parquet are read from the row groups that hold them
+(row-group offsets come from the footer), projected to the requested
+columns. Sorting goes through a per-column permutation (row positions in
+sorted order, nulls last, ties by position) built on first use from that
+one column, stored under <dataset dir>/sort/ with the file signature and
+kept in memory after that; a sorted page is then a slice of the
+permutation. Its rows are scattered over most row groups, so for a canonical
+matrix they are gathered from the float32 memory-mapped cache
+(matrix_store.load_mmap, with MATRIX_MMAP_CACHE) instead of decoding every
+row group; values are reported at float32 precision there. Otherwise the
+rows are taken from the row groups they live in.
+
+Cursors are opaque (file signature, sort, position). The file behind a
+signature never changes, so a position in the sorted order is a stable
+keyset; a cursor from an older file is rejected.
+"""
+from __future__ import annotations
+
+import base64
+import json
+import os
+import uuid
+from functools import lru_cache
+from hashlib import sha1
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+MAX_LIMIT = 1000
+MAX_COLUMNS = 500
+
+
+def _signature(path: str | Path) -> str:
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+@lru_cache(maxsize=64)
+def _parquet(path: str, sig: str):
+    """(ParquetFile, row-group start offsets incl. total) for one file version."""
+    import pyarrow.parquet as pq
+
+    pf = pq.ParquetFile(path)
+    sizes = [pf.metadata.row_group(i).num_rows for i in range(pf.metadata.num_row_groups)]
+    return pf, np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+
+
+# ---------- sort permutations ----------
+
+def _perm_path(path: Path, column: str, desc: bool) -> Path:
+    h = sha1(column.encode()).hexdigest()[:16]
+    return path.parent / "sort" / f"{path.stem}.{h}.{'desc' if desc else 'asc'}.npz"
+
+
+@lru_cache(maxsize=32)
+def _read_perm(path: str, mtime_ns: int):
+    with np.load(path) as z:
+        perm = z["perm"]
+        perm.flags.writeable = False
+        return perm, str(z["signature"])
+
+
+def _build_perm(path: Path, column: str, desc: bool) -> np.ndarray:
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, columns=[column])
+    perm = pc.sort_indices(table, sort_keys=[(column, "descending" if desc else "ascending")],
+                           null_placement="at_end").to_numpy()
+    dtype = np.int32 if len(perm) < 2**31 else np.int64
+    return perm.astype(dtype)
+
+
+def sort_permutation(path: str | Path, column: str, desc: bool = False) -> np.ndarray:
+    """Row positions of the file in `column` order, built once per file version."""
+    path = Path(path)
+    sig = _signature(path)
+    out = _perm_path(path, column, desc)
+    try:
+        perm, stored = _read_perm(str(out), out.stat().st_mtime_ns)
+        if stored == sig:
+            return perm
+    except (OSError, KeyError, ValueError):
+        pass
+    perm = _build_perm(path, column, desc)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(f"{out.name}.{uuid.uuid4().hex}.tmp")
+    with tmp.open("wb") as f:
+        np.savez(f, perm=perm, signature=np.asarray(sig))
+    os.replace(tmp, out)
+    return perm
+
+
+def restamp_permutations(path: str | Path, old_signature: str) -> int:
+    """
+    Re-sign the stored permutations of `path` built for `old_signature`
+    (after a rewrite that only added columns, so row order is unchanged).
+    """
+    path = Path(path)
+    sig = _signature(path)
+    n = 0
+    for out in (path.parent / "sort").glob(f"{path.stem}.*.npz"):
+        try:
+            with np.load(out) as z:
+                perm, stored = z["perm"], str(z["signature"])
+        except (OSError, KeyError, ValueError):
+            continue
+        if stored != old_signature:
+            continue
+        tmp = out.with_name(f"{out.name}.{uuid.uuid4().hex}.tmp")
+        with tmp.open("wb") as f:
+            np.savez(f, perm=perm, signature=np.asarray(sig))
+        os.replace(tmp, out)
+        n += 1
+    return n
+
+
+# ---------- cursors ----------
+
+def _encode_cursor(sig: str, sort: Optional[str], desc: bool, pos: int) -> str:
+    raw = json.dumps({"s": sig, "k": sort, "d": desc, "p": pos}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, sig: str, sort: Optional[str], desc: bool) -> int:
+    try:
+        c = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        pos = int(c["p"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if c.get("s") != sig:
+        raise ValueError("Cursor is from an older version of the dataset")
+    if c.get("k") != sort or bool(c.get("d")) != desc:
+        raise ValueError("Cursor was issued for a different sort")
+    return pos
+
+
+# ---------- pages ----------
+
+def _take_parquet(pf, starts: np.ndarray, rows: np.ndarray, columns: List[str]):
+    """Rows at file positions `rows` (any order), reading only the row groups they fall in."""
+    import pyarrow as pa
+
+    rg = np.searchsorted(starts, rows, side="right") - 1
+    parts, order = [], []
+    for g in np.unique(rg):
+        sel = np.nonzero(rg == g)[0]
+        t = pf.read_row_group(int(g), columns=columns)
+        parts.append(t.take(pa.array(rows[sel] - starts[g])))
+        order.append(sel)
+    if not parts:
+        return pf.schema_arrow.empty_table().select(columns)
+    table = pa.concat_tables(parts)
+    # back to the requested order
+    return table.take(pa.array(np.argsort(np.concatenate(order), kind="stable")))
+
+
+def _take_mmap(path: Path, rows: np.ndarray, columns: List[str]) -> Optional[list]:
+    """
+    JSON rows at file positions `rows` of a canonical matrix, from its
+    float32 cache; None when there is no cache for `path` or a column isn't in it.
+    """
+    from app.config import settings
+    from app.services.matrix_store import is_canonical, load_mmap
+
+    if not settings.MATRIX_MMAP_CACHE or not is_canonical(path) or columns[:1] != ["gene_id"]:
+        return None
+    try:
+        arr, info = load_mmap(path, "gene_id")
+    except OSError:
+        return None
+    where = {c: i for i, c in enumerate(info["columns"])}
+    if any(c not in where for c in columns[1:]):
+        return None
+    block = arr[np.ix_(rows, [where[c] for c in columns[1:]])]
+    # shortest float32 repr, so values read 0.1 rather than 0.10000000149011612
+    text = block.astype(str)
+    ids = info["index"]
+    return [
+        [ids[r], *(None if v != v else float(t) for v, t in zip(block[i], text[i]))]
+        for i, r in enumerate(rows.tolist())
+    ]
+
+
+def _rows_json(df) -> list:
+    import pandas as pd
+
+    return df.astype(object).where(pd.notnull(df), None).values.tolist()
+
+
+def browse(
+    path: str | Path,
+    *,
+    offset: int = 0,
+    limit: int = 100,
+    sort: Optional[str] = None,
+    desc: bool = False,
+    columns: Optional[List[str]] = None,
+    col_offset: int = 0,
+    col_limit: int = 200,
+    cursor: Optional[str] = None,
+) -> dict:
+    path = Path(path)
+    sig = _signature(path)
+    if path.suffix != ".parquet":
+        return _browse_scan(path, sig, offset, limit, sort, desc, columns, col_offset, col_limit, cursor)
+
+    pf, starts = _parquet(str(path), sig)
+    total = int(starts[-1])
+    all_cols = pf.schema_arrow.names
+    cols = _project(all_cols, columns, col_offset, col_limit)
+    if sort is not None and sort not in all_cols:
+        raise ValueError(f"Unknown sort column '{sort}'")
+    if cursor:
+        offset = _decode_cursor(cursor, sig, sort, desc)
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    lo, hi = min(max(0, int(offset)), total), min(max(0, int(offset)) + limit, total)
+
+    rows = None
+    if sort is None:
+        positions = np.arange(lo, hi, dtype=np.int64)
+    else:
+        positions = np.asarray(sort_permutation(path, sort, desc)[lo:hi], dtype=np.int64)
+        rows = _take_mmap(path, positions, cols)
+    if rows is None:
+        rows = _rows_json(_take_parquet(pf, starts, positions, cols).to_pandas())
+
+    return {
+        "total": total,
+        "offset": lo,
+        "limit": limit,
+        "sort": sort,
+        "desc": desc,
+        "columns": cols,
+        "total_columns": len(all_cols),
+        "positions": positions.tolist(),
+        "rows": rows,
+        "next_cursor": _encode_cursor(sig, sort, desc, hi) if hi < total else None,
+    }
+
+
+def _project(all_cols: List[str], columns, col_offset: int, col_limit: int) -> List[str]:
+    if columns:
+        unknown = [c for c in columns if c not in all_cols]
+        if unknown:
+            raise ValueError(f"Unknown column(s): {', '.join(unknown[:10])}")
+        cols = list(dict.fromkeys(columns))
+    else:
+        # first column (ids) plus a horizontal window, for wide matrices
+        n = max(1, min(int(col_limit), MAX_COLUMNS))
+        start = max(1, int(col_offset) + 1)
+        cols = all_cols[:1] + all_cols[start:start + n]
+    if len(cols) > MAX_COLUMNS + 1:
+        raise ValueError(f"At most {MAX_COLUMNS} columns per page")
+    return cols
+
+
+def _browse_scan(path, sig, offset, limit, sort, desc, columns, col_offset, col_limit, cursor) -> dict:
+    """Fallback for non-parquet files: polars scan with slice pushdown."""
+    import polars as pl
+    from app.utils.dataread import scan_any
+
+    ldf = scan_any(str(path)).with_row_index("__row")
+    all_cols = [c for c in ldf.collect_schema().names() if c != "__row"]
+    cols = _project(all_cols, columns, col_offset, col_limit)
+    if sort is not None and sort not in all_cols:
+        raise ValueError(f"Unknown sort column '{sort}'")
+    if cursor:
+        offset = _decode_cursor(cursor, sig, sort, desc)
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    total = ldf.select(pl.len()).collect().item()
+    lo = min(max(0, int(offset)), total)
+    hi = min(lo + limit, total)
+    if sort is not None:
+        ldf = ldf.sort(sort, descending=desc, nulls_last=True, maintain_order=True)
+    page = ldf.slice(lo, hi - lo).select(["__row", *cols]).collect()
+    return {
+        "total": total,
+        "offset": lo,
+        "limit": limit,
+        "sort": sort,
+        "desc": desc,
+        "columns": cols,
+        "total_columns": len(all_cols),
+        "positions": page["__row"].to_list(),
+        "rows": _rows_json(page.drop("__row").to_pandas()),
+        "next_cursor": _encode_cursor(sig, sort, desc, hi) if hi < total else None,
+    }
@@ -0,0 +1,267 @@
+"""
+Append-only dataset versions.
+
+An append adds new samples (columns, for genes the matrix already has) or
+new genes (rows, over samples the matrix already has) to a canonical
+dataset without re-ingesting it. Each append becomes version N+1:
+
+  <dataset dir>/versions/v<N>/fragment.parquet   the appended block, canonical
+  <dataset dir>/versions/v<N>/raw-<upload>       the upload, for provenance
+  <dataset dir>/versions.json                    the version list
+
+and matrix.parquet is rewritten one row group at a time with the fragment
+merged in (matrix_store.append_columns / append_rows), so every reader
+keeps seeing a single gene-sorted file.
+
+Only what depends on the changed part is recomputed:
+  - per-gene stats (app.services.gene_stats) are merged with the fragment's
+    moments instead of rescanning the matrix;
+  - a sample append keeps the row layout, so the gene index stays as is and
+    the categorical index, sort permutations, saved-view bitmaps and column
+    profile (plus the new columns) are re-signed for the new file;
+  - a gene append rewrites the gene index; the sidecars over rows rebuild
+    on next use;
+  - the sample-major layout, when the dataset has one, is rewritten from
+    the new matrix (otherwise the planner would stop using it as stale).
+Everything keyed by the file signature or the dataset fingerprint (previews,
+memory-mapped layouts, run and stage caches) reads the new version.
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from fastapi import UploadFile
+from sqlalchemy.orm import Session
+
+from app.models import Dataset, User
+from app.services import gene_search
+from app.services import gene_stats
+from app.services.dataset_service import _safe_name, canonicalize, save_upload
+from app.services.matrix_store import (
+    append_columns, append_rows, is_canonical, sample_major_path, write_gene_index,
+    write_gene_major, write_sample_major,
+)
+
+MANIFEST_NAME = "versions.json"
+
+_locks: Dict[int, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock(dataset_id: int) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(dataset_id, threading.Lock())
+
+
+def _signature(path: str | Path) -> str:
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def manifest_path(ds: Dataset) -> Path:
+    return Path(ds.storage_path).parent / MANIFEST_NAME
+
+
+def list_versions(ds: Dataset) -> List[dict]:
+    """Versions of the dataset, oldest first; datasets never appended to have just version 1."""
+    try:
+        return json.loads(manifest_path(ds).read_text())["versions"]
+    except (OSError, ValueError, KeyError):
+        created = ds.created_at.isoformat() if ds.created_at else None
+        return [{"version": 1, "axis": "base", "n_rows": ds.n_rows, "n_cols": ds.n_cols, "created_at": created}]
+
+
+def _save_versions(ds: Dataset, versions: List[dict]) -> None:
+    out = manifest_path(ds)
+    tmp = out.with_name(f"{out.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_text(json.dumps({"versions": versions}, indent=2))
+    os.replace(tmp, out)
+
+
+def _gene_ids(canon_path: Path) -> np.ndarray:
+    return pq.read_table(canon_path, columns=["gene_id"]).column(0).to_pandas().astype(str).to_numpy()
+
+
+def _axis(matrix_ids: np.ndarray, matrix_cols: List[str], frag: pd.DataFrame) -> str:
+    """"samples" or "genes" for a fragment that extends the matrix along one axis only."""
+    frag_ids = frag["gene_id"].astype(str)
+    frag_cols = [str(c) for c in frag.columns[1:]]
+    if frag.empty or not frag_cols:
+        raise ValueError("The appended file has no numeric values")
+    known_ids, known_cols = set(matrix_ids), set(matrix_cols)
+    new_ids = ~frag_ids.isin(known_ids)
+    new_cols = [c for c in frag_cols if c not in known_cols]
+
+    if len(new_cols) == len(frag_cols) and not new_ids.any():
+        if len(known_ids) != len(matrix_ids) or not frag_ids.is_unique:
+            raise ValueError("Samples can only be appended when gene ids are unique")
+        return "samples"
+    if not new_cols and new_ids.all():
+        return "genes"
+    if new_cols and new_ids.any():
+        raise ValueError("Append either new samples for existing genes or new genes for existing samples, not both")
+    if new_cols:
+        raise ValueError(f"Sample(s) already in the dataset: {', '.join([c for c in frag_cols if c in known_cols][:5])}")
+    raise ValueError(f"Gene(s) already in the dataset: {', '.join(frag_ids[~new_ids].head(5))}")
+
+
+def _append_samples(canon: Path, tmp: Path, frag: pd.DataFrame, old_sig: str, samples) -> None:
+    from app.services.sample_meta import align_to_matrix, load_sample_meta, write_sample_meta
+    from app.services.table_browse import restamp_permutations
+    from app.utils.catindex import restamp
+    from app.utils.colprofile import extend_profile
+
+    old_stats = gene_stats.load_gene_stats(canon)
+    ids = _gene_ids(canon)
+    append_columns(canon, frag, tmp)
+    os.replace(tmp, canon)
+
+    # the new columns as they now sit in the matrix (genes missing from the fragment are null)
+    added = frag.set_index(frag["gene_id"].astype(str)).drop(columns=["gene_id"]).reindex(ids).reset_index(drop=True)
+    block = gene_stats.block_stats(added.to_numpy(dtype=np.float64, na_value=np.nan))
+    if old_stats is not None and len(old_stats) == len(ids):
+        merged = gene_stats.merge(gene_stats.moments_of(old_stats), block)
+        gene_stats.write_gene_stats(canon, gene_stats.frame(ids, merged))
+    else:
+        gene_stats.build_gene_stats(canon)
+
+    for step in (
+        lambda: restamp(canon, old_sig),
+        lambda: restamp_permutations(canon, old_sig),
+        lambda: extend_profile(canon, old_sig, added),
+    ):
+        try:
+            step()
+        except Exception:
+            pass
+    if samples is not None:
+        try:
+            meta = align_to_matrix(samples, [str(c) for c in frag.columns[1:]])
+            old = load_sample_meta(canon)
+            write_sample_meta(meta if old is None else pd.concat([old, meta], ignore_index=True), canon.parent)
+        except Exception:
+            pass
+
+
+def _append_genes(canon: Path, tmp: Path, frag: pd.DataFrame) -> None:
+    old_stats = gene_stats.load_gene_stats(canon)
+    old_ids = _gene_ids(canon)
+    _, is_old = append_rows(canon, frag, tmp)
+    os.replace(tmp, canon)
+
+    ids = np.empty(len(is_old), dtype=object)
+    ids[is_old] = old_ids
+    ids[~is_old] = frag["gene_id"].astype(str).to_numpy()
+    write_gene_index(pd.DataFrame({"gene_id": ids}), canon.parent)
+
+    if old_stats is not None and len(old_stats) == len(old_ids):
+        num = frag.iloc[:, 1:].to_numpy(dtype=np.float64, na_value=np.nan)
+        new_stats = gene_stats.frame(frag["gene_id"], gene_stats.block_stats(num))
+        order = np.empty(len(is_old), dtype=np.int64)
+        order[is_old] = np.arange(len(old_ids))
+        order[~is_old] = len(old_ids) + np.arange(len(frag))
+        stats = pd.concat([old_stats, new_stats], ignore_index=True).iloc[order].reset_index(drop=True)
+        gene_stats.write_gene_stats(canon, stats)
+    else:
+        gene_stats.build_gene_stats(canon)
+
+
+def append_version(db: Session, owner: User, ds: Dataset, upload: UploadFile) -> dict:
+    """
+    Append the samples or genes in `upload` to `ds` as a new version.
+    Raises ValueError when the dataset can't be appended to or the upload
+    doesn't extend it along exactly one axis.
+    """
+    canon = Path(ds.storage_path)
+    if not is_canonical(canon) or not canon.exists():
+        raise ValueError("Only datasets stored as a canonical parquet matrix can be appended to")
+
+    tmp_path, _ = save_upload(owner.id, upload)
+    try:
+        frag, samples = canonicalize(tmp_path)
+    except Exception as e:
+        tmp_path.unlink(missing_ok=True)
+        raise ValueError(f"Failed to read file: {e}")
+
+    with _lock(ds.id):
+        schema = pq.read_schema(canon)
+        try:
+            axis = _axis(_gene_ids(canon), schema.names[1:], frag)
+        except ValueError:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        versions = list_versions(ds)
+        number = versions[-1]["version"] + 1
+        vdir = canon.parent / "versions" / f"v{number}"
+        vdir.mkdir(parents=True, exist_ok=True)
+        write_gene_major(frag, vdir / "fragment.parquet")
+
+        old_sig = _signature(canon)
+        had_sample_major = sample_major_path(canon).exists()
+        tmp = canon.with_name(f"{canon.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            if axis == "samples":
+                _append_samples(canon, tmp, frag, old_sig, samples)
+            else:
+                _append_genes(canon, tmp, frag)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+        if had_sample_major:
+            try:
+                if write_sample_major(pd.read_parquet(canon), canon.parent) is None:
+                    sample_major_path(canon).unlink(missing_ok=True)
+            except Exception:
+                pass
+
+        if axis == "samples":
+            from app.services.view_service import restamp_views
+            try:
+                restamp_views(db, ds, old_sig)
+            except Exception:
+                db.rollback()
+        try:
+            gene_search.add_dataset(owner.id, ds.id, canon)
+        except Exception:
+            pass
+        try:
+            shutil.move(str(tmp_path), str(vdir / f"raw-{_safe_name(tmp_path.name)}"))
+        except Exception:
+            pass
+
+        meta = pq.ParquetFile(canon).metadata
+        n_rows, n_cols = meta.num_rows, meta.num_columns - 1
+        entry = {
+            "version": number,
+            "axis": axis,
+            "n_added": int(frag.shape[1] - 1 if axis == "samples" else len(frag)),
+            "fragment": f"versions/v{number}/fragment.parquet",
+            "source": upload.filename,
+            "n_rows": n_rows,
+            "n_cols": n_cols,
+            "created_at": _now(),
+        }
+        if axis == "samples":
+            entry["added"] = [str(c) for c in frag.columns[1:]]
+        _save_versions(ds, versions + [entry])
+
+        ds.n_rows = n_rows
+        ds.n_cols = n_cols
+        db.commit()
+        db.refresh(ds)
+    return entry
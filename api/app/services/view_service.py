@@ -0,0 +1,190 @@
+"""
+Saved filter views.
+
+A view's filters are evaluated once over the dataset file into a row
+bitmap (packed bits, zlib-compressed) stored at <dataset dir>/views/<id>.npz
+together with the file signature it was built from. Readers get the
+bitmap back as a boolean mask; when the dataset file changes the bitmap is
+rebuilt on next use.
+"""
+from __future__ import annotations
+
+import os
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.models import Dataset, SavedView
+
+
+def file_signature(path: str) -> str:
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def bitmap_path(ds: Dataset, view_id: int) -> Path:
+    return Path(ds.storage_path).parent / "views" / f"{view_id}.npz"
+
+
+def view_token(view: SavedView) -> str:
+    """Changes whenever the view's rows can change; use it in cache keys."""
+    return f"{view.id}:{view.source_signature}:{view.updated_at}"
+
+
+def _check_filters(ds: Dataset, filters: List[Dict[str, Any]]) -> None:
+    from app.utils.dataread import scan_any
+
+    cols = set(scan_any(ds.storage_path).collect_schema().names())
+    for f in filters:
+        col = f.get("column") or f.get("col")
+        if col not in cols:
+            raise ValueError(f"Unknown column '{col}' in view filters")
+        if f.get("op") not in ("==", "!=", "<", "<=", ">", ">=", "contains", "in", "between"):
+            raise ValueError(f"Unsupported filter op '{f.get('op')}'")
+
+
+def evaluate(ds: Dataset, filters: List[Dict[str, Any]]) -> np.ndarray:
+    """Boolean mask over the dataset's rows for `filters` (AND-ed)."""
+    import polars as pl
+    from app.utils.dataread import scan_any
+    from app.utils.filters import apply_filters_pl
+    from app.utils.catindex import load_index
+
+    ldf = scan_any(ds.storage_path).with_row_index("__row")
+    idx = (
+        apply_filters_pl(ldf, filters, index=load_index(ds.storage_path))
+        .select("__row").collect()["__row"].to_numpy()
+    )
+    total = ldf.select(pl.len()).collect().item()
+    mask = np.zeros(total, dtype=bool)
+    mask[idx] = True
+    return mask
+
+
+def _write_bitmap(path: Path, mask: np.ndarray, signature: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with tmp.open("wb") as f:
+        np.savez_compressed(f, bits=np.packbits(mask), n=np.int64(len(mask)), signature=np.asarray(signature))
+    os.replace(tmp, path)
+
+
+@lru_cache(maxsize=64)
+def _read_bitmap(path: str, mtime_ns: int):
+    with np.load(path) as z:
+        n = int(z["n"])
+        mask = np.unpackbits(z["bits"], count=n).astype(bool)
+        mask.flags.writeable = False
+        return mask, str(z["signature"])
+
+
+def materialize(db: Session, ds: Dataset, view: SavedView) -> np.ndarray:
+    signature = file_signature(ds.storage_path)
+    mask = evaluate(ds, view.filters_json or [])
+    _write_bitmap(bitmap_path(ds, view.id), mask, signature)
+    view.source_signature = signature
+    view.row_count = int(mask.sum())
+    view.total_rows = int(len(mask))
+    db.commit()
+    return mask
+
+
+def view_mask(db: Session, ds: Dataset, view: SavedView) -> np.ndarray:
+    """The view's row mask, rebuilt if the dataset file changed since it was stored."""
+    path = bitmap_path(ds, view.id)
+    signature = file_signature(ds.storage_path)
+    try:
+        mask, stored = _read_bitmap(str(path), path.stat().st_mtime_ns)
+    except (OSError, KeyError, ValueError):
+        stored = None
+    if stored != signature or view.source_signature != signature:
+        return materialize(db, ds, view)
+    return mask
+
+
+def restamp_views(db: Session, ds: Dataset, old_signature: str) -> int:
+    """
+    Carry the bitmaps built for `old_signature` over to the current file
+    after an append that only added sample columns (rows unchanged, so
+    filters on the old columns select the same rows).
+    """
+    signature = file_signature(ds.storage_path)
+    n = 0
+    for view in list_views(db, ds):
+        path = bitmap_path(ds, view.id)
+        try:
+            mask, stored = _read_bitmap(str(path), path.stat().st_mtime_ns)
+        except (OSError, KeyError, ValueError):
+            continue
+        if stored != old_signature or view.source_signature != old_signature:
+            continue
+        _write_bitmap(path, mask, signature)
+        view.source_signature = signature
+        n += 1
+    db.commit()
+    return n
+
+
+def get_view(db: Session, ds: Dataset, view_id: int) -> SavedView:
+    view = (
+        db.query(SavedView)
+        .filter(SavedView.id == view_id, SavedView.dataset_id == ds.id, SavedView.owner_id == ds.owner_id)
+        .first()
+    )
+    if not view:
+        raise ValueError("View not found")
+    return view
+
+
+def resolve_view(db: Session, ds: Dataset, view_id: int | None):
+    """(mask, token) for an optional view_id; (None, None) when no view is requested."""
+    if view_id is None:
+        return None, None
+    view = get_view(db, ds, int(view_id))
+    mask = view_mask(db, ds, view)
+    return mask, view_token(view)
+
+
+def list_views(db: Session, ds: Dataset) -> List[SavedView]:
+    return (
+        db.query(SavedView)
+        .filter(SavedView.dataset_id == ds.id, SavedView.owner_id == ds.owner_id)
+        .order_by(SavedView.name)
+        .all()
+    )
+
+
+def save_view(db: Session, ds: Dataset, name: str, filters: List[Dict[str, Any]], view: SavedView | None = None) -> SavedView:
+    """Create (or replace the filters of) a view and materialize its bitmap."""
+    _check_filters(ds, filters)
+    clash = (
+        db.query(SavedView)
+        .filter(SavedView.dataset_id == ds.id, SavedView.owner_id == ds.owner_id, SavedView.name == name)
+        .first()
+    )
+    if clash is not None and (view is None or clash.id != view.id):
+        raise ValueError(f"A view named '{name}' already exists")
+    if view is None:
+        view = SavedView(dataset_id=ds.id, owner_id=ds.owner_id, name=name, filters_json=filters)
+        db.add(view)
+        db.flush()
+    else:
+        view.name = name
+        view.filters_json = filters
+    try:
+        materialize(db, ds, view)
+    except Exception as e:
+        db.rollback()
+        raise ValueError(f"Could not evaluate view filters: {e}")
+    db.refresh(view)
+    return view
+
+
+def delete_view(db: Session, ds: Dataset, view: SavedView) -> None:
+    bitmap_path(ds, view.id).unlink(missing_ok=True)
+    db.delete(view)
+    db.commit()
@@ -1,7 +1,30 @@
 from cachetools import TTLCache
 from functools import lru_cache
 
-cache = TTLCache(maxsize=512, ttl=300)
+
+class _CountingTTLCache(TTLCache):
+    """TTLCache that reports lookups and evictions to app.metrics."""
+
+    def __contains__(self, key):
+        from app.metrics import CHART_CACHE
+        hit = super().__contains__(key)
+        CHART_CACHE.inc(result="hit" if hit else "miss")
+        return hit
+
+    def popitem(self):
+        from app.metrics import CHART_CACHE_EVICTIONS
+        CHART_CACHE_EVICTIONS.inc()
+        return super().popitem()
+
+    def expire(self, time=None):
+        from app.metrics import CHART_CACHE_EVICTIONS
+        expired = super().expire(time)
+        if expired:
+            CHART_CACHE_EVICTIONS.inc(len(expired))
+        return expired
+
+
+cache = _CountingTTLCache(maxsize=512, ttl=300)
 
 def make_key(dataset_id: int, payload: dict) -> str:
     import json, hashlib
@@ -0,0 +1,199 @@
+"""
+Dictionary encoding + per-value row bitmaps for categorical ("label") columns.
+
+Built at ingest next to the dataset file as <stem>.catidx.npz and rebuilt
+when the file's signature changes. Equality / inequality / membership
+filters on indexed columns become bitmap ANDs/ORs, and value counts are
+bitmap popcounts, so those requests never rescan or rehash the strings.
+"""
+from __future__ import annotations
+
+import json
+import os
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+INDEX_OPS = ("==", "!=", "in")
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+def index_path(path: str | Path) -> Path:
+    p = Path(path)
+    return p.with_name(f"{p.stem}.catidx.npz")
+
+
+def _signature(path: str | Path) -> str:
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def build_index(path: str | Path, df=None) -> Path:
+    """
+    Index every column guess_role() calls a "label" in the file at `path`
+    (or in `df`, its already-loaded contents). Always writes the index file,
+    possibly with no columns, so a missing index means "not built yet".
+    """
+    import pandas as pd
+    from app.utils.dataread import guess_role, read_table_any
+
+    if df is None:
+        df = read_table_any(str(path))
+    n = len(df)
+    arrays: Dict[str, np.ndarray] = {}
+    columns: Dict[str, dict] = {}
+    for i, col in enumerate(df.columns):
+        s = df[col]
+        if guess_role(s) != "label":
+            continue
+        codes, uniques = pd.factorize(s, sort=True)
+        key = f"c{i}"
+        k = len(uniques)
+        bits = np.zeros((k, (n + 7) // 8), dtype=np.uint8)
+        for j in range(k):
+            bits[j] = np.packbits(codes == j)
+        arrays[f"{key}_bits"] = bits
+        arrays[f"{key}_null"] = np.packbits(codes < 0)
+        columns[str(col)] = {
+            "key": key,
+            "values": [str(v) for v in uniques],
+            "counts": np.bincount(codes[codes >= 0], minlength=k).tolist(),
+            "nulls": int((codes < 0).sum()),
+        }
+
+    out = index_path(path)
+    meta = {"signature": _signature(path), "n_rows": n, "columns": columns}
+    tmp = out.with_name(f"{out.name}.{uuid.uuid4().hex}.tmp")
+    with tmp.open("wb") as f:
+        np.savez_compressed(f, meta=np.asarray(json.dumps(meta)), **arrays)
+    os.replace(tmp, out)
+    return out
+
+
+def restamp(path: str | Path, old_signature: str) -> bool:
+    """
+    Re-sign an index built for `old_signature` with the file's current
+    signature; for rewrites that only add numeric columns (rows unchanged).
+    """
+    out = index_path(path)
+    try:
+        with np.load(out) as z:
+            meta = json.loads(str(z["meta"]))
+            arrays = {k: z[k] for k in z.files if k != "meta"}
+    except (OSError, KeyError, ValueError):
+        return False
+    if meta.get("signature") != old_signature:
+        return False
+    meta["signature"] = _signature(path)
+    tmp = out.with_name(f"{out.name}.{uuid.uuid4().hex}.tmp")
+    with tmp.open("wb") as f:
+        np.savez_compressed(f, meta=np.asarray(json.dumps(meta)), **arrays)
+    os.replace(tmp, out)
+    return True
+
+
+class CategoricalIndex:
+    def __init__(self, meta: dict, arrays: Dict[str, np.ndarray]):
+        self.n_rows = int(meta["n_rows"])
+        self.columns = meta["columns"]
+        self._arrays = arrays
+        self._pos = {c: {v: j for j, v in enumerate(info["values"])} for c, info in self.columns.items()}
+
+    def has(self, col) -> bool:
+        return col in self.columns
+
+    def _bits(self, col) -> np.ndarray:
+        return self._arrays[f"{self.columns[col]['key']}_bits"]
+
+    def _unpack(self, packed: np.ndarray) -> np.ndarray:
+        return np.unpackbits(packed, count=self.n_rows).astype(bool)
+
+    def answers(self, f: Dict[str, Any]) -> bool:
+        col = f.get("column") or f.get("col")
+        op, val = f.get("op"), f.get("value")
+        if not self.has(col) or op not in INDEX_OPS:
+            return False
+        # polars would reject comparing a string column with a number; leave that to it
+        vals = val if op == "in" and isinstance(val, list) else [val]
+        return all(isinstance(v, str) for v in vals)
+
+    def mask(self, f: Dict[str, Any]) -> np.ndarray:
+        """Row mask for one filter accepted by answers(); nulls never match (as in polars)."""
+        col = f.get("column") or f.get("col")
+        op, val = f.get("op"), f.get("value")
+        bits, pos = self._bits(col), self._pos[col]
+        wanted = val if op == "in" and isinstance(val, list) else [val]
+        sel = [pos[v] for v in wanted if v in pos]
+        if op == "!=":
+            sel = [j for j in range(len(pos)) if j not in set(sel)]
+        packed = np.bitwise_or.reduce(bits[sel], axis=0) if sel else np.zeros(bits.shape[1], dtype=np.uint8)
+        return self._unpack(packed)
+
+    def value_counts(self, col, rows: Optional[np.ndarray] = None) -> List[Tuple[Optional[str], int]]:
+        """(value, count) pairs, nulls as None, largest first; `rows` restricts to a row mask."""
+        info = self.columns[col]
+        if rows is None:
+            counts = list(info["counts"])
+            nulls = info["nulls"]
+        else:
+            m = np.packbits(rows)
+            counts = _POPCOUNT[self._bits(col) & m].sum(axis=1).tolist()
+            nulls = int(_POPCOUNT[self._arrays[f"{info['key']}_null"] & m].sum())
+        pairs = list(zip(info["values"], counts))
+        if nulls:
+            pairs.append((None, nulls))
+        return sorted((p for p in pairs if p[1]), key=lambda p: -p[1])
+
+
+@lru_cache(maxsize=32)
+def _open(idx: str, mtime_ns: int) -> Tuple[str, CategoricalIndex]:
+    with np.load(idx) as z:
+        meta = json.loads(str(z["meta"]))
+        arrays = {k: z[k] for k in z.files if k != "meta"}
+    return meta["signature"], CategoricalIndex(meta, arrays)
+
+
+def load_index(path: str | Path, build: bool = True) -> Optional[CategoricalIndex]:
+    """The index for the file at `path`, (re)built when missing or stale if `build`."""
+    idx = index_path(path)
+    try:
+        sig = _signature(path)
+    except OSError:
+        return None
+    try:
+        stored, index = _open(str(idx), idx.stat().st_mtime_ns)
+        if stored == sig:
+            return index
+    except (OSError, KeyError, ValueError):
+        pass
+    if not build:
+        return None
+    try:
+        build_index(path)
+        return _open(str(idx), idx.stat().st_mtime_ns)[1]
+    except Exception:
+        return None
+
+
+def split_filters(index: Optional[CategoricalIndex], filters, rows: Optional[np.ndarray] = None):
+    """
+    (mask, remaining): AND of `rows` and every filter the index can answer,
+    or None when there is nothing to apply; `remaining` still needs a scan.
+    """
+    filters = list(filters or [])
+    mask = None if rows is None else np.asarray(rows, dtype=bool)
+    if index is None:
+        return mask, filters
+    if mask is not None and len(mask) != index.n_rows:
+        return mask, filters
+    rest = []
+    for f in filters:
+        if index.answers(f):
+            m = index.mask(f)
+            mask = m if mask is None else (mask & m)
+        else:
+            rest.append(f)
+    return mask, rest
@@ -0,0 +1,270 @@
+"""
+Whole-file column profiles.
+
+One streaming pass over the file in row batches (PROFILE_BATCH_ROWS),
+profiled in parallel (PROFILE_WORKERS): per column a null count, a
+distinct-count sketch, min/max, a t-digest for numeric columns and the
+inferred type. Partial profiles are merged and written next to the file
+as <stem>.profile.json with the file signature; /schema serves it and
+rebuilds it when the file changes. Ingest builds it ahead of time.
+"""
+from __future__ import annotations
+
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.config import settings
+from app.utils.dataread import role_from_stats
+from app.utils.sketches import DistinctCounter, TDigest, hash_values
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+_KIND_RANK = {"boolean": 0, "integer": 1, "number": 2, "datetime": 3, "string": 4}
+_DT_PROBE = 50
+
+
+def profile_path(path: str | Path) -> Path:
+    p = Path(path)
+    return p.with_name(f"{p.stem}.profile.json")
+
+
+def _signature(path: str | Path) -> str:
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def _batches(path: str | Path, df: Optional[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    size = settings.PROFILE_BATCH_ROWS
+    if df is not None:
+        for i in range(0, max(len(df), 1), size):
+            yield df.iloc[i:i + size]
+        return
+    ext = Path(path).suffix.lower()
+    if ext in (".parquet", ".pq"):
+        import pyarrow.parquet as pq
+        for rb in pq.ParquetFile(str(path)).iter_batches(batch_size=size):
+            yield rb.to_pandas()
+    elif ext in (".csv", ".tsv", ".txt"):
+        sep = "," if ext == ".csv" else ("\t" if ext == ".tsv" else None)
+        with pd.read_csv(path, sep=sep, chunksize=size, engine="python" if sep is None else "c") as reader:
+            yield from reader
+    else:
+        from app.utils.dataread import read_table_any
+        yield from _batches(path, read_table_any(str(path)))
+
+
+class _Column:
+    """Mergeable per-column state."""
+
+    def __init__(self):
+        self.rows = 0
+        self.nulls = 0
+        self.kind = "boolean"
+        self.text = False
+        self.dt_ok = True  # every non-null string seen so far parses as a datetime
+        self.distinct = DistinctCounter()
+        self.digest: Optional[TDigest] = None
+        self.min = None
+        self.max = None
+
+    def add(self, s: pd.Series) -> None:
+        self.rows += len(s)
+        notna = s.notna().to_numpy()
+        self.nulls += int(len(s) - notna.sum())
+        v = s[notna]
+        kind = _kind(s)
+        if kind == "string":
+            self.text = True
+            if self.dt_ok and len(v):
+                self.dt_ok = _all_datetimes(v)
+        self._widen(kind)
+        if not len(v):
+            return
+        if kind == "datetime":
+            arr = v.to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        elif kind in ("integer", "number", "boolean"):
+            arr = v.to_numpy(dtype=np.float64)
+        else:
+            arr = v.astype(str).to_numpy(dtype=object)
+        self.distinct.add_hashes(hash_values(arr))
+        if kind in ("integer", "number", "datetime"):
+            if self.digest is None:
+                self.digest = TDigest()
+            self.digest.add(arr.astype(np.float64))
+        if kind != "boolean":
+            lo, hi = arr.min(), arr.max()
+            self.min = lo if self.min is None else min(self.min, lo)
+            self.max = hi if self.max is None else max(self.max, hi)
+
+    def _widen(self, kind: str) -> None:
+        if _KIND_RANK[kind] > _KIND_RANK[self.kind]:
+            self.kind = kind
+
+    def merge(self, other: "_Column") -> None:
+        self.rows += other.rows
+        self.nulls += other.nulls
+        self.text = self.text or other.text
+        self.dt_ok = self.dt_ok and other.dt_ok
+        self._widen(other.kind)
+        self.distinct.merge(other.distinct)
+        if other.digest is not None:
+            if self.digest is None:
+                self.digest = TDigest()
+            self.digest.merge(other.digest)
+        for attr, pick in (("min", min), ("max", max)):
+            a, b = getattr(self, attr), getattr(other, attr)
+            if a is None or b is None:
+                setattr(self, attr, b if a is None else a)
+            elif type(a) is type(b) or not (isinstance(a, str) or isinstance(b, str)):
+                setattr(self, attr, pick(a, b))
+            else:
+                setattr(self, attr, pick(str(a), str(b)))
+
+
+def _kind(s: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(s):
+        return "boolean"
+    if pd.api.types.is_integer_dtype(s):
+        return "integer"
+    if pd.api.types.is_float_dtype(s):
+        return "number"
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return "datetime"
+    if s.notna().any():
+        return "string"
+    return "boolean"  # all-null batch: no evidence yet, lowest kind
+
+
+def _all_datetimes(v: pd.Series) -> bool:
+    # a cheap probe first so ordinary text columns never pay for a full parse
+    probe = v.iloc[:_DT_PROBE]
+    if pd.to_numeric(probe, errors="coerce").notna().all():
+        return False  # numbers stored as text, not dates
+    if pd.to_datetime(probe, errors="coerce", format="mixed").isna().any():
+        return False
+    return not pd.to_datetime(v, errors="coerce", format="mixed").isna().any()
+
+
+def _profile_batch(df: pd.DataFrame) -> Dict[str, _Column]:
+    out = {}
+    for col in df.columns:
+        c = _Column()
+        c.add(df[col])
+        out[str(col)] = c
+    return out
+
+
+def _scalar(v, kind: str):
+    if v is None:
+        return None
+    if kind == "datetime" and isinstance(v, (int, float, np.integer, np.floating)):
+        return pd.Timestamp(int(v)).isoformat()
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, float) and not np.isfinite(v):
+        return None
+    if kind == "integer" and isinstance(v, float):
+        return int(v)
+    return v
+
+
+def _finish(name: str, c: _Column) -> dict:
+    kind = c.kind
+    if kind == "string" and c.dt_ok and c.rows > c.nulls:
+        kind = "datetime"
+    distinct = c.distinct.count()
+    n = c.rows
+    out = {
+        "name": name,
+        "dtype": kind,
+        "missing": c.nulls,
+        "missing_pct": round(c.nulls / n * 100.0, 2) if n else 0.0,
+        "unique_count": distinct,
+        "unique_approx": c.distinct.approximate,
+        "role": role_from_stats(name, distinct, n, kind == "string"),
+        "min": _scalar(c.min, c.kind),
+        "max": _scalar(c.max, c.kind),
+    }
+    if c.digest is not None and c.kind in ("integer", "number"):
+        out["quantiles"] = {f"p{int(q * 100)}": c.digest.quantile(q) for q in QUANTILES}
+    return out
+
+
+def _profile(batches: Iterator[pd.DataFrame]) -> Tuple[int, list]:
+    """(rows, finished column profiles) of a stream of row batches."""
+    merged: Dict[str, _Column] = {}
+    columns: list = []
+    workers = max(1, settings.PROFILE_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+
+        def drain(limit: int):
+            while len(pending) > limit:
+                part = pending.pop(0).result()
+                for name, c in part.items():
+                    if name in merged:
+                        merged[name].merge(c)
+                    else:
+                        merged[name] = c
+                        columns.append(name)
+
+        for batch in batches:
+            pending.append(pool.submit(_profile_batch, batch))
+            drain(2 * workers)  # bounded read-ahead
+        drain(0)
+
+    rows = merged[columns[0]].rows if columns else 0
+    return rows, [_finish(name, merged[name]) for name in columns]
+
+
+def _store(path: str | Path, profile: dict) -> None:
+    out = profile_path(path)
+    tmp = out.with_name(f"{out.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_text(json.dumps(profile, default=str))
+    os.replace(tmp, out)
+
+
+def build_profile(path: str | Path, df: Optional[pd.DataFrame] = None) -> dict:
+    """Profile every column of the file at `path` (or `df`, its loaded contents) and store it."""
+    rows, columns = _profile(_batches(path, df))
+    profile = {"signature": _signature(path), "rows": rows, "columns": columns}
+    _store(path, profile)
+    return profile
+
+
+def extend_profile(path: str | Path, old_signature: str, added: pd.DataFrame) -> Optional[dict]:
+    """
+    Add the columns of `added` (new columns of the file, aligned to its
+    unchanged rows) to a profile built for `old_signature`, and re-sign it.
+    Returns None, leaving the profile to be rebuilt, when it was not current.
+    """
+    try:
+        profile = json.loads(profile_path(path).read_text())
+    except (OSError, ValueError):
+        return None
+    if profile.get("signature") != old_signature or profile.get("rows") != len(added):
+        return None
+    _, columns = _profile(_batches(path, added))
+    names = {c["name"] for c in columns}
+    profile["columns"] = [c for c in profile["columns"] if c["name"] not in names] + columns
+    profile["signature"] = _signature(path)
+    _store(path, profile)
+    return profile
+
+
+def load_profile(path: str | Path, build: bool = True) -> Optional[dict]:
+    """The stored profile for the file at `path`, (re)built when missing or stale if `build`."""
+    try:
+        sig = _signature(path)
+        profile = json.loads(profile_path(path).read_text())
+        if profile.get("signature") == sig:
+            return profile
+    except (OSError, ValueError):
+        pass
+    return build_profile(path) if build else None
@@ -0,0 +1,113 @@
+"""
+Response compression by size threshold (ASGI middleware).
+
+Complete bodies of at least COMPRESS_MIN_BYTES with a compressible media type
+are encoded with zstd (pyarrow's codec) when the client accepts it, else
+gzip. Streamed bodies are gzip-compressed chunk by chunk with a sync flush,
+so a stream keeps flowing; event streams and responses that already carry a
+Content-Encoding or Content-Range, or ask for Cache-Control: no-transform,
+are passed through untouched.
+"""
+from __future__ import annotations
+
+import gzip
+import zlib
+
+from app.config import settings
+
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "application/vnd.apache.arrow.stream")
+_SKIP = ("text/event-stream",)
+
+
+def _zstd(body: bytes) -> bytes | None:
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+    if not pa.Codec.is_available("zstd"):
+        return None
+    codec = pa.Codec("zstd", compression_level=settings.COMPRESS_ZSTD_LEVEL)
+    return codec.compress(body, asbytes=True)
+
+
+def _accepted(scope) -> set:
+    for name, value in scope.get("headers") or ():
+        if name == b"accept-encoding":
+            return {p.split(";")[0].strip() for p in value.decode("latin-1").lower().split(",")}
+    return set()
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int | None = None):
+        self.app = app
+        self.minimum_size = settings.COMPRESS_MIN_BYTES if minimum_size is None else minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accepted = _accepted(scope)
+        if not accepted & {"gzip", "zstd"}:
+            return await self.app(scope, receive, send)
+
+        state = {"start": None, "mode": None, "z": None}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body" or state["mode"] == "plain":
+                return await send(message)
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+
+            if state["mode"] is None:
+                start = state["start"]
+                headers = {k.lower(): v for k, v in start["headers"]}
+                ctype = headers.get(b"content-type", b"").decode("latin-1").lower()
+                eligible = (
+                    b"content-encoding" not in headers
+                    and b"content-range" not in headers
+                    and b"no-transform" not in headers.get(b"cache-control", b"").lower()
+                    and ctype.startswith(COMPRESSIBLE)
+                    and not ctype.startswith(_SKIP)
+                )
+                if not eligible or (not more and len(body) < self.minimum_size) or (more and "gzip" not in accepted):
+                    state["mode"] = "plain"
+                    await send(start)
+                    return await send(message)
+
+                if not more:
+                    encoding, out = None, None
+                    if "zstd" in accepted:
+                        out = _zstd(body)
+                        encoding = "zstd" if out is not None else None
+                    if out is None and "gzip" in accepted:
+                        out, encoding = gzip.compress(body, compresslevel=settings.COMPRESS_GZIP_LEVEL), "gzip"
+                    if out is None:
+                        state["mode"] = "plain"
+                        await send(start)
+                        return await send(message)
+                    await send(_with_encoding(start, encoding, len(out)))
+                    state["mode"] = "done"
+                    return await send({"type": "http.response.body", "body": out})
+
+                state["mode"] = "stream"
+                state["z"] = zlib.compressobj(settings.COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+                await send(_with_encoding(start, "gzip", None))
+
+            z = state["z"]
+            chunk = z.compress(body) + (z.flush(zlib.Z_SYNC_FLUSH) if more else z.flush())
+            await send({"type": "http.response.body", "body": chunk, "more_body": more})
+
+        await self.app(scope, receive, _send)
+
+
+def _with_encoding(start: dict, encoding: str, length: int | None) -> dict:
+    vary = [v for k, v in start["headers"] if k.lower() == b"vary"]
+    headers = [(k, v) for k, v in start["headers"] if k.lower() not in (b"content-length", b"vary")]
+    headers.append((b"content-encoding", encoding.encode()))
+    headers.append((b"vary", b", ".join(vary + [b"Accept-Encoding"])))
+    if length is not None:
+        headers.append((b"content-length", str(length).encode()))
+    return {**start, "headers": headers}
@@ -13,16 +13,22 @@ def read_table_any(path: str, nrows: int | None = None) -> pd.DataFrame:
         return pd.read_csv(path, sep=sep, **kwargs)
     elif ext in [".xls", ".xlsx"]:
         return pd.read_excel(path, engine="openpyxl", **kwargs)
+    elif ext in [".parquet", ".pq"]:
+        return pl.read_parquet(path, n_rows=nrows).to_pandas()
     else:
         raise ValueError(f"Unsupported file extension: {ext}")
 
 def guess_role(series: pd.Series) -> str:
-    name = (series.name or "").lower()
-    nunique = series.nunique(dropna=True)
-    n = len(series)
-    if "id" in name or (nunique > 0.9 * n and series.dtype == "object"):
+    # object on pandas 2, the dedicated string dtype on pandas 3
+    text = series.dtype == "object" or pd.api.types.is_string_dtype(series.dtype)
+    return role_from_stats(series.name, series.nunique(dropna=True), len(series), text)
+
+def role_from_stats(name, nunique: int, n: int, text: bool) -> str:
+    """guess_role() from precomputed column statistics (see app.utils.colprofile)."""
+    name = str(name or "").lower()
+    if "id" in name or (nunique > 0.9 * n and text):
         return "id"
-    if series.dtype == "object" and nunique <= 20:
+    if text and nunique <= 20:
         return "label"
     return "feature"
 
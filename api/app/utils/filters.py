@@ -1,6 +1,7 @@
 import polars as pl
 import json
 from typing import List, Dict, Any
+from app.utils.catindex import split_filters
 
 def _to_list(v):
     if isinstance(v, list): return v
@@ -11,7 +12,11 @@ def _to_list(v):
         pass
     return [v]
 
-def apply_filters(df: pl.DataFrame, filters: List[Dict[str, Any]] | None) -> pl.DataFrame:
+def apply_filters(df: pl.DataFrame, filters: List[Dict[str, Any]] | None, index=None, rows=None) -> pl.DataFrame:
+    """Eager counterpart of apply_filters_pl; same `index` / `rows` semantics."""
+    mask, filters = split_filters(index, filters, rows)
+    if mask is not None:
+        df = df.filter(pl.Series(mask))
     if not filters:
         return df
     exprs = []
@@ -43,7 +48,16 @@ from typing import List, Dict, Any
 def _to_list(v):
     return v if isinstance(v, list) else [v]
 
-def apply_filters_pl(ldf: pl.LazyFrame, filters: List[Dict[str, Any]] | None) -> pl.LazyFrame:
+def apply_filters_pl(ldf: pl.LazyFrame, filters: List[Dict[str, Any]] | None, index=None, rows=None) -> pl.LazyFrame:
+    """
+    AND the filters onto ldf. With a categorical `index` (app.utils.catindex),
+    equality/membership filters on indexed columns are answered from bitmaps;
+    `rows` is an extra row mask (e.g. a saved view). Both are positional, so
+    ldf must still have the file's rows in file order.
+    """
+    mask, filters = split_filters(index, filters, rows)
+    if mask is not None:
+        ldf = ldf.filter(pl.lit(pl.Series(mask)))
     if not filters:
         return ldf
     exprs = []
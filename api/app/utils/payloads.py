@@ -0,0 +1,149 @@
+"""
+Response encodings for array-shaped payloads (stats, chart points, previews).
+
+Handlers build a Frame -- named, equal-length columns (numpy arrays where
+possible) plus small JSON metadata -- and render() encodes it in the format
+the client asked for:
+
+  json      the endpoint's historical JSON shape (built by the handler's `legacy`)
+  columnar  {"columns": [...], "data": {name: [...]}, **meta}, numeric columns
+            serialized straight from their buffers by orjson
+  arrow     Arrow IPC stream; numeric columns are wrapped without a copy and
+            the metadata is stored as JSON in the schema metadata ("meta")
+  f32       the numeric columns as little-endian float32, column after column
+            (shape "rows,columns" in X-Shape, names in X-Columns, meta in X-Meta)
+
+The format comes from ?format= or, failing that, the Accept header.
+numpy/pyarrow are imported on use, so importing this module stays cheap.
+"""
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException, Request, Response
+
+FORMATS = ("json", "columnar", "arrow", "f32")
+FORMAT_PATTERN = "^(" + "|".join(FORMATS) + ")$"
+
+ARROW_MEDIA = "application/vnd.apache.arrow.stream"
+F32_MEDIA = "application/octet-stream"
+_ACCEPT = {
+    ARROW_MEDIA: "arrow",
+    F32_MEDIA: "f32",
+    "application/x-float32": "f32",
+    "application/vnd.geneeez.columnar+json": "columnar",
+}
+
+
+@dataclass
+class Frame:
+    columns: Dict[str, Any]
+    meta: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.columns)
+
+    @property
+    def n_rows(self) -> int:
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    @classmethod
+    def from_matrix(cls, names: List[str], mat, meta: Optional[dict] = None) -> "Frame":
+        """Square/2-D matrix as one column per matrix column (views, no copy)."""
+        return cls({str(n): mat[:, i] for i, n in enumerate(names)}, meta or {})
+
+    @classmethod
+    def from_pandas(cls, df, meta: Optional[dict] = None) -> "Frame":
+        return cls({str(c): df[c].to_numpy() for c in df.columns}, meta or {})
+
+
+def wanted_format(request: Request, fmt: Optional[str] = None) -> str:
+    if fmt:
+        return fmt
+    for part in request.headers.get("accept", "").split(","):
+        media = part.split(";")[0].strip().lower()
+        if media in _ACCEPT:
+            return _ACCEPT[media]
+    return "json"
+
+
+def _is_numeric(a) -> bool:
+    return getattr(a, "dtype", None) is not None and a.dtype.kind in "biuf"
+
+
+def _json_column(a):
+    if _is_numeric(a):
+        return a
+    import pandas as pd
+
+    s = pd.Series(a, dtype=object)
+    return s.where(pd.notnull(s), None).tolist()
+
+
+def _dumps(obj) -> bytes:
+    try:
+        import orjson
+    except ImportError:
+        return json.dumps(obj, default=lambda a: a.tolist()).encode()
+    # numpy buffers are serialized directly; NaN/inf become null
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def _columnar(frame: Frame) -> Response:
+    import numpy as np
+
+    data = {}
+    for name, a in frame.columns.items():
+        a = _json_column(a)
+        # orjson only takes contiguous native-endian arrays
+        data[name] = np.ascontiguousarray(a) if _is_numeric(a) else a
+    body = {**frame.meta, "columns": frame.names, "data": data}
+    return Response(_dumps(body), media_type="application/json")
+
+
+def _arrow(frame: Frame) -> Response:
+    import numpy as np
+    import pyarrow as pa
+
+    arrays = []
+    for a in frame.columns.values():
+        if _is_numeric(a):
+            arrays.append(pa.array(np.ascontiguousarray(a)))
+        else:
+            arrays.append(pa.array(list(_json_column(a)), from_pandas=True))
+    table = pa.Table.from_arrays(arrays, names=frame.names)
+    table = table.replace_schema_metadata({"meta": json.dumps(frame.meta, default=str)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as w:
+        w.write_table(table)
+    return Response(sink.getvalue().to_pybytes(), media_type=ARROW_MEDIA)
+
+
+def _f32(frame: Frame) -> Response:
+    import numpy as np
+
+    if not all(_is_numeric(a) for a in frame.columns.values()):
+        raise HTTPException(406, "format=f32 needs an all-numeric payload")
+    out = np.empty((len(frame.columns), frame.n_rows), dtype="<f4")
+    for i, a in enumerate(frame.columns.values()):
+        out[i] = a
+    headers = {
+        "X-Shape": f"{frame.n_rows},{len(frame.columns)}",
+        "X-Columns": json.dumps(frame.names),
+        "X-Meta": json.dumps(frame.meta, default=str),
+    }
+    return Response(out.tobytes(), media_type=F32_MEDIA, headers=headers)
+
+
+def render(frame: Frame, fmt: str, legacy: Callable[[Frame], Any]):
+    """The frame in `fmt`; "json" returns legacy(frame) for FastAPI to serialize."""
+    if fmt == "columnar":
+        return _columnar(frame)
+    if fmt == "arrow":
+        return _arrow(frame)
+    if fmt == "f32":
+        return _f32(frame)
+    return legacy(frame)
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import html
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from app.utils.rss import PeakRSS
+
+_current: ContextVar["Timeline | None"] = ContextVar("timeline", default=None)
+
+# CPU time, RSS and IO counters are per process, not per run: a span only
+# keeps them when no other Timeline was active in the process while it ran.
+_active = 0
+_epoch = 0
+_active_lock = threading.Lock()
+PROCESS_FIELDS = ("cpu_s", "peak_rss_bytes", "read_bytes", "write_bytes")
+
+
+def io_counters() -> tuple[int, int]:
+    """(bytes read, bytes written) by this process so far, from /proc/self/io."""
+    try:
+        vals = {}
+        with open("/proc/self/io") as f:
+            for line in f:
+                k, _, v = line.partition(":")
+                vals[k] = int(v)
+        return vals.get("rchar", 0), vals.get("wchar", 0)
+    except (OSError, ValueError):
+        return 0, 0
+
+
+class Timeline:
+    """
+    Ordered stage spans for one analytics run. Each span records wall time
+    and, when the run had the process to itself while it was open
+    ("exclusive"), process CPU time, peak RSS and bytes read/written; spans
+    that overlapped another run get null for those (they'd mix both runs).
+    `on_span(stage)` is called as each span opens (progress, cancellation).
+    """
+
+    def __init__(self, on_span=None):
+        self.spans: list[dict] = []
+        self._t0 = time.perf_counter()
+        self._on_span = on_span
+
+    @contextmanager
+    def span(self, stage: str):
+        if self._on_span is not None:
+            self._on_span(stage)
+        with _active_lock:
+            alone, epoch = _active <= 1, _epoch
+        r0, w0 = io_counters()
+        c0 = time.process_time()
+        t0 = time.perf_counter()
+        rec = {"stage": stage, "offset_s": round(t0 - self._t0, 6)}
+        rss = PeakRSS()
+        try:
+            with rss:
+                yield rec
+        except BaseException:
+            rec["error"] = True
+            raise
+        finally:
+            r1, w1 = io_counters()
+            with _active_lock:
+                exclusive = alone and _active <= 1 and _epoch == epoch
+            rec.update({
+                "wall_s": round(time.perf_counter() - t0, 6),
+                "exclusive": exclusive,
+                "cpu_s": round(time.process_time() - c0, 6),
+                "peak_rss_bytes": rss.peak,
+                "read_bytes": r1 - r0,
+                "write_bytes": w1 - w0,
+            })
+            if not exclusive:
+                rec.update(dict.fromkeys(PROCESS_FIELDS))
+            self.spans.append(rec)
+
+    @contextmanager
+    def activate(self):
+        global _active, _epoch
+        with _active_lock:
+            _active += 1
+            _epoch += 1
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+            with _active_lock:
+                _active -= 1
+
+    def summary(self) -> dict:
+        stages: dict[str, dict] = {}
+        for s in self.spans:
+            agg = stages.setdefault(s["stage"], {"wall_s": 0.0, "exclusive": True, "cpu_s": 0.0,
+                                                 "read_bytes": 0, "write_bytes": 0, "peak_rss_bytes": 0})
+            agg["wall_s"] = round(agg["wall_s"] + s["wall_s"], 6)
+            if not s["exclusive"]:
+                agg["exclusive"] = False
+                agg.update(dict.fromkeys(PROCESS_FIELDS))
+            if not agg["exclusive"]:
+                continue
+            agg["cpu_s"] = round(agg["cpu_s"] + s["cpu_s"], 6)
+            agg["read_bytes"] += s["read_bytes"]
+            agg["write_bytes"] += s["write_bytes"]
+            agg["peak_rss_bytes"] = max(agg["peak_rss_bytes"], s["peak_rss_bytes"])
+        return {
+            "total_wall_s": round(time.perf_counter() - self._t0, 6),
+            # cpu/rss/io are process-wide counters, kept only for exclusive spans
+            "process_fields": list(PROCESS_FIELDS),
+            "spans": self.spans,
+            "stages": stages,
+        }
+
+
+@contextmanager
+def span(stage: str):
+    """Record a stage on the active Timeline; a no-op outside a run."""
+    tl = _current.get()
+    if tl is None:
+        yield None
+        return
+    with tl.span(stage) as rec:
+        yield rec
+
+
+# ---------- sampling profiler ----------
+
+class SamplingProfiler:
+    """
+    Samples the calling thread's Python stack every `interval` seconds from a
+    background thread and counts collapsed stacks ("a;b;c" -> samples), the
+    input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def __enter__(self):
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def write_folded(self, path: Path) -> Path:
+        with path.open("w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+        return path
+
+    def write_svg(self, path: Path, width: int = 1200, row: int = 16) -> Path:
+        """Minimal static flamegraph (root at the bottom) from the collected stacks."""
+        root: dict = {"n": 0, "kids": {}}
+        for stack, n in self.stacks.items():
+            node = root
+            node["n"] += n
+            for fr in stack.split(";"):
+                node = node["kids"].setdefault(fr, {"n": 0, "kids": {}})
+                node["n"] += n
+
+        def depth(node):
+            return 1 + max((depth(k) for k in node["kids"].values()), default=0)
+
+        total = max(root["n"], 1)
+        height = (depth(root) + 1) * row
+        rects = []
+
+        def walk(node, name, x, level):
+            w = node["n"] / total * width
+            if w < 0.5:
+                return
+            y = height - (level + 1) * row
+            label = html.escape(name)
+            hue = 20 + (hash(name) % 40)
+            rects.append(
+                f'<g><title>{label} ({node["n"]} samples)</title>'
+                f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" fill="hsl({hue},80%,60%)"/>'
+                + (f'<text x="{x + 2:.1f}" y="{y + row - 4}" font-size="11">{label[: int(w / 7)]}</text>' if w > 30 else "")
+                + "</g>"
+            )
+            cx = x
+            for kname, kid in sorted(node["kids"].items()):
+                walk(kid, kname, cx, level + 1)
+                cx += kid["n"] / total * width
+
+        walk(root, "all", 0.0, 0)
+        path.write_text(
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'font-family="monospace">{"".join(rects)}</svg>'
+        )
+        return path
@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    _PAGE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE = 4096
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (0 when it can't be read)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        # ru_maxrss is the lifetime peak (KiB on Linux, bytes on macOS)
+        r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return r if r > 1 << 32 else r * 1024
+    return 0
+
+
+# one sampler thread per process, running while any PeakRSS window is open;
+# each sample raises the peak of every open window, so nested windows (spans
+# inside spans, a run inside a benchmark) don't each add a polling thread
+INTERVAL = 0.05
+_lock = threading.Lock()
+_windows: set = set()
+_sampler = None
+
+
+def _sample_loop():
+    global _sampler
+    while True:
+        time.sleep(INTERVAL)
+        rss = current_rss()
+        with _lock:
+            if not _windows:
+                _sampler = None
+                return
+            for w in _windows:
+                if rss > w.peak:
+                    w.peak = rss
+
+
+class PeakRSS:
+    """
+    Highest RSS seen while the block runs (`.peak`) and the RSS on entry
+    (`.start`), read from the shared process-wide sampler.
+    """
+
+    def __init__(self):
+        self.start = 0
+        self.peak = 0
+
+    def __enter__(self):
+        global _sampler
+        self.start = self.peak = current_rss()
+        with _lock:
+            _windows.add(self)
+            if _sampler is None:
+                _sampler = threading.Thread(target=_sample_loop, name="rss-sampler", daemon=True)
+                _sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        with _lock:
+            _windows.discard(self)
+        self.peak = max(self.peak, current_rss())
+        return False
@@ -0,0 +1,132 @@
+"""
+Mergeable streaming sketches for column profiling.
+
+DistinctCounter keeps exact 64-bit value hashes up to EXACT_LIMIT and then
+switches to a HyperLogLog (2**P registers, ~0.8% standard error).
+TDigest keeps a bounded set of weighted centroids for quantiles, denser in
+the tails. Both are vectorised over numpy arrays and merge, so partial
+sketches from parallel batches combine into the sketch of the whole file.
+"""
+from __future__ import annotations
+
+import math
+
+import numpy as np
+import pandas as pd
+
+P = 14
+M = 1 << P
+EXACT_LIMIT = 4096
+
+
+def hash_values(values) -> np.ndarray:
+    """uint64 hashes of non-null values (same value -> same hash across batches)."""
+    return pd.util.hash_array(np.asarray(values), categorize=False)
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    """Exact bit length of uint64 values (float64 is exact on 32-bit halves)."""
+    hi = (x >> np.uint64(32)).astype(np.float64)
+    lo = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    with np.errstate(divide="ignore"):
+        bl_hi = np.where(hi > 0, np.floor(np.log2(hi)) + 1, 0)
+        bl_lo = np.where(lo > 0, np.floor(np.log2(lo)) + 1, 0)
+    return np.where(hi > 0, 32 + bl_hi, bl_lo).astype(np.int64)
+
+
+class DistinctCounter:
+    def __init__(self):
+        self.exact = np.empty(0, dtype=np.uint64)
+        self.registers = None
+
+    @property
+    def approximate(self) -> bool:
+        return self.registers is not None
+
+    def add_hashes(self, h: np.ndarray) -> None:
+        if not len(h):
+            return
+        if self.registers is None:
+            self.exact = np.union1d(self.exact, h)
+            if len(self.exact) <= EXACT_LIMIT:
+                return
+            h, self.exact = self.exact, np.empty(0, dtype=np.uint64)
+            self.registers = np.zeros(M, dtype=np.uint8)
+        idx = (h >> np.uint64(64 - P)).astype(np.int64)
+        w = h << np.uint64(P)
+        rho = np.minimum(64 - _bit_length(w) + 1, 64 - P + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rho)
+
+    def merge(self, other: "DistinctCounter") -> None:
+        if other.registers is None:
+            self.add_hashes(other.exact)
+            return
+        if self.registers is None:
+            exact = self.exact
+            self.exact, self.registers = np.empty(0, dtype=np.uint64), other.registers.copy()
+            self.add_hashes(exact)
+        else:
+            np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        if self.registers is None:
+            return int(len(self.exact))
+        alpha = 0.7213 / (1 + 1.079 / M)
+        est = alpha * M * M / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int((self.registers == 0).sum())
+        if est <= 2.5 * M and zeros:
+            est = M * math.log(M / zeros)  # linear counting for the small range
+        return int(round(est))
+
+
+class TDigest:
+    def __init__(self, compression: float = 200.0):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def add(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._compress(np.concatenate([self.means, values]),
+                       np.concatenate([self.weights, np.ones(len(values))]))
+
+    def merge(self, other: "TDigest") -> None:
+        if not len(other.means):
+            return
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        self._compress(np.concatenate([self.means, other.means]),
+                       np.concatenate([self.weights, other.weights]))
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray) -> None:
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        q = (np.cumsum(weights) - weights / 2) / total
+        # k1 scale function: centroid size shrinks towards q = 0 and q = 1
+        k = self.compression / (2 * math.pi) * np.arcsin(np.clip(2 * q - 1, -1, 1))
+        group = np.floor(k - k[0]).astype(np.int64)
+        w = np.bincount(group, weights=weights)
+        keep = w > 0
+        self.means = (np.bincount(group, weights=weights * means)[keep]) / w[keep]
+        self.weights = w[keep]
+
+    def quantile(self, q: float) -> float | None:
+        if not len(self.means):
+            return None
+        if len(self.means) == 1:
+            return float(self.means[0])
+        centres = np.cumsum(self.weights) - self.weights / 2
+        xs = np.concatenate([[0.0], centres, [self.count]])
+        ys = np.concatenate([[self.min], self.means, [self.max]])
+        return float(np.interp(q * self.count, xs, ys))
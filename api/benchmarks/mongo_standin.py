@@ -0,0 +1,89 @@
+"""
+In-process stand-in for the few pymongo calls the API makes, so benchmarks
+run without a Mongo server. Filters are exact matches on top-level fields.
+"""
+from __future__ import annotations
+
+import copy
+from typing import Any, Dict, List
+
+
+def _matches(doc: dict, flt: dict) -> bool:
+    return all(doc.get(k) == v for k, v in (flt or {}).items())
+
+
+def _project(doc: dict, projection: dict | None) -> dict:
+    out = copy.deepcopy(doc)
+    if projection and projection.get("_id") == 0:
+        out.pop("_id", None)
+    return out
+
+
+class _Result:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+class Collection:
+    def __init__(self):
+        self.docs: List[Dict[str, Any]] = []
+        self._next_id = 1
+
+    def find_one(self, flt: dict | None = None, projection: dict | None = None):
+        for d in self.docs:
+            if _matches(d, flt):
+                return _project(d, projection)
+        return None
+
+    def find(self, flt: dict | None = None, projection: dict | None = None):
+        return [_project(d, projection) for d in self.docs if _matches(d, flt)]
+
+    def insert_one(self, doc: dict):
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", self._next_id)
+        self._next_id += 1
+        self.docs.append(doc)
+        return _Result(inserted_id=doc["_id"])
+
+    def update_one(self, flt: dict, update: dict, upsert: bool = False):
+        for d in self.docs:
+            if _matches(d, flt):
+                d.update(copy.deepcopy(update.get("$set", {})))
+                return _Result(matched_count=1, upserted_id=None)
+        if upsert:
+            doc = {**copy.deepcopy(flt), **copy.deepcopy(update.get("$set", {}))}
+            return _Result(matched_count=0, upserted_id=self.insert_one(doc).inserted_id)
+        return _Result(matched_count=0, upserted_id=None)
+
+    def delete_many(self, flt: dict | None = None):
+        before = len(self.docs)
+        self.docs = [d for d in self.docs if not _matches(d, flt)]
+        return _Result(deleted_count=before - len(self.docs))
+
+    def count_documents(self, flt: dict | None = None) -> int:
+        return sum(1 for d in self.docs if _matches(d, flt))
+
+
+class Database:
+    def __init__(self):
+        self._collections: Dict[str, Collection] = {}
+
+    def __getattr__(self, name: str) -> Collection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._collections.setdefault(name, Collection())
+
+    __getitem__ = __getattr__
+
+    def clear(self) -> None:
+        self._collections.clear()
+
+
+def install() -> Database:
+    """Point app.mongo.get_mongo() at a fresh in-memory database."""
+    from app import mongo
+
+    db = Database()
+    mongo._client = object()
+    mongo._db = db
+    return db
@@ -0,0 +1,280 @@
+"""
+Benchmark harness for ingest, read endpoints, charts, stats and recipes.
+
+    cd api
+    python -m benchmarks.run --scales xs,small --shapes geo,csv --repeat 3 --out bench.json
+
+Runs offline in a temporary working directory against SQLite and an
+in-memory Mongo stand-in. Writes one JSON record per (scale, shape, op)
+with wall times and peak RSS so results can be diffed across commits.
+Every repeat starts from cold caches (see clear_caches). Exits with status
+1 when any op failed.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+API_ROOT = Path(__file__).resolve().parents[1]
+if str(API_ROOT) not in sys.path:
+    sys.path.insert(0, str(API_ROOT))
+
+from benchmarks.synth import SCALES, SHAPES, wide_matrix, write_shape  # noqa: E402
+
+# (recipe, params, shape of the dataset to run on; None = the read-path dataset).
+# DE needs sample groups, which only the GEO shape carries (its sample table).
+RECIPES = [
+    ("correlation", {"axis": "samples", "max_n": 300}, None),
+    ("correlation", {"axis": "genes", "max_n": 300}, None),
+    ("pca", {"n_components": 10, "top_genes": 1000}, None),
+    ("heatmap", {"top_genes": 1000}, None),
+    ("de", {"group_col": "group"}, "geo"),
+]
+
+
+def _setup_env(work: Path) -> None:
+    # must run before anything under app/ is imported (settings read env at import)
+    (work / "storage").mkdir(parents=True, exist_ok=True)
+    os.environ["DATABASE_URL"] = f"sqlite:///{work / 'bench.db'}"
+    os.environ["STORAGE_DIR"] = str(work / "storage")
+    os.environ["UPLOAD_DIR"] = str(work / "uploads")
+    os.chdir(work)
+
+
+def _git_rev() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=API_ROOT, capture_output=True, text=True, timeout=10
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _measure(fn, repeat: int, reset=None) -> dict:
+    from app.utils.rss import PeakRSS
+
+    times, peak, delta = [], 0, 0
+    error = None
+    for _ in range(repeat):
+        if reset:
+            reset()
+        with PeakRSS() as rss:
+            t0 = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            elapsed = time.perf_counter() - t0
+        times.append(elapsed)
+        peak = max(peak, rss.peak)
+        delta = max(delta, rss.peak - rss.start)
+        if error:
+            break
+    return {
+        "status": "error" if error else "ok",
+        "error": error,
+        "times_s": [round(t, 6) for t in times],
+        "min_s": round(min(times), 6),
+        "median_s": round(statistics.median(times), 6),
+        "peak_rss_bytes": peak,
+        "rss_delta_bytes": delta,
+    }
+
+
+def _ok(resp):
+    if resp.status_code >= 400:
+        raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+    return resp
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scales", default="xs,small", help=f"comma list of {','.join(SCALES)}")
+    ap.add_argument("--shapes", default=",".join(SHAPES), help=f"comma list of {','.join(SHAPES)}")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="-", help="output JSON path ('-' for stdout)")
+    ap.add_argument("--keep", action="store_true", help="keep the temporary working directory")
+    args = ap.parse_args(argv)
+
+    scales = [s for s in args.scales.split(",") if s]
+    shapes = [s for s in args.shapes.split(",") if s]
+    for s in scales:
+        if s not in SCALES:
+            ap.error(f"unknown scale {s!r}")
+    for s in shapes:
+        if s not in SHAPES:
+            ap.error(f"unknown shape {s!r}")
+    out_path = None if args.out == "-" else Path(args.out).resolve()
+
+    work = Path(tempfile.mkdtemp(prefix="geneeez-bench-"))
+    _setup_env(work)
+
+    from benchmarks import mongo_standin
+    mongo = mongo_standin.install()
+
+    from fastapi.testclient import TestClient
+    import main as api_main
+    import numpy as np
+    import pandas as pd
+    import polars as pl
+    from app.db import SessionLocal, init_db
+    from app.models import Dataset, User
+    from app.security import sign_access
+    from app.services.analysis_service import create_run
+    from app.services.analytics_exec import execute_inline
+    from app.services.dataset_service import persist_canonical
+    from app.services import residency, stage_cache
+    from app.utils.cache import cache as chart_cache
+
+    init_db()
+    db = SessionLocal()
+    user = User(email="bench@example.com", password_hash="-")
+    db.add(user); db.commit(); db.refresh(user)
+    headers = {"Authorization": f"Bearer {sign_access(user)}"}
+    client = TestClient(api_main.app)
+
+    def clear_caches():
+        # every repeat starts cold: drop the in-process caches and the on-disk
+        # derived data (stage results, clustering orderings, float32 mmaps)
+        chart_cache.clear()
+        mongo.clear()
+        stage_cache.clear_memory()
+        residency.clear()
+        for d in ("stages", "orderings"):
+            shutil.rmtree(work / "storage" / d, ignore_errors=True)
+        for f in (work / "uploads").rglob("*.f32.*"):
+            f.unlink(missing_ok=True)
+
+    results = []
+
+    def record(scale, shape, op, res, **extra):
+        n_genes, n_samples = SCALES[scale]
+        results.append({"scale": scale, "n_genes": n_genes, "n_samples": n_samples,
+                        "shape": shape, "op": op, **extra, **res})
+        print(f"[bench] {scale:>6} {shape:>9} {op:<28} {res['status']:<5} "
+              f"median={res['median_s']:.4f}s peak={res['peak_rss_bytes'] / 2**20:.0f}MiB",
+              file=sys.stderr)
+
+    try:
+        for scale in scales:
+            n_genes, n_samples = SCALES[scale]
+            df = wide_matrix(n_genes, n_samples, seed=args.seed)
+            inputs = work / "inputs" / scale
+            bench_ds = None
+            by_shape = {}
+
+            for shape in shapes:
+                src = write_shape(df, shape, inputs)
+                ds = Dataset(title=f"bench-{scale}-{shape}", storage_path=str(src),
+                             original_filename=src.name, owner_id=user.id)
+                db.add(ds); db.commit(); db.refresh(ds)
+
+                incoming = work / "uploads" / str(user.id) / "_incoming"
+                incoming.mkdir(parents=True, exist_ok=True)
+                tmp = incoming / src.name
+                out = {}
+
+                def ingest():
+                    out["canon"], out["n_rows"], out["n_cols"] = persist_canonical(user.id, ds.id, tmp)
+
+                res = _measure(ingest, args.repeat, reset=lambda: shutil.copy(src, tmp))
+                record(scale, shape, "persist_canonical", res, input_bytes=src.stat().st_size)
+                if res["status"] != "ok":
+                    continue
+                ds.storage_path = str(out["canon"])
+                ds.n_rows, ds.n_cols = out["n_rows"], out["n_cols"]
+                db.commit()
+                by_shape[shape] = ds
+                if bench_ds is None or shape == "csv":
+                    bench_ds = ds
+
+            if bench_ds is None:
+                continue
+
+            # read paths only depend on the canonical matrix, so run them once per scale
+            ds, base = bench_ds, f"/datasets/{bench_ds.id}"
+            canon = pd.read_parquet(ds.storage_path) if ds.storage_path.endswith(".parquet") \
+                else pd.read_csv(ds.storage_path)
+            s0, s1 = str(canon.columns[1]), str(canon.columns[2 if canon.shape[1] > 2 else 1])
+            genes = canon["gene_id"].astype(str).sample(n=min(20, len(canon)), random_state=0).tolist()
+            numeric_cols = [str(c) for c in canon.columns[1:51]]
+            del canon
+
+            http_ops = [
+                ("preview", lambda: _ok(client.get(f"{base}/preview?rows=50", headers=headers))),
+                ("schema", lambda: _ok(client.get(f"{base}/schema", headers=headers))),
+                ("genes[20]", lambda: _ok(client.get(f"{base}/genes?ids={','.join(genes)}", headers=headers))),
+                ("chart:hist", lambda: _ok(client.post(f"{base}/chart", json={"kind": "hist", "x": s0, "bins": 30}, headers=headers))),
+                ("chart:bar", lambda: _ok(client.post(f"{base}/chart", json={"kind": "bar", "x": "gene_id"}, headers=headers))),
+                ("chart:line", lambda: _ok(client.post(f"{base}/chart", json={"kind": "line", "x": s0, "y": s1}, headers=headers))),
+                ("chart:scatter", lambda: _ok(client.post(f"{base}/chart", json={"kind": "scatter", "x": s0, "y": s1}, headers=headers))),
+                ("stats:corr", lambda: _ok(client.post(f"{base}/stats/corr", json={"columns": numeric_cols}, headers=headers))),
+                ("stats:pca", lambda: _ok(client.post(f"{base}/stats/pca", json={"n_components": 2}, headers=headers))),
+            ]
+            for op, fn in http_ops:
+                record(scale, "canonical", op, _measure(fn, args.repeat, reset=clear_caches))
+
+            for recipe_key, params, on in RECIPES:
+                target = by_shape.get(on) if on else ds
+                label = f"recipe:{recipe_key}" + (f"[{params['axis']}]" if "axis" in params else "")
+                if target is None:
+                    print(f"[bench] {scale:>6} {label}: skipped, needs --shapes {on}", file=sys.stderr)
+                    continue
+
+                def recipe(recipe_key=recipe_key, params=params, target=target):
+                    run = create_run(db, dataset=target, user_id=user.id, recipe_key=recipe_key,
+                                     params=params, cache_key="bench")
+                    execute_inline(db, run, target)
+
+                record(scale, on or "canonical", label, _measure(recipe, args.repeat, reset=clear_caches),
+                       params=params)
+    finally:
+        db.close()
+        os.chdir(API_ROOT)
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_rev": _git_rev(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "polars": pl.__version__,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "scales": {s: list(SCALES[s]) for s in scales},
+            "shapes": shapes,
+            "workdir": str(work) if args.keep else None,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if out_path:
+        out_path.write_text(text)
+    else:
+        print(text)
+    failed = [f"{r['scale']}/{r['shape']}/{r['op']}" for r in results if r["status"] != "ok"]
+    if failed:
+        print(f"[bench] {len(failed)} op(s) failed: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
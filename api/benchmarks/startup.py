@@ -0,0 +1,103 @@
+"""
+Import-time budgets for the API process.
+
+    cd api
+    python -m benchmarks.startup --out startup.json
+
+Each target is imported in a fresh interpreter (best of --repeat). A target
+fails when it exceeds its budget or pulls in a module from HEAVY that
+should only load on first use. Exit status is 1 on any failure.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+API_ROOT = Path(__file__).resolve().parents[1]
+
+# seconds; generous enough for CI machines, tight enough to catch an eager import
+BUDGETS = {
+    "main": 1.5,
+    "app.routers.auth": 1.0,
+    "app.routers.analysis": 1.2,
+    "app.routers.datasets": 1.2,
+    "app.routers.recipes": 1.2,
+    "app.routers.stats": 1.2,
+    "app.services.analytics_exec": None,  # worker-side, tracked but unbudgeted
+    "app.services.warmup:preload": None,
+}
+
+HEAVY = ("pandas", "numpy", "polars", "pyarrow", "matplotlib", "sklearn", "scipy", "pymongo", "psycopg")
+WORKER_SIDE = {"app.services.analytics_exec", "app.services.warmup:preload"}
+
+_PROBE = r"""
+import json, sys, time
+target = sys.argv[1]
+mod, _, fn = target.partition(":")
+t0 = time.perf_counter()
+m = __import__(mod, fromlist=["_"])
+if fn:
+    getattr(m, fn)()
+elapsed = time.perf_counter() - t0
+print(json.dumps({"seconds": elapsed, "heavy": [h for h in sys.argv[2:] if h in sys.modules]}))
+"""
+
+
+def _probe(target: str, workdir: Path) -> dict:
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", "sqlite://")
+    env["PYTHONPATH"] = str(API_ROOT) + os.pathsep + env.get("PYTHONPATH", "")
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE, target, *HEAVY],
+        cwd=workdir, env=env, capture_output=True, text=True, timeout=300,
+    )
+    if out.returncode != 0:
+        return {"error": out.stderr.strip().splitlines()[-1] if out.stderr else f"exit {out.returncode}"}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--out", default="-")
+    args = ap.parse_args(argv)
+
+    workdir = Path(tempfile.mkdtemp(prefix="geneeez-startup-"))
+    (workdir / "storage").mkdir()
+
+    results, failed = [], False
+    for target, budget in BUDGETS.items():
+        runs = [_probe(target, workdir) for _ in range(args.repeat)]
+        errors = [r["error"] for r in runs if "error" in r]
+        ok_runs = [r for r in runs if "error" not in r]
+        best = min((r["seconds"] for r in ok_runs), default=None)
+        heavy = sorted({h for r in ok_runs for h in r["heavy"]})
+        problems = []
+        if errors:
+            problems.append(errors[0])
+        if budget is not None and best is not None and best > budget:
+            problems.append(f"{best:.3f}s over budget {budget:.3f}s")
+        if target not in WORKER_SIDE and heavy:
+            problems.append(f"eagerly imports {', '.join(heavy)}")
+        failed |= bool(problems)
+        results.append({"target": target, "best_s": None if best is None else round(best, 4),
+                        "budget_s": budget, "heavy_modules": heavy, "ok": not problems,
+                        "problems": problems})
+        print(f"[startup] {target:<32} {'-' if best is None else f'{best:.3f}s':>8} "
+              f"{'ok' if not problems else '; '.join(problems)}", file=sys.stderr)
+
+    text = json.dumps({"python": sys.version.split()[0], "results": results}, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        Path(args.out).write_text(text)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Deterministic synthetic expression datasets in every input shape that
+dataset_service._read_any accepts.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+SCALES: Dict[str, Tuple[int, int]] = {
+    "xs":     (1_000, 10),
+    "small":  (5_000, 50),
+    "medium": (20_000, 200),
+    "large":  (60_000, 500),
+    "xl":     (60_000, 2_000),
+}
+
+SHAPES = ("geo", "long", "csv", "parquet", "xlsx")
+
+TISSUES = ("liver", "lung", "brain", "kidney")
+
+
+def wide_matrix(n_genes: int, n_samples: int, seed: int = 0) -> pd.DataFrame:
+    """gene_id + one lognormal column per sample (two groups with a shifted block of genes)."""
+    rng = np.random.default_rng(seed)
+    values = rng.lognormal(mean=2.0, sigma=1.0, size=(n_genes, n_samples)).astype(np.float64)
+    shifted = max(1, n_genes // 20)
+    values[:shifted, n_samples // 2:] *= 2.0
+    genes = [f"ENSG{i:011d}" for i in range(n_genes)]
+    rng.shuffle(genes)
+    df = pd.DataFrame(values, columns=sample_ids(n_samples))
+    df.insert(0, "gene_id", genes)
+    return df
+
+
+def sample_ids(n_samples: int) -> list[str]:
+    return [f"GSM{i:07d}" for i in range(n_samples)]
+
+
+def _write_geo(df: pd.DataFrame, path: Path) -> None:
+    samples = list(df.columns[1:])
+    n = len(samples)
+    with path.open("w") as f:
+        f.write('!Series_title\t"synthetic benchmark series"\n')
+        f.write('!Series_geo_accession\t"GSE000000"\n')
+        f.write("!Sample_title\t" + "\t".join(f'"sample {i}"' for i in range(n)) + "\n")
+        f.write("!Sample_geo_accession\t" + "\t".join(f'"{s}"' for s in samples) + "\n")
+        f.write("!Sample_characteristics_ch1\t"
+                + "\t".join(f'"group: {"case" if i >= n // 2 else "control"}"' for i in range(n)) + "\n")
+        f.write("!Sample_characteristics_ch1\t"
+                + "\t".join(f'"tissue: {TISSUES[i % len(TISSUES)]}"' for i in range(n)) + "\n")
+        f.write("!series_matrix_table_begin\n")
+        df.rename(columns={"gene_id": "ID_REF"}).to_csv(f, sep="\t", index=False)
+        f.write("!series_matrix_table_end\n")
+
+
+def _write_long(df: pd.DataFrame, path: Path) -> None:
+    long = df.melt(id_vars="gene_id", var_name="sample_id", value_name="value")
+    long.to_csv(path, index=False)
+
+
+def write_shape(df: pd.DataFrame, shape: str, out_dir: Path) -> Path:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if shape == "geo":
+        path = out_dir / "series_matrix.txt"
+        _write_geo(df, path)
+    elif shape == "long":
+        path = out_dir / "long.csv"
+        _write_long(df, path)
+    elif shape == "csv":
+        path = out_dir / "wide.csv"
+        df.to_csv(path, index=False)
+    elif shape == "parquet":
+        path = out_dir / "wide.parquet"
+        df.to_parquet(path, index=False)
+    elif shape == "xlsx":
+        path = out_dir / "wide.xlsx"
+        df.to_excel(path, index=False, engine="openpyxl")
+    else:
+        raise ValueError(f"Unknown shape: {shape}")
+    return path
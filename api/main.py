@@ -2,13 +2,13 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
 from app.db import init_db
-from app.routers import auth, datasets, analysis, recipes, stats
-from fastapi.staticfiles import StaticFiles
+from app.routers import auth, datasets, analysis, recipes, stats, files, storage
+from fastapi.responses import PlainTextResponse
+from app.metrics import MetricsMiddleware, render as render_metrics
+from app.utils.compression import CompressionMiddleware
 
 app = FastAPI(title="geneeez-api")
 
-app.mount("/files", StaticFiles(directory="storage", html=False), name="files")
-
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[settings.FRONTEND_ORIGIN],
@@ -16,6 +16,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
@@ -28,14 +30,29 @@ app.include_router(recipes.router, tags=["recipes"])
 
 app.include_router(stats.router, tags=["stats"])
 
+app.include_router(files.router, tags=["files"])
+
+app.include_router(storage.router, tags=["storage"])
+
 
 @app.get("/health")
 def health():
     return {"ok": True, "service": "geneeez-api"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.on_event("startup")
 def _startup():
     init_db()
+    if settings.ANALYTICS_PRELOAD:
+        from app.services.warmup import preload
+        preload()
+    from app.services import run_queue, storage_gc
+    run_queue.recover()
+    storage_gc.start()
 
 
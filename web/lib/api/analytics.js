@@ -16,3 +16,13 @@ export async function getRun(runId) {
   const { data } = await api.get(`/analytics/runs/${runId}`);
   return data;
 }
+
+export async function rebuildRun(runId) {
+  const { data } = await api.post(`/analytics/runs/${runId}/rebuild`);
+  return data;
+}
+
+export async function getStorageUsage() {
+  const { data } = await api.get(`/storage/usage`);
+  return data;
+}
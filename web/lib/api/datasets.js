@@ -17,6 +17,21 @@ export async function uploadDataset({ title, description, file }) {
   return data;
 }
 
+export async function appendToDataset(id, file) {
+  const fd = new FormData();
+  fd.append("file", file);
+
+  const { data } = await api.post(`/datasets/${id}/append`, fd, {
+    headers: { "Content-Type": "multipart/form-data" },
+  });
+  return data;
+}
+
+export async function getDatasetVersions(id) {
+  const { data } = await api.get(`/datasets/${id}/versions`);
+  return data;
+}
+
 export async function deleteDataset(id) {
   const { data } = await api.delete(`/datasets/${id}`);
   return data;
@@ -45,3 +60,30 @@ export async function downloadDataset(
   });
   return resp.data;
 }
+
+export async function getDatasetTable(
+  id,
+  { offset = 0, limit = 100, sort, desc = false, columns = [], colOffset = 0, colLimit = 200, cursor } = {}
+) {
+  const params = { offset, limit, desc, col_offset: colOffset, col_limit: colLimit };
+  if (sort) params.sort = sort;
+  if (columns.length) params.columns = columns.join(",");
+  if (cursor) params.cursor = cursor;
+  const { data } = await api.get(`/datasets/${id}/table`, { params });
+  return data;
+}
+
+export async function searchGenes(q, limit = 20) {
+  const { data } = await api.get(`/genes/search`, { params: { q, limit } });
+  return data;
+}
+
+export async function getGeneExpression(geneId) {
+  const { data } = await api.get(`/genes/${encodeURIComponent(geneId)}/expression`);
+  return data;
+}
+
+export async function getDatasetSamples(id) {
+  const { data } = await api.get(`/datasets/${id}/samples`);
+  return data;
+}